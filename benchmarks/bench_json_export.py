@@ -0,0 +1,95 @@
+""" Time a full gmeta export of synthetic records with the default JSON, and compact JSON with each installed library, and encoding the entries alone
+
+Run from the top of the repository: python benchmarks/bench_json_export.py [--records N]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "tests"))
+
+from harvester.DBInterface import DBInterface
+from harvester.Exporter import Exporter
+from harvester.JSONSerializer import JSONSerializer
+from helpers import ListLogger, add_repository, make_records
+
+
+def installed_backends():
+	backends = []
+	for backend in JSONSerializer.backends:
+		try:
+			JSONSerializer(backend)
+			backends.append(backend)
+		except ValueError:
+			pass
+	return backends
+
+
+def load_records(db, count):
+	repo_id = add_repository(db)
+	db.load_identity_map(repo_id)
+	db.set_bulk_mode(True)
+	for start in range(0, count, 5000):
+		db.write_records(make_records(min(5000, count - start), start=start), repo_id, "oai_dc")
+	db.set_bulk_mode(False)
+	db.release_identity_map(repo_id)
+
+
+def export(db, serializer, export_filepath):
+	# Every entry is rendered, rather than taken from the cache an earlier run filled
+	con = db.getConnection()
+	with con:
+		con.execute("DELETE FROM export_cache")
+	os.makedirs(export_filepath)
+	exporter = Exporter(db, ListLogger(), {})
+	exporter.serializer = serializer
+	start = time.time()
+	exporter.export_to_file(export_format="gmeta", export_filepath=export_filepath, temp_filepath=export_filepath + "_temp", only_new_records=False)
+	elapsed = time.time() - start
+	if not exporter.export_ok:
+		print("{}: {}".format(export_filepath, exporter.logger.errors()))
+	return exporter.records_assembled, elapsed
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--records", type=int, default=100000)
+	args = parser.parse_args()
+
+	# Migrations are read relative to the working directory
+	os.chdir(ROOT)
+	with tempfile.TemporaryDirectory() as directory:
+		# Leave out the migration messages
+		with contextlib.redirect_stdout(io.StringIO()):
+			db = DBInterface({"type": "sqlite", "dbname": os.path.join(directory, "bench.db")})
+		db.setLogger(ListLogger())
+		start = time.time()
+		load_records(db, args.records)
+		print("Loaded {} records in {:.1f}s".format(args.records, time.time() - start))
+
+		# The default output always comes from the standard library, so only compact output is timed for each library
+		serializers = [("default", JSONSerializer())] + [(backend + " compact", JSONSerializer(backend, compact=True)) for backend in installed_backends()]
+		for name, serializer in serializers:
+			records, elapsed = export(db, serializer, os.path.join(directory, "export_" + name.replace(" ", "_")))
+			print("{:<16} export of {} records {:>7.2f}s".format(name, records, elapsed))
+
+		entries = []
+		for name in sorted(os.listdir(os.path.join(directory, "export_default"))):
+			with open(os.path.join(directory, "export_default", name)) as f:
+				entries.extend(json.load(f)["ingest_data"]["gmeta"])
+		for name, serializer in serializers:
+			start = time.time()
+			for entry in entries:
+				serializer.dumps(entry)
+			print("{:<16} encoding {} entries {:>7.2f}s".format(name, len(entries), time.time() - start))
+
+
+if __name__ == "__main__":
+	main()
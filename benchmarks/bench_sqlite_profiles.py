@@ -0,0 +1,67 @@
+""" Time writing records to sqlite under each PRAGMA profile, as a crawl writes them: a page at a time, with the bulk_ overrides in place
+
+Run from the top of the repository: python benchmarks/bench_sqlite_profiles.py [--records N] [--page-size N]
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "tests"))
+
+from harvester.DBInterface import DBInterface
+from helpers import ListLogger, add_repository, make_records
+
+WAL = {"journal_mode": "wal", "synchronous": "normal", "mmap_size": "268435456", "cache_size": "-65536", "temp_store": "memory", "busy_timeout": "5000"}
+
+PROFILES = [
+	("sqlite defaults", {}),
+	("wal", WAL),
+	("wal, bulk_cache_size", dict(WAL, bulk_cache_size="-262144")),
+	("wal, bulk_cache_size, bulk_synchronous = off", dict(WAL, bulk_cache_size="-262144", bulk_synchronous="off")),
+]
+
+
+def run(name, pragmas, records, page_size, directory):
+	# Leave out the migration messages
+	with contextlib.redirect_stdout(io.StringIO()):
+		db = DBInterface(dict({"type": "sqlite", "dbname": os.path.join(directory, "{}.db".format(len(os.listdir(directory))))}, **pragmas))
+	db.setLogger(ListLogger())
+	repo_id = add_repository(db)
+	con = db.getConnection()
+	journal_mode = con.execute("PRAGMA journal_mode").fetchone()[0]
+
+	db.set_crawl_profile(True)
+	synchronous = con.execute("PRAGMA synchronous").fetchone()[0]
+	start = time.time()
+	for i in range(0, len(records), page_size):
+		db.write_records(records[i:i + page_size], repo_id, "oai_dc")
+	elapsed = time.time() - start
+	db.set_crawl_profile(False)
+
+	if db.logger.errors():
+		print("{}: {}".format(name, db.logger.errors()[0]))
+	print("{:<48} journal_mode={:<8} synchronous={} {:>8.0f} records/s".format(name, journal_mode, synchronous, len(records) / elapsed))
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--records", type=int, default=3000)
+	parser.add_argument("--page-size", type=int, default=10)
+	args = parser.parse_args()
+
+	# Migrations are read relative to the working directory
+	os.chdir(ROOT)
+	with tempfile.TemporaryDirectory() as directory:
+		for name, pragmas in PROFILES:
+			# write_records changes the records it is given, so each profile gets its own
+			run(name, pragmas, make_records(args.records), args.page_size, directory)
+
+
+if __name__ == "__main__":
+	main()
@@ -1,14 +1,19 @@
 """Globus Harvester.
 
 Usage:
-  globus_harvester.py [--onlyharvest | --onlyexport] [--only-new-records] [--export-filepath=<file>] [--export-format=<format>]
+  globus_harvester.py [--onlyharvest | --onlyexport] [--only-new-records] [--export-filepath=<file>] [--export-format=<format>] [--export-workers=<n>] [--export-compression=<type>] [--bulk-load] [--harvest-workers=<n>] [--full-harvest]
 
 Options:
   --onlyharvest             Just harvest new items, do not export anything.
   --onlyexport              Just export existing items, do not harvest anything.
-  --only-new-records        Only export records changed since last crawl.
+  --only-new-records        Only export records changed since the last export in this format.
   --export-filepath=<file>  The path to export the data to.
-  --export-format=<format>  The export format (gmeta or rifcs).
+  --export-format=<format>  The export format (gmeta, rifcs or jsonl).
+  --export-workers=<n>      The number of processes to render the export with.
+  --export-compression=<type>  Compress export files as they are written (none, gzip or zstd).
+  --bulk-load               Load crawled records in bulk mode even for repositories that already have records.
+  --harvest-workers=<n>     The number of repositories to harvest at the same time.
+  --full-harvest            List every record of OAI repositories, rather than only those changed since the last harvest.
 
 """
 
@@ -17,6 +22,7 @@ import json
 import os
 import time
 import configparser
+from concurrent.futures import ThreadPoolExecutor
 
 from harvester.OAIRepository import OAIRepository
 from harvester.CKANRepository import CKANRepository
@@ -24,6 +30,7 @@ from harvester.MarkLogicRepository import MarkLogicRepository
 from harvester.CSWRepository import CSWRepository
 from harvester.DBInterface import DBInterface
 from harvester.HarvestLogger import HarvestLogger
+from harvester.RepositoryLogger import RepositoryLogger
 from harvester.TimeFormatter import TimeFormatter
 from harvester.Lock import Lock
 from harvester.Exporter import Exporter
@@ -50,6 +57,42 @@ def get_config_ini(config_file="conf/harvester.conf"):
 	return config
 
 
+def get_repo_log(main_log, repoconfig):
+	'''
+	Logger for one repository, following its copyerrorstoemail setting without changing the shared logger
+	'''
+	repo_log = RepositoryLogger(main_log, repoconfig.get('name', repoconfig.get('url')))
+	if 'copyerrorstoemail' in repoconfig and not repoconfig['copyerrorstoemail']:
+	    repo_log.setErrorsToEmail(False)
+	return repo_log
+
+
+def harvest_repository(repoconfig, final_config, dbh, dbparams, repo_log):
+	'''
+	Crawl one repository and then update its stale records
+	:param dbh: Database connection for this repository alone, or the shared one when harvesting one at a time
+	:return: Seconds taken
+	'''
+	tstart = time.time()
+	if repoconfig['type'] == "oai":
+	    repo = OAIRepository(final_config)
+	elif repoconfig['type'] == "ckan":
+	    repo = CKANRepository(final_config)
+	elif repoconfig['type'] == "marklogic":
+	    repo = MarkLogicRepository(final_config)
+	elif repoconfig['type'] == "csw":
+	    repo = CSWRepository(final_config)
+	else:
+	    repo_log.error("Unknown repository type: {}".format(repoconfig['type']))
+	    return time.time() - tstart
+	repo.setLogger(repo_log)
+	repo.setRepoParams(repoconfig)
+	repo.setDatabase(dbh)
+	repo.crawl()
+	repo.update_stale_records(dbparams)
+	return time.time() - tstart
+
+
 if __name__ == "__main__":
 
 	instance_lock = Lock()
@@ -62,10 +105,21 @@ if __name__ == "__main__":
 	final_config['abort_after_numerrors']     = int(config['harvest'].get('abort_after_numerrors', 5))
 	final_config['record_refresh_days']       = int(config['harvest'].get('record_refresh_days', 30))
 	final_config['repo_refresh_days']         = int(config['harvest'].get('repo_refresh_days', 1))
+	final_config['write_batch_size']          = int(config['harvest'].get('write_batch_size', 100))
+	final_config['bulk_write_batch_size']     = int(config['harvest'].get('bulk_write_batch_size', 5000))
+	final_config['bulk_load']                 = arguments["--bulk-load"]
+	final_config['harvest_workers']           = int(config['harvest'].get('harvest_workers', 1))
+	final_config['full_harvest']              = arguments["--full-harvest"]
+	final_config['full_harvest_days']         = int(config['harvest'].get('full_harvest_days', 30))
+	final_config['harvest_overlap_hours']     = int(config['harvest'].get('harvest_overlap_hours', 1))
 	final_config['temp_filepath']             = config['harvest'].get('temp_filepath', "temp")
 	final_config['export_filepath']           = config['export'].get('export_filepath', "data")
 	final_config['export_file_limit_mb']      = int(config['export'].get('export_file_limit_mb', 10))
 	final_config['export_format']             = config['export'].get('export_format', "gmeta")
+	final_config['export_workers']            = int(config['export'].get('export_workers', 1))
+	final_config['export_compression']        = config['export'].get('compression', "none")
+	final_config['validate_rifcs']            = config['export'].get('validate_rifcs', "false").upper() == "TRUE"
+	final_config['compact_json']              = config['export'].get('compact_json', "false").upper() == "TRUE"
 
 	main_log = HarvestLogger(config['logging'])
 	main_log.info("Starting... (pid={})".format(os.getpid()))
@@ -73,27 +127,45 @@ if __name__ == "__main__":
 	dbh = DBInterface(config['db'])
 	dbh.setLogger(main_log)
 
+	if arguments["--harvest-workers"]:
+	    final_config['harvest_workers'] = int(arguments["--harvest-workers"])
+
 	repo_configs = get_config_json()
 	if arguments["--onlyexport"] == False:
 	    # Find any new information in the repositories
-	    for repoconfig in repo_configs['repos']:
-	        if repoconfig['type'] == "oai":
-	            repo = OAIRepository(final_config)
-	        elif repoconfig['type'] == "ckan":
-	            repo = CKANRepository(final_config)
-	        elif repoconfig['type'] == "marklogic":
-	            repo = MarkLogicRepository(final_config)
-	        elif repoconfig['type'] == "csw":
-	        	repo = CSWRepository(final_config)
-	        repo.setLogger(main_log)
-	        if 'copyerrorstoemail' in repoconfig and not repoconfig['copyerrorstoemail']:
-	        	main_log.setErrorsToEmail(False)
-	        repo.setRepoParams(repoconfig)
-	        repo.setDatabase(dbh)
-	        repo.crawl()
-	        repo.update_stale_records(config['db'])
-	        if 'copyerrorstoemail' in repoconfig and not repoconfig['copyerrorstoemail']:
-	        	main_log.restoreErrorsToEmail()
+	    harvest_times = []
+	    if final_config['harvest_workers'] > 1:
+	        # Each repository gets its own connection, since they are written to at the same time
+	        worker_db_config = dict(config['db'])
+	        if worker_db_config.get('type') == "sqlite":
+	            # Wait for another worker's write to finish rather than failing on a locked database; a page
+	            # written in bulk mode holds the lock for much longer than the few seconds a single process needs
+	            worker_db_config['busy_timeout'] = max(int(worker_db_config.get('busy_timeout') or 0), 60000)
+	        def harvest_with_own_connection(repoconfig):
+	            repo_log = get_repo_log(main_log, repoconfig)
+	            repo_db = DBInterface(worker_db_config)
+	            repo_db.setLogger(repo_log)
+	            harvest_time = harvest_repository(repoconfig, final_config, repo_db, worker_db_config, repo_log)
+	            repo_log.info("Vocabulary cache: {}".format(repo_db.vocabulary_cache.summary()))
+	            return harvest_time
+	        main_log.info("Harvesting {} repositories with {} workers".format(len(repo_configs['repos']), final_config['harvest_workers']))
+	        with ThreadPoolExecutor(max_workers=final_config['harvest_workers']) as pool:
+	            futures = [(repoconfig, pool.submit(harvest_with_own_connection, repoconfig)) for repoconfig in repo_configs['repos']]
+	            for repoconfig, future in futures:
+	                try:
+	                    harvest_times.append((repoconfig.get('name', repoconfig.get('url')), future.result()))
+	                except Exception as e:
+	                    main_log.error("Repository {} unable to be harvested: {}".format(repoconfig.get('name'), e))
+	    else:
+	        for repoconfig in repo_configs['repos']:
+	            repo_log = get_repo_log(main_log, repoconfig)
+	            dbh.setLogger(repo_log)
+	            harvest_times.append((repoconfig.get('name', repoconfig.get('url')), harvest_repository(repoconfig, final_config, dbh, config['db'], repo_log)))
+	        dbh.setLogger(main_log)
+
+	    formatter = TimeFormatter()
+	    for name, seconds in sorted(harvest_times, key=lambda harvest: harvest[1], reverse=True):
+	        main_log.info("Harvest of {} took {}".format(name, formatter.humanize(seconds)))
 
 	if arguments["--onlyharvest"] == True:
 	    raise SystemExit
@@ -102,6 +174,10 @@ if __name__ == "__main__":
 	    final_config['export_format'] = arguments["--export-format"]
 	if arguments["--export-filepath"]:
 	    final_config['export_filepath'] = arguments["--export-filepath"]
+	if arguments["--export-workers"]:
+	    final_config['export_workers'] = int(arguments["--export-workers"])
+	if arguments["--export-compression"]:
+	    final_config['export_compression'] = arguments["--export-compression"]
 
 	exporter = Exporter(dbh, main_log, final_config)
 
@@ -116,6 +192,7 @@ if __name__ == "__main__":
 	exporter.export_to_file(**kwargs)
 
 	formatter = TimeFormatter()
+	main_log.info("Vocabulary cache: {}".format(dbh.vocabulary_cache.summary()))
 	main_log.info("Done after {}".format(formatter.humanize(time.time() - tstart)))
 
 	with open("data/last_run_timestamp", "w") as lastrun:
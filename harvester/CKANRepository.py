@@ -1,5 +1,5 @@
 from harvester.HarvestRepository import HarvestRepository
-from functools import wraps
+from harvester.RateLimiter import rate_limited
 import ckanapi
 import time
 import json
@@ -37,6 +37,7 @@ class CKANRepository(HarvestRepository):
 				self.logger.info("Done {} item headers after {} ({:.1f} items/sec)".format(item_count, self.formatter.humanize(tdelta), item_count/tdelta) )
 
 		self.logger.info("Found {} items in feed".format(item_count) )
+		self.reconcile_records(records)
 
 	def format_ckan_to_oai(self, ckan_record, local_identifier):
 		record = {}
@@ -147,35 +148,7 @@ class CKANRepository(HarvestRepository):
 
 		return record
 
-	def _rate_limited(max_per_second):
-		""" Decorator that make functions not be called faster than a set rate """
-		threading = __import__('threading')
-		lock = threading.Lock()
-		min_interval = 1.0 / float(max_per_second)
-
-		def decorate(func):
-			last_time_called = [0.0]
-
-			@wraps(func)
-			def rate_limited_function(*args, **kwargs):
-				lock.acquire()
-				elapsed = time.clock() - last_time_called[0]
-				left_to_wait = min_interval - elapsed
-
-				if left_to_wait > 0:
-					time.sleep(left_to_wait)
-
-				lock.release()
-
-				ret = func(*args, **kwargs)
-				last_time_called[0] = time.clock()
-				return ret
-
-			return rate_limited_function
-
-		return decorate
-
-	@_rate_limited(5)
+	@rate_limited
 	def _update_record(self,record):
 		#self.logger.debug("Updating CKAN record {}".format(record['local_identifier']) )
 
@@ -200,8 +173,7 @@ class CKANRepository(HarvestRepository):
 			self.logger.error("Updating record {} failed: {}".format(record['local_identifier'],e) )
 			# Touch the record so we do not keep requesting it on every run
 			self.db.touch_record(record)
-			self.error_count =  self.error_count + 1
-			if self.error_count < self.abort_after_numerrors:
+			if self.count_error() < self.abort_after_numerrors:
 				return True
 
 		return False
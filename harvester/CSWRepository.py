@@ -1,5 +1,5 @@
 from harvester.HarvestRepository import HarvestRepository
-from functools import wraps
+from harvester.RateLimiter import rate_limited
 from owslib.csw import CatalogueServiceWeb
 import time
 import json
@@ -10,6 +10,9 @@ import os.path
 class CSWRepository(HarvestRepository):
 	""" CSW Repository """
 
+	# Each request leaves its response on the shared client, so records are refreshed one at a time
+	concurrent_updates = False
+
 	def setRepoParams(self, repoParams):
 		self.metadataprefix = "csw"
 		super(CSWRepository, self).setRepoParams(repoParams)
@@ -28,6 +31,7 @@ class CSWRepository(HarvestRepository):
 		self.repository_id = self.db.update_repo(**kwargs)
 
 		item_count = 0
+		identifiers = []
 		while True:
 			try:
 				self.cswrepo.getrecords2(startposition=self.cswrepo.results['nextrecord'])
@@ -36,6 +40,7 @@ class CSWRepository(HarvestRepository):
 
 			for rec in self.cswrepo.records:
 				result = self.db.write_header(self.cswrepo.records[rec].identifier, self.repository_id)
+				identifiers.append(self.cswrepo.records[rec].identifier)
 				item_count = item_count + 1
 				if (item_count % self.update_log_after_numitems == 0):
 					tdelta = time.time() - self.tstart + 0.1
@@ -44,6 +49,7 @@ class CSWRepository(HarvestRepository):
 				break
 
 		self.logger.info("Found {} items in feed".format(item_count) )
+		self.reconcile_records(identifiers)
 
 	def format_csw_to_oai(self, csw_record, local_identifier):
 		record = {}
@@ -58,35 +64,7 @@ class CSWRepository(HarvestRepository):
 
 		return record
 
-	def _rate_limited(max_per_second):
-		""" Decorator that make functions not be called faster than a set rate """
-		threading = __import__('threading')
-		lock = threading.Lock()
-		min_interval = 1.0 / float(max_per_second)
-
-		def decorate(func):
-			last_time_called = [0.0]
-
-			@wraps(func)
-			def rate_limited_function(*args, **kwargs):
-				lock.acquire()
-				elapsed = time.clock() - last_time_called[0]
-				left_to_wait = min_interval - elapsed
-
-				if left_to_wait > 0:
-					time.sleep(left_to_wait)
-
-				lock.release()
-
-				ret = func(*args, **kwargs)
-				last_time_called[0] = time.clock()
-				return ret
-
-			return rate_limited_function
-
-		return decorate
-
-	@_rate_limited(5)
+	@rate_limited
 	def _update_record(self,record):
 
 		self.cswrepo.getrecordbyid(id=[record['local_identifier']])
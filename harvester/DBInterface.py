@@ -3,9 +3,22 @@ import time
 import sys
 import hashlib
 import json
+import io
+from contextlib import contextmanager
+from harvester.VocabularyCache import VocabularyCache
+from harvester.URLResolver import URLResolver
 
 class DBInterface:
-	def __init__(self, params):
+	# Tables holding rows that belong to a single record, cleared when the record is deleted
+	record_related_tables = ["records_x_access", "records_x_creators", "records_x_publishers", "records_x_rights", "records_x_subjects",
+		"records_x_tags", "descriptions", "geospatial", "domain_metadata", "export_cache"]
+
+	# sqlite PRAGMAs that can be set from the [db] config section, with sqlite's own defaults
+	sqlite_pragmas = {"journal_mode": "delete", "synchronous": "full", "mmap_size": 0, "cache_size": -2000, "temp_store": "default", "busy_timeout": 0}
+
+	def __init__(self, params, migrate=True):
+		# Kept so that worker processes can open connections of their own
+		self.params = dict(params)
 		self.dbtype = params.get('type', None)
 		self.dbname = params.get('dbname', None)
 		self.host = params.get('host', None)
@@ -14,6 +27,16 @@ class DBInterface:
 		self.password = params.get('pass', None)
 		self.connection = None
 		self.logger = None
+		self.vocabulary_cache = VocabularyCache(params.get('vocabulary_cache_size', 10000))
+		self.supports_returning = False
+		self.bulk_mode = False
+		self.pending_vocabulary = []
+		self.write_stats = {}
+		self.identity_maps = {}
+		self.pending_identities = []
+		self.pragmas = {}
+		self.bulk_pragmas = {}
+		self.url_resolver = URLResolver()
 
 		if self.dbtype == "sqlite":
 			self.dblayer = __import__('sqlite3')
@@ -23,12 +46,33 @@ class DBInterface:
 				except:
 					pass
 
+			# RETURNING was added in sqlite 3.35
+			self.supports_returning = self.dblayer.sqlite_version_info >= (3, 35, 0)
+
+			# PRAGMAs applied to every connection, and the overrides used while crawling
+			for pragma in self.sqlite_pragmas:
+				if params.get(pragma, ''):
+					self.pragmas[pragma] = params.get(pragma)
+				if params.get('bulk_' + pragma, ''):
+					self.bulk_pragmas[pragma] = params.get('bulk_' + pragma)
+
 		elif self.dbtype == "postgres":
 			self.dblayer = __import__('psycopg2')
+			self.supports_returning = True
 
 		else:
 			raise ValueError('Database type must be sqlite or postgres in config file')
 
+		# Worker processes open a database the parent has already brought up to date
+		if migrate:
+			self.migrate()
+
+		self.tabledict = {}
+		with open("sql/tables.json", 'r') as jsonfile:
+			self.tabledict = json.load(jsonfile)
+
+	def migrate(self):
+		""" Run the scripts in sql/<type>/ newer than the version recorded in the settings table """
 		con = self.getConnection()
 		with con:
 			cur = self.getCursor(con)
@@ -36,28 +80,26 @@ class DBInterface:
 			# This table must always exist
 			cur.execute("create table if not exists settings (setting_id INTEGER PRIMARY KEY NOT NULL, setting_name TEXT, setting_value TEXT)")
 
-			# Determine if the database schema needs to be updated
-			dbversion = self.get_db_version()
-			files = os.listdir("sql/" + str(self.dbtype) + "/")
-			files.sort()
-			for filename in files:
-				if filename.endswith(".sql"):
-					scriptversion = int(filename.split('.')[0])
-					if scriptversion > dbversion:
-						# Run this script to update the schema, then record it as done
-						with open("sql/" + str(self.dbtype) + "/" + filename, 'r') as scriptfile:
-							scriptcontents = scriptfile.read()
+		# Determine if the database schema needs to be updated; psycopg2 cannot enter a connection it is already in, so each step has its own block
+		dbversion = self.get_db_version()
+		files = os.listdir("sql/" + str(self.dbtype) + "/")
+		files.sort()
+		for filename in files:
+			if filename.endswith(".sql"):
+				scriptversion = int(filename.split('.')[0])
+				if scriptversion > dbversion:
+					# Run this script to update the schema, then record it as done
+					with open("sql/" + str(self.dbtype) + "/" + filename, 'r') as scriptfile:
+						scriptcontents = scriptfile.read()
+					with con:
+						cur = self.getCursor(con)
 						if self.dbtype == "postgres":
 							cur.execute(scriptcontents)
 						else:
 							cur.executescript(scriptcontents)
-						self.set_db_version(scriptversion)
-						dbversion = scriptversion
-						print("Updated database to version: {:d}".format(scriptversion)) # No logger yet
-
-		self.tabledict = {}
-		with open("sql/tables.json", 'r') as jsonfile:
-			self.tabledict = json.load(jsonfile)
+					self.set_db_version(scriptversion)
+					dbversion = scriptversion
+					print("Updated database to version: {:d}".format(scriptversion)) # No logger yet
 
 	def setLogger(self, l):
 		self.logger = l
@@ -65,7 +107,9 @@ class DBInterface:
 	def getConnection(self):
 		if self.connection == None:
 			if self.dbtype == "sqlite":
-				self.connection = self.dblayer.connect(self.dbname)
+				# Used from the threads refreshing stale records, which take turns through LockedDatabase
+				self.connection = self.dblayer.connect(self.dbname, check_same_thread=False)
+				self._apply_pragmas(self.pragmas)
 			elif self.dbtype == "postgres":
 				self.connection = self.dblayer.connect("dbname='%s' user='%s' password='%s' host='%s'" % (
 					self.dbname, self.user, self.password, self.host))
@@ -73,6 +117,20 @@ class DBInterface:
 
 		return self.connection
 
+	def _apply_pragmas(self, pragmas):
+		for pragma in self.sqlite_pragmas:
+			if pragma in pragmas:
+				self.connection.execute("PRAGMA {} = {}".format(pragma, pragmas[pragma]))
+
+	def set_crawl_profile(self, enabled):
+		""" Switch sqlite to the bulk_ PRAGMA overrides while a crawl is writing, and back afterwards """
+		if self.dbtype != "sqlite" or not self.bulk_pragmas:
+			return
+		if enabled:
+			self._apply_pragmas(self.bulk_pragmas)
+		else:
+			self._apply_pragmas({pragma: self.pragmas.get(pragma, self.sqlite_pragmas[pragma]) for pragma in self.bulk_pragmas})
+
 	def getCursor(self, con):
 		if self.dbtype == "sqlite":
 			con.row_factory = self.getRow()
@@ -122,6 +180,24 @@ class DBInterface:
 				cur.execute(self._prep("update settings set setting_value = ? where setting_name = ?"),
 						(v, "dbversion"))
 
+	def get_setting(self, setting_name, default=None):
+		con = self.getConnection()
+		with con:
+			cur = self.getCursor(con)
+			cur.execute(self._prep("select setting_value from settings where setting_name = ?"), (setting_name,))
+			res = cur.fetchone()
+		if res is None:
+			return default
+		return res['setting_value']
+
+	def set_setting(self, setting_name, setting_value):
+		con = self.getConnection()
+		with con:
+			cur = self.getCursor(con)
+			cur.execute(self._prep("update settings set setting_value = ? where setting_name = ?"), (setting_value, setting_name))
+			if cur.rowcount == 0:
+				cur.execute(self._prep("insert into settings(setting_value, setting_name) values (?,?)"), (setting_value, setting_name))
+
 	def update_repo(self, **kwargs):
 		for key, value in kwargs.items():
 			setattr(self, key, value)
@@ -133,10 +209,10 @@ class DBInterface:
 				try:
 					self.logger.debug("This repo already exists in the database; updating")
 					cur.execute(self._prep("""UPDATE repositories 
-						set repository_url=?, repository_set=?, repository_name=?, repository_type=?, repository_thumbnail=?, last_crawl_timestamp=?, item_url_pattern=?,enabled=?,
+						set repository_url=?, repository_set=?, repository_name=?, repository_type=?, repository_thumbnail=?, item_url_pattern=?,enabled=?,
 						abort_after_numerrors=?,max_records_updated_per_run=?,update_log_after_numitems=?,record_refresh_days=?,repo_refresh_days=?,homepage_url=?
 						WHERE repository_id=?"""), (
-						self.repo_url, self.repo_set, self.repo_name, self.repo_type, self.repo_thumbnail, time.time(), self.item_url_pattern,
+						self.repo_url, self.repo_set, self.repo_name, self.repo_type, self.repo_thumbnail, self.item_url_pattern,
 						self.enabled, self.abort_after_numerrors, self.max_records_updated_per_run, self.update_log_after_numitems,
 						self.record_refresh_days, self.repo_refresh_days, self.homepage_url, self.repo_id))
 				except self.dblayer.IntegrityError as e:
@@ -155,7 +231,7 @@ class DBInterface:
 							self.repo_url, self.repo_set, self.repo_name, self.repo_type, self.repo_thumbnail, time.time(), self.item_url_pattern,
 							self.enabled, self.abort_after_numerrors, self.max_records_updated_per_run, self.update_log_after_numitems,
 							self.record_refresh_days, self.repo_refresh_days,self.homepage_url))
-						repo_id = int(cur.fetchone()['repository_id'])
+						self.repo_id = int(cur.fetchone()['repository_id'])
 
 					if self.dbtype == "sqlite":
 						cur.execute(self._prep("""INSERT INTO repositories 
@@ -167,9 +243,15 @@ class DBInterface:
 							self.record_refresh_days, self.repo_refresh_days,self.homepage_url))
 						self.repo_id = int(cur.lastrowid)
 
+					cur.execute(self._prep(self._insert_ignore("repository_stats", ["repository_id"])), (self.repo_id,))
+
 				except self.dblayer.IntegrityError as e:
 					self.logger.error("Cannot add repository: {}".format(e))
 
+				# A crawl of a repository not yet in the database starts with an empty identity map under id 0
+				if 0 in self.identity_maps and self.repo_id:
+					self.identity_maps[self.repo_id] = self.identity_maps.pop(0)
+
 		return self.repo_id
 
 	def get_repo_id(self, repo_url, repo_set):
@@ -198,53 +280,185 @@ class DBInterface:
 		self.logger.debug("Last crawl ts for repo_id {} is {}".format(repo_id, returnvalue))
 		return returnvalue
 
+	def get_repo_last_full_crawl(self, repo_id):
+		returnvalue = 0
+		if repo_id == 0 or repo_id is None:
+			return 0
+		records = self.get_multiple_records("repositories", "last_full_crawl_timestamp", "repository_id", repo_id)
+		for record in records:
+			returnvalue = int(record['last_full_crawl_timestamp'] or 0)
+		return returnvalue
+
 	def get_repositories(self):
-		records = self.get_multiple_records("repositories", "*", "enabled", "1", "or enabled = 'true'")
-		repos = [dict(rec) for rec in records]
-		for i in range(len(repos)):
-			records = self.get_multiple_records("records", "count(*) as cnt", "repository_id", repos[i]["repository_id"], "and deleted=0")
-			for rec in records:
-				repos[i]["item_count"] = int(rec["cnt"])
+		repos = self._select_repositories_with_stats()
+		missing = [repo["repository_id"] for repo in repos if repo["active_count"] is None]
+		if missing:
+			# A repository without a summary row is counted from its records; reading the list never writes one
+			counts = self._count_repository_records(missing)
+			for repo in repos:
+				if repo["repository_id"] in counts:
+					repo.update(counts[repo["repository_id"]])
+		for repo in repos:
+			for column in ["active_count", "deleted_count", "stale_count"]:
+				repo[column] = int(repo[column] or 0)
+			repo["item_count"] = repo["active_count"]
 		return repos
 
-	def update_last_crawl(self, repo_id):
+	def _select_repositories_with_stats(self):
 		con = self.getConnection()
 		with con:
 			cur = self.getCursor(con)
-			cur.execute(self._prep("update repositories set last_crawl_timestamp = ? where repository_id = ?"),
-						(int(time.time()), repo_id))
+			cur.execute(self._prep("""SELECT repos.*, stats.active_count, stats.deleted_count, stats.stale_count, stats.last_export_timestamp
+				FROM repositories repos LEFT JOIN repository_stats stats on stats.repository_id = repos.repository_id
+				WHERE repos.enabled = ? or repos.enabled = 'true'"""), ("1",))
+			return [dict(rec) for rec in cur.fetchall()]
+
+	def _count_repository_records(self, repo_ids):
+		""" The counts kept in repository_stats, read from the records table for the given repositories """
+		counts = {}
+		con = self.getConnection()
+		with con:
+			cur = self.getCursor(con)
+			for row in self._select_in(cur, """SELECT repos.repository_id,
+					coalesce(sum(case when recs.deleted = 0 then 1 else 0 end), 0) as active_count,
+					coalesce(sum(case when recs.deleted = 1 then 1 else 0 end), 0) as deleted_count,
+					coalesce(sum(case when recs.deleted = 0 and recs.modified_timestamp < ? - coalesce(repos.record_refresh_days, 30) * 86400 then 1 else 0 end), 0) as stale_count
+				FROM repositories repos LEFT JOIN records recs on recs.repository_id = repos.repository_id
+				WHERE repos.repository_id IN ({}) GROUP BY repos.repository_id""", repo_ids, (int(time.time()),)):
+				counts[row["repository_id"]] = {"active_count": row["active_count"], "deleted_count": row["deleted_count"], "stale_count": row["stale_count"]}
+		return counts
+
+	def rebuild_repository_stats(self):
+		""" Recount the repository_stats summary from the records table in one pass """
+		con = self.getConnection()
+		with self.transaction(con) as cur:
+			cur.execute("SELECT max(last_export_timestamp) as last_export FROM repository_stats")
+			last_export = cur.fetchone()["last_export"]
+			cur.execute("DELETE FROM repository_stats")
+			cur.execute(self._prep("""INSERT INTO repository_stats
+				(repository_id, active_count, deleted_count, stale_count, last_crawl_timestamp, last_export_timestamp)
+				SELECT repos.repository_id,
+					coalesce(sum(case when recs.deleted = 0 then 1 else 0 end), 0),
+					coalesce(sum(case when recs.deleted = 1 then 1 else 0 end), 0),
+					coalesce(sum(case when recs.deleted = 0 and recs.modified_timestamp < ? - coalesce(repos.record_refresh_days, 30) * 86400 then 1 else 0 end), 0),
+					repos.last_crawl_timestamp, ?
+				FROM repositories repos LEFT JOIN records recs on recs.repository_id = repos.repository_id
+				GROUP BY repos.repository_id, repos.last_crawl_timestamp"""), (int(time.time()), last_export))
+
+	def _count_records(self, cur, repo_id, active=0, deleted=0):
+		""" Apply a change in record counts to the repository_stats summary, inside the caller's transaction """
+		if active or deleted:
+			cur.execute(self._prep("UPDATE repository_stats set active_count = active_count + ?, deleted_count = deleted_count + ? WHERE repository_id = ?"),
+				(active, deleted, repo_id))
+
+	def update_stale_count(self, repo_id, stale_timestamp):
+		con = self.getConnection()
+		with con:
+			cur = self.getCursor(con)
+			cur.execute(self._prep("""UPDATE repository_stats set stale_count =
+				(SELECT count(*) FROM records WHERE repository_id = ? and deleted = 0 and modified_timestamp < ?) WHERE repository_id = ?"""),
+				(repo_id, stale_timestamp, repo_id))
 
-	def delete_record(self, record):
+	def update_last_export(self):
 		con = self.getConnection()
-		if record['record_id'] == 0:
-			return False
 		with con:
 			cur = self.getCursor(con)
+			cur.execute(self._prep("UPDATE repository_stats set last_export_timestamp = ?"), (int(time.time()),))
 
-			try:
-				cur.execute(self._prep("UPDATE records set deleted = 1, modified_timestamp = ? where record_id=?"),
-							(time.time(), record['record_id']))
-			except:
-				self.logger.error("Unable to mark as deleted record {}".format(record['local_identifier']))
-				return False
+	def update_last_crawl(self, repo_id, crawl_timestamp=None, full_crawl=True):
+		""" Record a finished crawl by the time it started, which is where the next incremental crawl carries on from """
+		if crawl_timestamp is None:
+			crawl_timestamp = time.time()
+		con = self.getConnection()
+		with con:
+			cur = self.getCursor(con)
+			cur.execute(self._prep("update repositories set last_crawl_timestamp = ? where repository_id = ?"),
+						(int(crawl_timestamp), repo_id))
+			if full_crawl:
+				cur.execute(self._prep("update repositories set last_full_crawl_timestamp = ? where repository_id = ?"),
+							(int(crawl_timestamp), repo_id))
+			cur.execute(self._prep("update repository_stats set last_crawl_timestamp = ? where repository_id = ?"),
+						(int(crawl_timestamp), repo_id))
 
-			try:
-				self.delete_related_records("records_x_access", record['record_id'])
-				self.delete_related_records("records_x_creators", record['record_id'])
-				self.delete_related_records("records_x_publishers", record['record_id'])
-				self.delete_related_records("records_x_rights", record['record_id'])
-				self.delete_related_records("records_x_subjects", record['record_id'])
-				self.delete_related_records("records_x_tags", record['record_id'])
-				self.delete_related_records("descriptions", record['record_id'])
-				self.delete_related_records("geospatial", record['record_id'])
-				self.delete_related_records("domain_metadata", record['record_id'])
-			except:
-				self.logger.error("Unable to delete related table rows for record {}".format(record['local_identifier']))
-				return False
+	def delete_record(self, record):
+		if record['record_id'] == 0:
+			return False
+		try:
+			self.delete_records([record['record_id']])
+		except Exception as e:
+			self.logger.error("Unable to mark as deleted record {}: {}".format(record['local_identifier'], e))
+			return False
 
 		self.logger.debug("Marked as deleted: record {}".format(record['local_identifier']))
 		return True
 
+	def delete_records(self, record_ids):
+		""" Mark records as deleted and remove their related rows, using one statement per table for each chunk of records """
+		record_ids = [int(record_id) for record_id in record_ids if record_id]
+		if not record_ids:
+			return 0
+
+		now = int(time.time())
+		con = self.getConnection()
+		with self.transaction(con) as cur:
+			for chunk in self._chunks(record_ids):
+				placeholders = ",".join("?" for record_id in chunk)
+				cur.execute(self._prep("SELECT repository_id, count(*) as cnt FROM records WHERE deleted = 0 and record_id IN ({}) GROUP BY repository_id".format(
+					placeholders)), chunk)
+				for row in cur.fetchall():
+					self._count_records(cur, row["repository_id"], active=-int(row["cnt"]), deleted=int(row["cnt"]))
+				cur.execute(self._prep("UPDATE records set deleted = 1, modified_timestamp = ?, changed_timestamp = ? where record_id IN ({})".format(placeholders)),
+					[now, now] + chunk)
+				for tablename in self.record_related_tables:
+					cur.execute(self._prep("DELETE from {} where record_id IN ({})".format(tablename, placeholders)), chunk)
+
+		return len(record_ids)
+
+	def delete_records_by_identifier(self, repo_id, local_identifiers):
+		""" Tombstone the records a feed lists as deleted; records already deleted are left alone unless queued for a refresh """
+		local_identifiers = set(local_identifiers)
+		con = self.getConnection()
+		with con:
+			cur = self.getCursor(con)
+			if repo_id in self.identity_maps:
+				# Identifiers missing from the map were never harvested, so there is nothing to delete
+				identities = self.identity_maps[repo_id]
+				rows = self._select_in(cur, "SELECT record_id FROM records WHERE (deleted = 0 or modified_timestamp = 0) and record_id IN ({})",
+					[identities[identifier] for identifier in local_identifiers if identifier in identities])
+			else:
+				rows = self._select_in(cur, "SELECT record_id FROM records WHERE repository_id=? and (deleted = 0 or modified_timestamp = 0) and local_identifier IN ({})",
+					local_identifiers, (repo_id,))
+		record_ids = [int(row["record_id"]) for row in rows]
+
+		# Deleting sets modified_timestamp, which keeps these out of get_stale_records
+		return self.delete_records(record_ids)
+
+	def reconcile_records(self, repo_id, seen_identifiers):
+		""" Compare the identifiers listed by a feed with the database: tombstone records the feed no longer lists,
+			and queue deleted records that have reappeared for a refresh """
+		seen_identifiers = set(seen_identifiers)
+		missing = []
+		reappeared = []
+		con = self.getConnection()
+		with con:
+			cur = self.getCursor(con)
+			cur.execute(self._prep("SELECT record_id, local_identifier, deleted FROM records WHERE repository_id=?"), (repo_id,))
+			for row in cur.fetchall():
+				if row["local_identifier"] in seen_identifiers:
+					if int(row["deleted"]) == 1:
+						reappeared.append(int(row["record_id"]))
+				elif int(row["deleted"]) == 0:
+					missing.append(int(row["record_id"]))
+
+		if reappeared:
+			# A zero timestamp makes get_stale_records pick the deleted record up again, and rewriting it clears the flag
+			with self.transaction(con) as cur:
+				for chunk in self._chunks(reappeared):
+					cur.execute(self._prep("UPDATE records set modified_timestamp = 0 where record_id IN ({})".format(
+						",".join("?" for record_id in chunk))), chunk)
+
+		return self.delete_records(missing), len(reappeared)
+
 	def delete_related_records(self, crosstable, record_id):
 		con = self.getConnection()
 		with con:
@@ -267,6 +481,9 @@ class DBInterface:
 			return str(self.tabledict[tablename]["valcol"])
 		raise ValueError("tables.json missing valcol definition for {}".format(tablename))
 
+	def is_vocabulary_table(self, tablename):
+		return tablename in self.tabledict and self.tabledict[tablename].get("vocabulary", False)
+
 	def insert_related_record(self, tablename, val, **kwargs):
 		valcolumn = self.get_table_value_column(tablename)
 		idcolumn = self.get_table_id_column(tablename)
@@ -274,47 +491,96 @@ class DBInterface:
 		paramlist = {valcolumn: val}
 		for key, value in kwargs.items():
 			paramlist[key] = value
-		sqlstring = "INSERT INTO {} ({}) VALUES ({})".format(
-			tablename, ",".join(str(k) for k in list(paramlist.keys())), ",".join(str("?") for k in list(paramlist.keys()))  )
+		sqlstring = self._insert_ignore(tablename, list(paramlist.keys()))
 
 		con = self.getConnection()
 		with con:
 			cur = self.getCursor(con)
 			try:
-				if self.dbtype == "postgres":
+				if self.supports_returning:
 					cur.execute(self._prep(sqlstring + " RETURNING " + idcolumn), list(paramlist.values()))
-					related_record_id = int(cur.fetchone()[idcolumn])
-				if self.dbtype == "sqlite":
+					row = cur.fetchone()
+					if row is not None:
+						related_record_id = int(row[idcolumn])
+				else:
 					cur.execute(self._prep(sqlstring), list(paramlist.values()))
-					related_record_id = int(cur.lastrowid)
+					if cur.rowcount == 1:
+						related_record_id = int(cur.lastrowid)
 			except self.dblayer.IntegrityError as e:
 				self.logger.error("Record insertion problem: {}".format(e))
 
+		if self.is_vocabulary_table(tablename):
+			self.vocabulary_cache.invalidate(tablename, val)
+			if related_record_id is None:
+				# The value was already present, so the insert was ignored
+				related_record_id = self.get_single_record_id(tablename, val)
 		return related_record_id
 
 	def insert_cross_record(self, crosstable, relatedtable, related_id, record_id, **kwargs):
-		cross_table_id = None
-		idcolumn = self.get_table_id_column(crosstable)
 		relatedidcolumn = self.get_table_id_column(relatedtable)
 		paramlist = {"record_id": record_id, relatedidcolumn: related_id}
 		for key, value in kwargs.items():
 			paramlist[key] = value
-		sqlstring = "INSERT INTO {} ({}) VALUES ({})".format(
-			crosstable, ",".join(str(k) for k in list(paramlist.keys())), ",".join(str("?") for k in list(paramlist.keys()))  )
 
 		con = self.getConnection()
 		with con:
 			cur = self.getCursor(con)
 			try:
-				if self.dbtype == "postgres":
-					cur.execute(self._prep(sqlstring + " RETURNING " + idcolumn), list(paramlist.values()))
-					cross_table_id = int(cur.fetchone()[idcolumn])
-				if self.dbtype == "sqlite":
-					cur.execute(self._prep(sqlstring), list(paramlist.values()))
-					cross_table_id = int(cur.lastrowid)
+				cur.execute(self._prep(self._insert_ignore(crosstable, list(paramlist.keys()))), list(paramlist.values()))
 			except self.dblayer.IntegrityError as e:
 				self.logger.error("Record insertion problem: {}".format(e))
 
+	def _insert_rows(self, cur, tablename, columns, rows, returning=None):
+		""" Insert many rows, skipping ones that clash with a unique index; optionally return the given columns of inserted rows """
+		if self.bulk_mode and self.dbtype == "postgres":
+			return self._copy_rows(cur, tablename, columns, rows, returning)
+
+		results = []
+		if returning and self.supports_returning:
+			for chunk in self._chunks(rows, 900 // len(columns)):
+				params = [value for row in chunk for value in row]
+				cur.execute(self._prep(self._insert_ignore(tablename, columns, len(chunk)) + " RETURNING " + ",".join(returning)), params)
+				results.extend(cur.fetchall())
+		else:
+			cur.executemany(self._prep(self._insert_ignore(tablename, columns)), rows)
+		return results
+
+	def _copy_rows(self, cur, tablename, columns, rows, returning=None):
+		""" Stream rows into a staging table with COPY, then merge them into the real table with one statement """
+		stagingtable = "staging_" + tablename
+		cur.execute("CREATE TEMP TABLE IF NOT EXISTS {} AS SELECT * FROM {} WITH NO DATA".format(stagingtable, tablename))
+		cur.execute("TRUNCATE {}".format(stagingtable))
+
+		buffer = io.StringIO()
+		for row in rows:
+			buffer.write("\t".join(self._copy_value(value) for value in row) + "\n")
+		buffer.seek(0)
+		cur.copy_expert("COPY {} ({}) FROM STDIN".format(stagingtable, ",".join(columns)), buffer)
+
+		sqlstring = "INSERT INTO {} ({}) SELECT {} FROM {} ON CONFLICT DO NOTHING".format(tablename, ",".join(columns), ",".join(columns), stagingtable)
+		if returning:
+			cur.execute(sqlstring + " RETURNING " + ",".join(returning))
+			return cur.fetchall()
+		cur.execute(sqlstring)
+		return []
+
+	def _copy_value(self, value):
+		""" Format a value for COPY text format """
+		if value is None:
+			return "\\N"
+		return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+	def set_bulk_mode(self, enabled):
+		""" Bulk mode is used while loading a repository from scratch; on postgres it loads rows with COPY """
+		self.bulk_mode = enabled
+
+	def _insert_ignore(self, tablename, columns, rowcount=1):
+		""" Build an insert that skips rows clashing with a unique index instead of raising an error """
+		values = ",".join("(" + ",".join("?" for c in columns) + ")" for r in range(rowcount))
+		if self.dbtype == "postgres":
+			return "INSERT INTO {} ({}) VALUES {} ON CONFLICT DO NOTHING".format(tablename, ",".join(columns), values)
+		return "INSERT OR IGNORE INTO {} ({}) VALUES {}".format(tablename, ",".join(columns), values)
+
 	def get_multiple_records(self, tablename, columnlist, given_col, given_val, extrawhere=""):
 		records = []
 		sqlstring = "select {} from {} where {}=? {}".format(columnlist, tablename, given_col, extrawhere)
@@ -329,225 +595,392 @@ class DBInterface:
 
 	def get_single_record_id(self, tablename, val, extrawhere = ""):
 		returnvalue = None
+		if self.is_vocabulary_table(tablename):
+			returnvalue = self.vocabulary_cache.get(tablename, val, extrawhere)
+			if returnvalue is not None:
+				return returnvalue
 		idcolumn = self.get_table_id_column(tablename)
 		valcolumn = self.get_table_value_column(tablename)
 		records = self.get_multiple_records(tablename, idcolumn, valcolumn, val, extrawhere)
 		for record in records:
 			returnvalue = int(record[idcolumn])
 
-		return returnvalue
-
-	def create_new_record(self, rec, source_url, repo_id):
-		returnvalue = None
-		con = self.getConnection()
-		with con:
-			cur = self.getCursor(con)
-			try:
-				if self.dbtype == "postgres":
-					cur.execute(self._prep(
-						"INSERT INTO records (title, pub_date, contact, series, modified_timestamp, source_url, deleted, local_identifier, repository_id) VALUES(?,?,?,?,?,?,?,?,?) RETURNING record_id"),
-						(rec["title"], rec["pub_date"], rec["contact"], rec["series"], time.time(), source_url, 0, rec["identifier"], repo_id))
-					returnvalue = int(cur.fetchone()['record_id'])
-				if self.dbtype == "sqlite":
-					cur.execute(self._prep(
-						"INSERT INTO records (title, pub_date, contact, series, modified_timestamp, source_url, deleted, local_identifier, repository_id) VALUES(?,?,?,?,?,?,?,?,?)"),
-						(rec["title"], rec["pub_date"], rec["contact"], rec["series"], time.time(), source_url, 0, rec["identifier"], repo_id))
-					returnvalue = int(cur.lastrowid)
-			except self.dblayer.IntegrityError as e:
-				self.logger.error("Record insertion problem: {}".format(e))
-
+		if returnvalue is not None and self.is_vocabulary_table(tablename):
+			self.vocabulary_cache.put(tablename, val, extrawhere, returnvalue)
 		return returnvalue
 
 	def write_record(self, record, repo_id, metadata_prefix, domain_metadata):
-		if record == None:
-			return None
-		record["record_id"] = self.get_single_record_id("records", record["identifier"], "and repository_id=" + str(repo_id))
+		""" Write one record, or nothing if it is None; pages of records are written with write_records """
+		self.write_records([(record, domain_metadata)], repo_id, metadata_prefix)
+
+	def write_records(self, batch, repo_id, metadata_prefix):
+		""" Write a page of (record, domain_metadata) pairs, resolving related rows per page and committing once """
+		pages = {}
+		for record, domain_metadata in batch:
+			if record is None:
+				continue
+			self._normalize_record(record)
+			# A repeated identifier within one page is written once, using the last copy seen
+			pages[record["identifier"]] = (record, domain_metadata or {})
+		if not pages:
+			return 0
 
 		con = self.getConnection()
-		with con:
-			cur = self.getCursor(con)
-			source_url = ""
-			if 'dc:source' in record:
-				if isinstance(record["dc:source"], list):
-					source_url = record["dc:source"][0]
-				else:
-					source_url = record["dc:source"]
-
-			if record["record_id"] is None:
-				record["record_id"] =  self.create_new_record(record, source_url, repo_id)
+		self.pending_vocabulary = []
+		self.pending_identities = []
+		try:
+			with self.transaction(con) as cur:
+				records = self._write_record_rows(cur, pages, repo_id)
+				if records:
+					self._write_vocabulary_relations(cur, records)
+					self._write_descriptions(cur, records)
+					self._write_geospatial(cur, records)
+					self._write_domain_metadata(cur, records)
+		except self.dblayer.IntegrityError as e:
+			self.logger.error("Record insertion problem: {}".format(e))
+			return 0
+		finally:
+			pending = self.pending_vocabulary
+			identities = self.pending_identities
+			self.pending_vocabulary = []
+			self.pending_identities = []
+
+		# Only ids from a committed transaction are safe to remember
+		for tablename, value, filters, id in pending:
+			self.vocabulary_cache.put(tablename, value, filters, id)
+		for local_identifier, record_id in identities:
+			self.identity_maps[repo_id][local_identifier] = record_id
+		return len(records)
+
+	def load_identity_map(self, repo_id):
+		""" Load the local_identifier -> record_id map for a repository, so per-item lookups during a crawl need no query """
+		identities = {}
+		if repo_id:
+			con = self.getConnection()
+			with con:
+				cur = con.cursor()
+				cur.execute(self._prep("SELECT local_identifier, record_id FROM records WHERE repository_id=?"), (repo_id,))
+				for local_identifier, record_id in cur:
+					if local_identifier is not None:
+						identities[sys.intern(local_identifier)] = int(record_id)
+		self.identity_maps[repo_id] = identities
+		return len(identities)
+
+	def release_identity_map(self, repo_id):
+		self.identity_maps.pop(repo_id, None)
+
+	@contextmanager
+	def transaction(self, con):
+		""" Run several statements as one transaction; postgres connections are otherwise in autocommit mode """
+		if self.dbtype == "postgres":
+			con.autocommit = False
+		try:
+			with con:
+				yield self.getCursor(con)
+		finally:
+			if self.dbtype == "postgres":
+				con.autocommit = True
+
+	def _normalize_record(self, record):
+		record["source_url"] = ""
+		if 'dc:source' in record:
+			if isinstance(record["dc:source"], list):
+				record["source_url"] = record["dc:source"][0]
 			else:
-				cur.execute(self._prep(
-					"UPDATE records set title=?, pub_date=?, contact=?, series=?, modified_timestamp=?, source_url=?, deleted=?, local_identifier=? WHERE record_id = ?"),
-					(record["title"], record["pub_date"], record["contact"], record["series"], time.time(),
-					 source_url, 0, record["identifier"], record["record_id"]))
-
-			if record["record_id"] is None:
-				return None
-
-			if "creator" in record:
-				if not isinstance(record["creator"], list):
-					record["creator"] = [record["creator"]]
-				existing_creator_recs = self.get_multiple_records("records_x_creators", "creator_id", "record_id", record["record_id"])
-				existing_creator_ids = [e["creator_id"] for e in existing_creator_recs]
-				for creator in record["creator"]:
-					creator_id = self.get_single_record_id("creators", creator)
-					if creator_id is None:
-						creator_id = self.insert_related_record("creators", creator)
-					if creator_id is not None:
-						if creator_id not in existing_creator_ids:
-							extras = {"is_contributor": 0}
-							self.insert_cross_record("records_x_creators", "creators", creator_id, record["record_id"], **extras)
-
-			if "contributor" in record:
-				if not isinstance(record["contributor"], list):
-					record["contributor"] = [record["contributor"]]
-				existing_creator_recs = self.get_multiple_records("records_x_creators", "creator_id", "record_id", record["record_id"])
-				existing_creator_ids = [e["creator_id"] for e in existing_creator_recs]
-				for creator in record["contributor"]:
-					creator_id = self.get_single_record_id("creators", creator)
-					if creator_id is None:
-						creator_id= self.insert_related_record("creators", creator)
-					if creator_id is not None:
-						if creator_id not in existing_creator_ids:
-							extras = {"is_contributor": 1}
-							self.insert_cross_record("records_x_creators", "creators", creator_id, record["record_id"], **extras)
-
-			if "subject" in record:
-				if not isinstance(record["subject"], list):
-					record["subject"] = [record["subject"]]
-				existing_subject_recs = self.get_multiple_records("records_x_subjects", "subject_id", "record_id", record["record_id"])
-				existing_subject_ids = [e["subject_id"] for e in existing_subject_recs]
-				for subject in record["subject"]:
-					subject_id = self.get_single_record_id("subjects", subject)
-					if subject_id is None:
-						subject_id = self.insert_related_record("subjects", subject)
-					if subject_id is not None:
-						if subject_id not in existing_subject_ids:
-							self.insert_cross_record("records_x_subjects", "subjects", subject_id, record["record_id"])
-
-			if "publisher" in record:
-				if not isinstance(record["publisher"], list):
-					record["publisher"] = [record["publisher"]]
-				existing_publisher_recs = self.get_multiple_records("records_x_publishers", "publisher_id", "record_id", record["record_id"])
-				existing_publisher_ids = [e["publisher_id"] for e in existing_publisher_recs]
-				for publisher in record["publisher"]:
-					publisher_id = self.get_single_record_id("publishers", publisher)
-					if publisher_id is None:
-						publisher_id = self.insert_related_record("publishers", publisher)
-					if publisher_id is not None:
-						if publisher_id not in existing_publisher_ids:
-							self.insert_cross_record("records_x_publishers", "publishers", publisher_id, record["record_id"])
-
-			if "rights" in record:
-				if not isinstance(record["rights"], list):
-					record["rights"] = [record["rights"]]
-				existing_rights_recs = self.get_multiple_records("records_x_rights", "rights_id", "record_id", record["record_id"])
-				existing_rights_ids = [e["rights_id"] for e in existing_rights_recs]
-				for rights in record["rights"]:
-					# Use a hash for lookups so we don't need to maintain a full text index
-					sha1 = hashlib.sha1()
-					sha1.update(rights.encode('utf-8'))
-					rights_hash = sha1.hexdigest()
-					rights_id = self.get_single_record_id("rights", rights_hash)
-					if rights_id is None:
-						self.delete_related_records("records_x_rights",record["record_id"]) # Needed for transition, can be removed once all rights rows have hashes
-						extras = {"rights": rights}
-						rights_id = self.insert_related_record("rights", rights_hash, **extras)
-					if rights_id is not None:
-						if rights_id not in existing_rights_ids:
-							self.insert_cross_record("records_x_rights", "rights", rights_id, record["record_id"])
-
-			if "description" in record:
-				if not isinstance(record["description"], list):
-					record["description"] = [record["description"]]
-				for description in record["description"]:
-					# Use a hash for lookups so we don't need to maintain a full text index
-					sha1 = hashlib.sha1()
-					sha1.update(description.encode('utf-8'))
-					description_hash = sha1.hexdigest()
-					description_id = self.get_single_record_id("descriptions", description_hash, "and record_id=" + str(record["record_id"]) + " and language='en'" )
-					if description_id is None:
-						extras = {"record_id": record["record_id"], "language": "en", "description": description}
-						self.insert_related_record("descriptions", description_hash, **extras)
-
-			if "description_fr" in record:
-				if not isinstance(record["description"], list):
-					record["description"] = [record["description"]]
-				for description in record["description"]:
-					# Use a hash for lookups so we don't need to maintain a full text index
-					sha1 = hashlib.sha1()
-					sha1.update(description.encode('utf-8'))
-					description_hash = sha1.hexdigest()
-					description_id = self.get_single_record_id("descriptions", description_hash, "and record_id=" + str(record["record_id"]) + " and language='fr'" )
-					if description_id is None:
-						extras = {"record_id": record["record_id"], "language": "fr", "description": description}
-						self.insert_related_record("descriptions", description_hash, **extras)
-
-			if "tags" in record:
-				if not isinstance(record["tags"], list):
-					record["tags"] = [record["tags"]]
-				existing_tag_recs = self.get_multiple_records("records_x_tags", "tag_id", "record_id", record["record_id"])
-				existing_tag_ids = [e["tag_id"] for e in existing_tag_recs]
-				for tag in record["tags"]:
-					tag_id = self.get_single_record_id("tags", tag, "and language='en'")
-					if tag_id is None:
-						extras = {"language":"en"}
-						tag_id = self.insert_related_record("tags", tag, **extras)
-					if tag_id is not None:
-						if tag_id not in existing_tag_ids:
-							self.insert_cross_record("records_x_tags", "tags", tag_id, record["record_id"])
-
-			if "tags_fr" in record:
-				if not isinstance(record["tags_fr"], list):
-					record["tags_fr"] = [record["tags_fr"]]
-				existing_tag_recs = self.get_multiple_records("records_x_tags", "tag_id", "record_id", record["record_id"])
-				existing_tag_ids = [e["tag_id"] for e in existing_tag_recs]
-				for tag in record["tags_fr"]:
-					tag_id = self.get_single_record_id("tags", tag, "and language='fr'")
-					if tag_id is None:
-						extras = {"language":"fr"}
-						tag_id = self.insert_related_record("tags", tag, **extras)
-					if tag_id is not None:
-						if tag_id not in existing_tag_ids:
-							self.insert_cross_record("records_x_tags", "tags", tag_id, record["record_id"])
-
-			if "access" in record:
-				if not isinstance(record["access"], list):
-					record["access"] = [record["access"]]
-				existing_access_recs = self.get_multiple_records("records_x_access", "access_id", "record_id", record["record_id"])
-				existing_access_ids = [e["access_id"] for e in existing_access_recs]
-				for access in record["access"]:
-					access_id = self.get_single_record_id("access", access)
-					if access_id is None:
-						access_id = self.insert_related_record("access", access)
-					if access_id is not None:
-						if access_id not in existing_access_ids:
-							self.insert_cross_record("records_x_access", "access", access_id, record["record_id"])
-
-			if "geospatial" in record:
-				existing_geospatial_ids = self.get_multiple_records("geospatial", "geospatial_id", "record_id", record["record_id"])
-				if not existing_geospatial_ids:
-					for coordinates in record["geospatial"]["coordinates"][0]:
-						extras = {"record_id": record["record_id"], "lat": coordinates[0], "lon": coordinates[1]}
-						self.insert_related_record("geospatial", record["geospatial"]["type"], **extras)
-
-			if len(domain_metadata) > 0:
-				existing_metadata_ids = self.get_multiple_records("domain_metadata", "metadata_id", "record_id", record["record_id"])
-				if not existing_metadata_ids:
-					for field_uri in domain_metadata:
-						field_pieces = field_uri.split("#")
-						domain_schema = field_pieces[0]
-						field_name = field_pieces[1]
-						schema_id = self.get_single_record_id("domain_schemas", domain_schema)
-						if schema_id is None:
-							schema_id = self.insert_related_record("domain_schemas", domain_schema)
-						if not isinstance(domain_metadata[field_uri], list):
-							domain_metadata[field_uri] = [domain_metadata[field_uri]]
-						for field_value in domain_metadata[field_uri]:
-							extras = {"record_id": record["record_id"], "field_name": field_name, "field_value": field_value}
-							self.insert_related_record("domain_metadata", schema_id, **extras)
+				record["source_url"] = record["dc:source"]
+
+		for field in ["creator", "contributor", "subject", "publisher", "rights", "description", "description_fr", "tags", "tags_fr", "access"]:
+			if field in record:
+				if not isinstance(record[field], list):
+					record[field] = [record[field]]
+				# Missing elements come through as None and cannot be looked up by value
+				record[field] = [value for value in record[field] if value is not None]
+
+	def _chunks(self, values, size=500):
+		""" Split a list for use in IN (...) clauses, keeping under the sqlite bound parameter limit """
+		values = list(values)
+		for i in range(0, len(values), size):
+			yield values[i:i + size]
+
+	def _select_in(self, cur, sqlstring, values, params=()):
+		""" Run a select containing a single {} placeholder for an IN list, once per chunk of values """
+		rows = []
+		for chunk in self._chunks(values):
+			cur.execute(self._prep(sqlstring.format(",".join("?" for v in chunk))), tuple(params) + tuple(chunk))
+			rows.extend(cur.fetchall())
+		return rows
+
+	def _write_record_rows(self, cur, pages, repo_id):
+		existing = {}
+		if repo_id in self.identity_maps:
+			# Identifiers missing from the map are new records, so only known ones need their row read back
+			identities = self.identity_maps[repo_id]
+			rows = self._select_in(cur, "SELECT record_id, local_identifier, content_hash, deleted FROM records WHERE record_id IN ({})",
+				[identities[identifier] for identifier in pages.keys() if identifier in identities])
+		else:
+			rows = self._select_in(cur, "SELECT record_id, local_identifier, content_hash, deleted FROM records WHERE repository_id=? AND local_identifier IN ({})",
+				pages.keys(), (repo_id,))
+		for row in rows:
+			existing[row["local_identifier"]] = row
+
+		cur.execute(self._prep("SELECT item_url_pattern FROM repositories WHERE repository_id=?"), (repo_id,))
+		repo = cur.fetchone()
+		item_url_pattern = repo["item_url_pattern"] if repo else None
+
+		now = int(time.time())
+		updates = []
+		inserts = []
+		touches = []
+		changed = []
+		revived = 0
+		for identifier, (record, domain_metadata) in pages.items():
+			content_hash = self.get_content_hash(record, domain_metadata)
+			# An empty string records that no landing URL could be made, as opposed to NULL for one not yet worked out
+			landing_url = self.url_resolver.resolve(identifier, item_url_pattern, record["source_url"]) or ""
+			if identifier in existing:
+				row = existing[identifier]
+				record["record_id"] = int(row["record_id"])
+				if row["content_hash"] == content_hash and int(row["deleted"]) == 0:
+					touches.append((now, record["record_id"]))
+					continue
+				if int(row["deleted"]) == 1:
+					revived += 1
+				updates.append((record["title"], record["pub_date"], record["contact"], record["series"], now, now,
+					record["source_url"], 0, identifier, content_hash, landing_url, record["record_id"]))
+			else:
+				inserts.append((record["title"], record["pub_date"], record["contact"], record["series"], now, now,
+					record["source_url"], 0, identifier, repo_id, content_hash, landing_url))
+			changed.append(identifier)
+
+		if touches:
+			cur.executemany(self._prep("UPDATE records set modified_timestamp = ? where record_id = ?"), touches)
+		if updates:
+			cur.executemany(self._prep(
+				"UPDATE records set title=?, pub_date=?, contact=?, series=?, modified_timestamp=?, changed_timestamp=?, source_url=?, deleted=?, local_identifier=?, content_hash=?, landing_url=? WHERE record_id = ?"),
+				updates)
+		if inserts:
+			self._insert_rows(cur, "records", ["title", "pub_date", "contact", "series", "modified_timestamp", "changed_timestamp", "source_url", "deleted",
+				"local_identifier", "repository_id", "content_hash", "landing_url"], inserts)
+			rows = self._select_in(cur, "SELECT record_id, local_identifier FROM records WHERE repository_id=? AND local_identifier IN ({})",
+				[row[8] for row in inserts], (repo_id,))
+			for row in rows:
+				pages[row["local_identifier"]][0]["record_id"] = int(row["record_id"])
+				if repo_id in self.identity_maps:
+					self.pending_identities.append((sys.intern(row["local_identifier"]), int(row["record_id"])))
+
+		self._count_records(cur, repo_id, active=revived + len(inserts), deleted=-revived)
+
+		records = [pages[identifier] for identifier in changed if "record_id" in pages[identifier][0]]
+		self._count_writes(repo_id, len(records), len(touches))
+		return records
 
-		return None
+	def get_content_hash(self, record, domain_metadata):
+		""" Fingerprint of everything write_records stores for a record, used to skip rewriting unchanged records """
+		content = [record.get(field) for field in ["title", "pub_date", "contact", "series", "source_url", "creator", "contributor", "subject",
+			"publisher", "rights", "description", "description_fr", "tags", "tags_fr", "access", "geospatial"]]
+		content.append(domain_metadata)
+		sha1 = hashlib.sha1()
+		sha1.update(json.dumps(content, sort_keys=True, default=str).encode('utf-8'))
+		return sha1.hexdigest()
+
+	def _count_writes(self, repo_id, written, unchanged):
+		if repo_id not in self.write_stats:
+			self.write_stats[repo_id] = {"written": 0, "unchanged": 0}
+		self.write_stats[repo_id]["written"] += written
+		self.write_stats[repo_id]["unchanged"] += unchanged
+
+	def get_write_stats(self, repo_id):
+		return self.write_stats.get(repo_id, {"written": 0, "unchanged": 0})
+
+	def _resolve_related_ids(self, cur, tablename, values, filters=None, extras=None):
+		""" Map each distinct value to its id in a vocabulary table, inserting the ones not seen before """
+		filters = filters or {}
+		extras = extras or {}
+		idcolumn = self.get_table_id_column(tablename)
+		valcolumn = self.get_table_value_column(tablename)
+		cachekey = tuple(sorted(filters.items()))
+		filterwhere = "".join("{}=? AND ".format(k) for k in filters.keys())
+		sqlstring = "SELECT {}, {} FROM {} WHERE {}{} IN ({{}})".format(idcolumn, valcolumn, tablename, filterwhere, valcolumn)
+
+		ids = {}
+		for v in set(values):
+			cached = self.vocabulary_cache.get(tablename, v, cachekey)
+			if cached is not None:
+				ids[v] = cached
+		values = set(v for v in values if v not in ids)
+
+		for row in self._select_in(cur, sqlstring, values, list(filters.values())):
+			ids[row[valcolumn]] = int(row[idcolumn])
+
+		missing = [v for v in values if v not in ids]
+		if missing:
+			columns = [valcolumn] + list(filters.keys())
+			extracolumns = []
+			for v in missing:
+				for key in extras.get(v, {}).keys():
+					if key not in extracolumns:
+						extracolumns.append(key)
+			columns.extend(extracolumns)
+			rows = [[v] + list(filters.values()) + [extras.get(v, {}).get(k) for k in extracolumns] for v in missing]
+			for row in self._insert_rows(cur, tablename, columns, rows, [idcolumn, valcolumn]):
+				ids[row[valcolumn]] = int(row[idcolumn])
+			# Anything not returned was inserted by someone else in the meantime
+			unresolved = [v for v in missing if v not in ids]
+			for row in self._select_in(cur, sqlstring, unresolved, list(filters.values())):
+				ids[row[valcolumn]] = int(row[idcolumn])
+
+		for v in values:
+			if v in ids:
+				self.pending_vocabulary.append((tablename, v, cachekey, ids[v]))
+		return ids, set(missing)
+
+	def _write_cross_records(self, cur, crosstable, relatedtable, links, extras=None):
+		""" Add (record_id, related_id) links; ones already present are skipped by the unique index """
+		relatedidcolumn = self.get_table_id_column(relatedtable)
+		extras = extras or {}
+		columns = ["record_id", relatedidcolumn] + list(extras.keys())
+		inserts = []
+		seen = set()
+		for link in links:
+			if link not in seen:
+				seen.add(link)
+				inserts.append(list(link) + list(extras.values()))
+		if inserts:
+			self._insert_rows(cur, crosstable, columns, inserts)
+
+	def _write_vocabulary_relations(self, cur, records):
+		for field, is_contributor in [("creator", 0), ("contributor", 1)]:
+			values = [v for record, dm in records for v in record.get(field, [])]
+			if values:
+				ids, added = self._resolve_related_ids(cur, "creators", values)
+				links = [(record["record_id"], ids[v]) for record, dm in records for v in record.get(field, [])]
+				self._write_cross_records(cur, "records_x_creators", "creators", links, {"is_contributor": is_contributor})
+
+		for field, tablename, crosstable in [("subject", "subjects", "records_x_subjects"), ("publisher", "publishers", "records_x_publishers"),
+				("access", "access", "records_x_access")]:
+			values = [v for record, dm in records for v in record.get(field, [])]
+			if values:
+				ids, added = self._resolve_related_ids(cur, tablename, values)
+				links = [(record["record_id"], ids[v]) for record, dm in records for v in record.get(field, [])]
+				self._write_cross_records(cur, crosstable, tablename, links)
+
+		for field, language in [("tags", "en"), ("tags_fr", "fr")]:
+			values = [v for record, dm in records for v in record.get(field, [])]
+			if values:
+				ids, added = self._resolve_related_ids(cur, "tags", values, {"language": language})
+				links = [(record["record_id"], ids[v]) for record, dm in records for v in record.get(field, [])]
+				self._write_cross_records(cur, "records_x_tags", "tags", links)
+
+		# Use a hash for lookups so we don't need to maintain a full text index
+		rights_by_hash = {}
+		for record, dm in records:
+			record["rights_hashes"] = []
+			for rights in record.get("rights", []):
+				rights_hash = hashlib.sha1(rights.encode('utf-8')).hexdigest()
+				rights_by_hash[rights_hash] = {"rights": rights}
+				record["rights_hashes"].append(rights_hash)
+		if rights_by_hash:
+			ids, added = self._resolve_related_ids(cur, "rights", rights_by_hash.keys(), extras=rights_by_hash)
+			# Needed for transition, can be removed once all rights rows have hashes
+			transition_ids = [record["record_id"] for record, dm in records if added.intersection(record["rights_hashes"])]
+			for chunk in self._chunks(transition_ids):
+				cur.execute(self._prep("DELETE from records_x_rights where record_id IN ({})".format(",".join("?" for r in chunk))), chunk)
+			links = [(record["record_id"], ids[h]) for record, dm in records for h in record["rights_hashes"]]
+			self._write_cross_records(cur, "records_x_rights", "rights", links)
+		for record, dm in records:
+			record.pop("rights_hashes", None)
+
+	def _write_descriptions(self, cur, records):
+		wanted = []
+		for field, language in [("description", "en"), ("description_fr", "fr")]:
+			for record, dm in records:
+				for description in record.get(field, []):
+					# Use a hash for lookups so we don't need to maintain a full text index
+					description_hash = hashlib.sha1(description.encode('utf-8')).hexdigest()
+					wanted.append((record["record_id"], description_hash, language, description))
+		if wanted:
+			self._insert_rows(cur, "descriptions", ["record_id", "language", "description", "description_hash"],
+				[(record_id, language, description, description_hash) for record_id, description_hash, language, description in wanted])
+
+	def _records_with_rows(self, cur, tablename, records):
+		rows = self._select_in(cur, "SELECT DISTINCT record_id FROM {} WHERE record_id IN ({{}})".format(tablename),
+			[record["record_id"] for record, dm in records])
+		return set(int(row["record_id"]) for row in rows)
+
+	def _write_geospatial(self, cur, records):
+		records = [(record, dm) for record, dm in records if "geospatial" in record]
+		if not records:
+			return
+		existing = self._records_with_rows(cur, "geospatial", records)
+		inserts = []
+		for record, dm in records:
+			if record["record_id"] not in existing:
+				for coordinates in record["geospatial"]["coordinates"][0]:
+					inserts.append((record["record_id"], record["geospatial"]["type"], coordinates[0], coordinates[1]))
+		if inserts:
+			self._insert_rows(cur, "geospatial", ["record_id", "coordinate_type", "lat", "lon"], inserts)
+
+	def _write_domain_metadata(self, cur, records):
+		records = [(record, dm) for record, dm in records if len(dm) > 0]
+		if not records:
+			return
+		existing = self._records_with_rows(cur, "domain_metadata", records)
+		records = [(record, dm) for record, dm in records if record["record_id"] not in existing]
+		if not records:
+			return
+
+		schema_ids, added = self._resolve_related_ids(cur, "domain_schemas", [field_uri.split("#")[0] for record, dm in records for field_uri in dm])
+		inserts = []
+		for record, domain_metadata in records:
+			for field_uri in domain_metadata:
+				field_pieces = field_uri.split("#")
+				if not isinstance(domain_metadata[field_uri], list):
+					domain_metadata[field_uri] = [domain_metadata[field_uri]]
+				for field_value in domain_metadata[field_uri]:
+					inserts.append((schema_ids[field_pieces[0]], record["record_id"], field_pieces[1], field_value))
+		self._insert_rows(cur, "domain_metadata", ["schema_id", "record_id", "field_name", "field_value"], inserts)
+
+	def refresh_landing_urls(self):
+		""" Resolve landing URLs not yet worked out, and all of them for repositories whose item_url_pattern changed since they were """
+		now = int(time.time())
+		refreshed = 0
+		con = self.getConnection()
+		with self.transaction(con) as cur:
+			cur.execute("SELECT repository_id, item_url_pattern, landing_url_pattern FROM repositories")
+			for repo in cur.fetchall():
+				pattern_changed = (repo["item_url_pattern"] or "") != (repo["landing_url_pattern"] or "")
+				cur.execute(self._prep("SELECT record_id, local_identifier, source_url, landing_url FROM records WHERE repository_id=?" +
+					("" if pattern_changed else " AND landing_url IS NULL")), (repo["repository_id"],))
+				resolved = []
+				changed = []
+				for row in cur.fetchall():
+					landing_url = self.url_resolver.resolve(row["local_identifier"] or "", repo["item_url_pattern"], row["source_url"]) or ""
+					if row["landing_url"] is None:
+						resolved.append((landing_url, row["record_id"]))
+					elif landing_url != row["landing_url"]:
+						# The exported record changes with its URL, so it is picked up by the next export of changed records
+						changed.append((landing_url, now, row["record_id"]))
+				if resolved:
+					cur.executemany(self._prep("UPDATE records SET landing_url=? WHERE record_id=?"), resolved)
+				if changed:
+					cur.executemany(self._prep("UPDATE records SET landing_url=?, changed_timestamp=? WHERE record_id=?"), changed)
+				if pattern_changed:
+					cur.execute(self._prep("UPDATE repositories SET landing_url_pattern=? WHERE repository_id=?"), (repo["item_url_pattern"], repo["repository_id"]))
+				refreshed += len(resolved) + len(changed)
+		return refreshed
+
+	def write_export_cache(self, entries):
+		""" Store rendered export entries as (record_id, content_hash, settings_hash, rendered), replacing earlier renderings """
+		if not entries:
+			return
+		con = self.getConnection()
+		with self.transaction(con) as cur:
+			if self.dbtype == "postgres":
+				cur.executemany(self._prep("""INSERT INTO export_cache (record_id, content_hash, settings_hash, rendered) VALUES (?,?,?,?)
+					ON CONFLICT (record_id) DO UPDATE SET content_hash = excluded.content_hash, settings_hash = excluded.settings_hash, rendered = excluded.rendered"""),
+					entries)
+			else:
+				cur.executemany("INSERT OR REPLACE INTO export_cache (record_id, content_hash, settings_hash, rendered) VALUES (?,?,?,?)", entries)
 
 	def get_stale_records(self, stale_timestamp, repo_id, max_records_updated_per_run):
 		con = self.getConnection()
@@ -557,7 +990,8 @@ class DBInterface:
 			cur.execute(self._prep("""SELECT recs.record_id, recs.title, recs.pub_date, recs.contact, recs.series, recs.modified_timestamp, recs.local_identifier, 
 				repos.repository_id, repos.repository_type
 				FROM records recs, repositories repos
-				where recs.repository_id = repos.repository_id and recs.modified_timestamp < ? and repos.repository_id = ? and recs.deleted = 0
+				where recs.repository_id = repos.repository_id and recs.modified_timestamp < ? and repos.repository_id = ?
+				and (recs.deleted = 0 or recs.modified_timestamp = 0)
 				LIMIT ?"""), (stale_timestamp, repo_id, max_records_updated_per_run))
 			if cur is not None:
 				records = cur.fetchall()
@@ -577,17 +1011,32 @@ class DBInterface:
 
 		return True
 
+	def get_record_id(self, repo_id, local_identifier):
+		if repo_id in self.identity_maps:
+			return self.identity_maps[repo_id].get(local_identifier)
+		return self.get_single_record_id("records", local_identifier, "and repository_id=" + str(repo_id))
+
 	def write_header(self, local_identifier, repo_id):
-		record_id = self.get_single_record_id("records", local_identifier, "and repository_id=" + str(repo_id))
+		record_id = self.get_record_id(repo_id, local_identifier)
 		if record_id is None:
 			con = self.getConnection()
 			with con:
 				cur = self.getCursor(con)
 				try:
-					cur.execute(self._prep(
-						"INSERT INTO records (title, pub_date, contact, series, modified_timestamp, local_identifier, repository_id) VALUES(?,?,?,?,?,?,?)"),
-						("", "", "", "", 0, local_identifier, repo_id))
+					if self.dbtype == "postgres":
+						cur.execute(self._prep(
+							"INSERT INTO records (title, pub_date, contact, series, modified_timestamp, local_identifier, repository_id) VALUES(?,?,?,?,?,?,?) RETURNING record_id"),
+							("", "", "", "", 0, local_identifier, repo_id))
+						record_id = int(cur.fetchone()['record_id'])
+					if self.dbtype == "sqlite":
+						cur.execute(self._prep(
+							"INSERT INTO records (title, pub_date, contact, series, modified_timestamp, local_identifier, repository_id) VALUES(?,?,?,?,?,?,?)"),
+							("", "", "", "", 0, local_identifier, repo_id))
+						record_id = int(cur.lastrowid)
+					self._count_records(cur, repo_id, active=1)
 				except self.dblayer.IntegrityError as e:
 					self.logger.error("Error creating record header: {}".format(e))
+			if record_id is not None and repo_id in self.identity_maps:
+				self.identity_maps[repo_id][sys.intern(local_identifier)] = record_id
 
 		return None
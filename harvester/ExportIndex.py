@@ -0,0 +1,104 @@
+import os
+import mmap
+import struct
+import hashlib
+
+class ExportIndex:
+	""" Binary index of a JSON Lines export: a header, the entries of the last full export sorted by key, then one entry per record written or deleted since """
+
+	header = b"FRDRIDX2"
+	# Number of sorted entries after the header
+	sorted_count = struct.Struct("<Q")
+	# sha1 of dc:source, record_id, file number, byte offset and length of the line without its newline; all little-endian
+	entry = struct.Struct("<20sQIQI")
+	key_length = 20
+
+	def __init__(self, filename, append=False):
+		self.filename = filename
+		self.pending = []
+		self.append = append and os.path.exists(filename)
+		if self.append:
+			self.output = open(filename, "ab")
+		else:
+			# Entries are kept in the order written until close(), which sorts them into the index
+			self.output = open(filename + ".unsorted", "wb")
+
+	@classmethod
+	def source_key(cls, source):
+		return hashlib.sha1(source.encode("utf-8")).digest()
+
+	def add(self, source, record_id, file_number, offset, length):
+		""" Held until flush(), which is only called once the lines they point to are on disk """
+		self.pending.append(self.entry.pack(self.source_key(source), record_id, file_number, offset, length))
+
+	def flush(self):
+		self.output.write(b"".join(self.pending))
+		self.output.flush()
+		self.pending = []
+
+	def close(self):
+		self.flush()
+		self.output.close()
+		if not self.append:
+			self._write_sorted()
+
+	def _write_sorted(self):
+		with open(self.filename + ".unsorted", "rb") as f:
+			written = f.read()
+		size = self.entry.size
+		# The sort is stable, so of two entries with the same key the one written last stays last
+		entries = sorted((written[i:i + size] for i in range(0, len(written), size)), key=lambda entry: entry[:self.key_length])
+		with open(self.filename + ".sorted", "wb") as f:
+			f.write(self.header + self.sorted_count.pack(len(entries)))
+			f.write(b"".join(entries))
+		os.replace(self.filename + ".sorted", self.filename)
+		os.remove(self.filename + ".unsorted")
+
+	@classmethod
+	def lookup(cls, filename, source=None, record_id=None):
+		""" Find (file number, offset, length) for a record by dc:source, which is binary searched, or by record_id; None if it is not in the export or was deleted """
+		key = cls.source_key(source) if source is not None else None
+		found = None
+		with open(filename, "rb") as f:
+			with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as index:
+				if index[:len(cls.header)] != cls.header:
+					raise ValueError("{} is not an export index".format(filename))
+				start = len(cls.header) + cls.sorted_count.size
+				sorted_count = cls.sorted_count.unpack_from(index, len(cls.header))[0]
+				tail = start + sorted_count * cls.entry.size
+
+				if key is not None:
+					found = cls._search(index, start, sorted_count, key)
+				else:
+					found = cls._scan(index, start, tail, key, record_id, found)
+				# Entries appended by later exports supersede those before them, so the last match wins
+				found = cls._scan(index, tail, len(index), key, record_id, found)
+		if found is None or found[2] == 0:
+			return None
+		return found
+
+	@classmethod
+	def _search(cls, index, start, count, key):
+		""" The last of the sorted entries with this key """
+		low, high = 0, count
+		while low < high:
+			middle = (low + high) // 2
+			position = start + middle * cls.entry.size
+			if index[position:position + cls.key_length] <= key:
+				low = middle + 1
+			else:
+				high = middle
+		if low == 0:
+			return None
+		entry_key, entry_id, file_number, offset, length = cls.entry.unpack_from(index, start + (low - 1) * cls.entry.size)
+		if entry_key != key:
+			return None
+		return (file_number, offset, length)
+
+	@classmethod
+	def _scan(cls, index, start, end, key, record_id, found):
+		for position in range(start, end - cls.entry.size + 1, cls.entry.size):
+			entry_key, entry_id, file_number, offset, length = cls.entry.unpack_from(index, position)
+			if entry_key == key or entry_id == record_id:
+				found = (file_number, offset, length)
+		return found
@@ -0,0 +1,93 @@
+import os
+import io
+import gzip
+
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+class ExportWriter:
+	""" Stream encoded records into export files between a prefix and suffix, starting a new file once the size limit is passed """
+
+	# File name extension for each export format
+	format_extensions = {"gmeta": ".json", "rifcs": ".xml", "jsonl": ".jsonl", "delete": ".txt"}
+	# File name extension added for each supported compression
+	compression_extensions = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+
+	def __init__(self, export_filepath, temp_filepath, size_limit, logger, export_format, prefix, suffix, separator, compression="none"):
+		self.export_filepath = export_filepath
+		self.temp_filepath = temp_filepath
+		self.size_limit = size_limit
+		self.logger = logger
+		self.export_format = export_format
+		self.prefix = prefix
+		self.suffix = suffix
+		self.separator = separator
+		self.compression = compression
+		self.batches = 0
+		self.entries = 0
+		self.buffer_size = 0
+		self.output = None
+		self.failed = False
+
+		try:
+			os.mkdir(self.temp_filepath)
+		except:
+			pass
+		self._open()
+
+	@classmethod
+	def file_name(cls, export_format, compression, batch_number=None):
+		""" Name of the last or only file of an export, or with batch_number of one of the numbered files before it """
+		basename = export_format if batch_number is None else export_format + "_" + str(batch_number)
+		return basename + cls.format_extensions[export_format] + cls.compression_extensions[compression]
+
+	@classmethod
+	def open_output(cls, filename, compression):
+		""" Open a text stream that compresses on the fly as it is written """
+		if compression == "gzip":
+			return gzip.open(filename, "wt", compresslevel=6)
+		if compression == "zstd":
+			if zstandard is None:
+				raise ValueError("zstd compression requires the zstandard package")
+			return io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(open(filename, "wb")), encoding="utf-8")
+		if compression == "none":
+			return open(filename, "w")
+		raise ValueError("Unknown export compression: {}".format(compression))
+
+	def _open(self):
+		self.temp_filename = os.path.join(self.temp_filepath, self.file_name(self.export_format, self.compression))
+		self.output = self.open_output(self.temp_filename, self.compression)
+		self.output.write(self.prefix)
+		self.entries = 0
+		self.buffer_size = 0
+
+	def write(self, entry):
+		""" Append one entry, already encoded as a string """
+		if self.entries:
+			self.output.write(self.separator)
+		self.output.write(entry)
+		self.entries += 1
+		self.buffer_size += len(entry)
+
+	def rotate_if_full(self):
+		""" Called before each record is considered, so a file is only closed when another record follows it """
+		if self.buffer_size > self.size_limit:
+			self.batches += 1
+			self.logger.debug("Writing batch {} to output file".format(self.batches))
+			self._close(self.file_name(self.export_format, self.compression, self.batches))
+			self._open()
+
+	def close(self):
+		""" Finish the last file, which is always named for the format without a number, e.g. gmeta.json plus any compression extension """
+		self._close(self.file_name(self.export_format, self.compression))
+
+	def _close(self, export_basename):
+		self.output.write(self.suffix)
+		self.output.close()
+		try:
+			os.rename(self.temp_filename, os.path.join(self.export_filepath, export_basename))
+		except:
+			self.failed = True
+			self.logger.error("Unable to move temp file {} into output file location {}".format(self.temp_filename, self.export_filepath))
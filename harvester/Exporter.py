@@ -5,282 +5,466 @@ import json
 import os
 import sys
 import html
+import hashlib
+import zlib
+import multiprocessing
+import shutil
+import pickle
+from harvester.ExportWriter import ExportWriter
+from harvester.JSONLinesWriter import JSONLinesWriter
+from harvester.JSONSerializer import JSONSerializer
+from harvester.DBInterface import DBInterface
+
+try:
+	from lxml import etree
+except ImportError:
+	etree = None
+
+# Set in the parent before export workers are forked, so the workers inherit it without pickling
+_fork_exporter = None
+
+def _export_record_range(job):
+	""" Runs in a worker process: render one record_id range into its own directory, using a new database connection """
+	exporter = _fork_exporter
+	part_number, record_range = job
+	exporter.db = DBInterface(exporter.db.params, migrate=False)
+	exporter.db.setLogger(exporter.logger)
+	part_filepath = os.path.join(exporter.temp_filepath, "part_" + str(part_number))
+	os.makedirs(part_filepath, exist_ok=True)
+	# Cache entries are left for the parent to write, so the workers do not wait on each other for the database lock
+	with open(os.path.join(part_filepath, "export_cache"), "wb") as exporter.cache_spool:
+		deleted = exporter._generate_records(part_filepath, part_filepath + "_tmp", exporter.changed_since, record_range)
+	return deleted, exporter.records_assembled, exporter.export_ok
 
 class Exporter(object):
 	""" Read records from the database and export to given formats """
 
 	__records_per_loop = 500
+	# Bump when a change to the exporter alters the rendered output, so cached entries are rendered again
+	__render_version = 3
 
 	def __init__(self, db, log, finalconfig):
 		self.db = db
 		self.logger = log
 		self.export_limit = finalconfig.get('export_file_limit_mb', 10)
+		self.export_workers = int(finalconfig.get('export_workers', 1))
+		self.compression = finalconfig.get('export_compression', "none")
+		if self.compression not in ExportWriter.compression_extensions:
+			raise ValueError("Export compression must be one of: {}".format(", ".join(ExportWriter.compression_extensions)))
+		self.validate_rifcs = finalconfig.get('validate_rifcs', False)
+		self.serializer = JSONSerializer(compact=finalconfig.get('compact_json', False))
+		self.rifcs_templates = None
+		self.rifcs_schema = None
+		self.cache_spool = None
+
+	def _generate_records_parallel(self, export_filepath, temp_filepath, changed_since=None):
+		""" Split the records into record_id ranges of equal size, render each in a worker process, then number the files in range order """
+		global _fork_exporter
+		jobs = list(enumerate(self._record_id_ranges(self.export_workers)))
+		self.logger.info("Exporter: rendering {} record ranges with {} worker processes".format(len(jobs), self.export_workers))
+
+		_fork_exporter = self
+		with multiprocessing.get_context("fork").Pool(self.export_workers) as pool:
+			results = pool.map(_export_record_range, jobs, chunksize=1)
+		_fork_exporter = None
 
-	def _construct_local_url(self, record):
-		# Check if the local_identifier has already been turned into a url
-		if "http" in record["local_identifier"].lower():
-			return record["local_identifier"]
-
-		# Check for OAI format of identifier (oai:domain:id)
-		oai_id = None
-		oai_search = re.search("oai:(.+):(.+)", record["local_identifier"])
-		if oai_search:
-			oai_id = oai_search.group(2)
-			# TODO: determine if this is needed for all repos, or just SFU?
-			oai_id = oai_id.replace("_", ":")
-
-		# If given a pattern then substitue in the item ID and return it
-		if "item_url_pattern" in record and record["item_url_pattern"]:
-			if oai_id:
-				local_url = re.sub("(\%id\%)", oai_id, record["item_url_pattern"])
-			else:
-				local_url = re.sub("(\%id\%)", record["local_identifier"], record["item_url_pattern"])
-			return local_url
-
-		# Check if the identifier is a DOI
-		doi = re.search("(doi|DOI):\s?\S+", record["local_identifier"])
-		if doi:
-			doi = doi.group(0).rstrip('\.')
-			local_url = re.sub("(doi|DOI):\s?", "http://dx.doi.org/", doi)
-			return local_url
-
-		# If the item has a source URL, use it
-		if ('source_url' in record) and record['source_url']:
-			return record['source_url']
-
-		# URL is in the identifier
-		local_url = re.search("(http|ftp|https)://([\w_-]+(?:(?:\.[\w_-]+)+))([\w.,@?^=%&:/~+#-]*[\w@?^=%&/~+#-])?",
-							  record["local_identifier"])
-		if local_url:
-			return local_url.group(0)
-
-		local_url = None
-		return local_url
-
-
-	def _generate_gmeta(self, export_filepath, temp_filepath, only_new_records):
-		self.logger.info("Exporter: generate_gmeta called")
-		gmeta = []
 		deleted = []
-
+		part_files = []
+		numbered_pattern = re.escape(self.export_format) + "_([0-9]+)" + re.escape(ExportWriter.file_name(self.export_format, self.compression)[len(self.export_format):]) + "$"
+		for (part_number, record_range), (part_deleted, part_assembled, part_ok) in zip(jobs, results):
+			deleted.extend(part_deleted)
+			if not part_ok:
+				self.export_ok = False
+			part_filepath = os.path.join(temp_filepath, "part_" + str(part_number))
+			if part_assembled == 0 and (part_files or part_number < len(jobs) - 1):
+				# Nothing rendered in this range; it would only add an empty file
+				continue
+			numbered = [f for f in os.listdir(part_filepath) if re.match(numbered_pattern, f)]
+			numbered.sort(key=lambda f: int(re.match(numbered_pattern, f).group(1)))
+			part_files.extend(os.path.join(part_filepath, f) for f in numbered + [ExportWriter.file_name(self.export_format, self.compression)])
+
+		for file_number, part_file in enumerate(part_files, 1):
+			export_basename = ExportWriter.file_name(self.export_format, self.compression, None if file_number == len(part_files) else file_number)
+			try:
+				os.rename(part_file, os.path.join(export_filepath, export_basename))
+			except:
+				self.export_ok = False
+				self.logger.error("Unable to move temp file {} into output file location {}".format(part_file, export_filepath))
+		for part_number, record_range in jobs:
+			self._write_spooled_cache(os.path.join(temp_filepath, "part_" + str(part_number), "export_cache"))
+			shutil.rmtree(os.path.join(temp_filepath, "part_" + str(part_number)), ignore_errors=True)
+			shutil.rmtree(os.path.join(temp_filepath, "part_" + str(part_number) + "_tmp"), ignore_errors=True)
+
+		self.records_assembled = sum(part_assembled for part_deleted, part_assembled, part_ok in results)
+		self.logger.info("{} size: {} items in {} files".format(self.export_format, self.records_assembled, len(part_files)))
+		return deleted
+
+	def _write_spooled_cache(self, filename):
+		""" Write the cache entries a worker process left in filename """
+		if not os.path.exists(filename):
+			return
+		with open(filename, "rb") as f:
+			while True:
+				try:
+					cache_entries = pickle.load(f)
+				except EOFError:
+					break
+				self._write_export_cache(cache_entries)
+
+	def _write_export_cache(self, cache_entries):
+		if self.cache_spool is not None:
+			pickle.dump(cache_entries, self.cache_spool)
+			return
 		try:
-			with open("data/last_run_timestamp", "r") as lastrun:
-				lastrun_timestamp = lastrun.read()
-		except:
-			lastrun_timestamp = 0
+			self.db.write_export_cache(cache_entries)
+		except self.db.dblayer.OperationalError as e:
+			# The cache only saves work on later exports, so a busy database is not a reason to fail this one
+			self.logger.warning("Unable to update export cache: {}".format(e))
+
+	def _record_id_ranges(self, count):
+		""" Boundaries that split the records table into count ranges holding about the same number of rows """
+		con = self.db.getConnection()
+		with con:
+			cur = con.cursor()
+			cur.execute("SELECT count(*), max(record_id) FROM records")
+			total, max_id = cur.fetchone()
+			boundaries = [0]
+			for part in range(1, count):
+				cur.execute(self.db._prep("SELECT record_id FROM records ORDER BY record_id LIMIT 1 OFFSET ?"), (total * part // count,))
+				row = cur.fetchone()
+				if row and int(row[0]) > boundaries[-1]:
+					boundaries.append(int(row[0]))
+		boundaries.append(int(max_id or 0) + 1)
+		return [(boundaries[i], boundaries[i + 1]) for i in range(len(boundaries) - 1)]
+
+	def _export_writer(self, export_filepath, temp_filepath, buffer_limit, changed_since):
+		if self.export_format == "jsonl":
+			# A full export starts from empty files, which were cleaned up first; others add to the end of what is there
+			return JSONLinesWriter(export_filepath, buffer_limit, self.logger, append=changed_since is not None)
+		if self.export_format == "rifcs":
+			return ExportWriter(export_filepath, temp_filepath, buffer_limit, self.logger, "rifcs", self.rifcs_templates["header"].template,
+				self.rifcs_templates["footer"].template, "", self.compression)
+		# The envelope is written around the entries by hand, so split an empty one where the list goes
+		envelope = self.serializer.dumps({"@datatype": "GIngest", "@version": "2016-11-09", "source_id": "ComputeCanada", "ingest_type": "GMetaList", "ingest_data": {"@datatype": "GMetaList", "@version": "2016-11-09", "gmeta": []}})
+		return ExportWriter(export_filepath, temp_filepath, buffer_limit, self.logger, "gmeta", envelope[:-3], envelope[-3:], self.serializer.separators[0], self.compression)
+
+	def _generate_records(self, export_filepath, temp_filepath, changed_since=None, record_range=None):
+		""" Export every record, or with changed_since only the records written or deleted since that time """
+		self.logger.info("Exporter: generating {} export".format(self.export_format))
+		if self.export_format in ["gmeta", "jsonl"]:
+			self.logger.debug("Exporter: encoding JSON with {}".format(self.serializer.backend if self.serializer.compact else "json"))
+		deleted = []
+		# Rendered GMetaEntry objects are cached, and are the same whether they go into a GMetaList or a line of their own
+		use_cache = self.export_format in ["gmeta", "jsonl"]
+		index_records = self.export_format == "jsonl"
+		if self.export_format == "rifcs":
+			self._load_rifcs_templates()
 
 		records_con = self.db.getConnection()
 		with records_con:
 			records_cursor = records_con.cursor()
 
-		records_cursor.execute(self.db._prep("""SELECT recs.record_id, recs.title, recs.pub_date, recs.contact, recs.series, recs.source_url, recs.deleted, recs.local_identifier, recs.modified_timestamp,
-			repos.repository_url, repos.repository_name, repos.repository_thumbnail, repos.item_url_pattern, repos.last_crawl_timestamp 
-			FROM records recs, repositories repos WHERE recs.repository_id = repos.repository_id """))
+		cache_columns = "cache.content_hash, cache.settings_hash, cache.rendered" if use_cache else "NULL, NULL, NULL"
+		cache_join = "LEFT JOIN export_cache cache on cache.record_id = recs.record_id" if use_cache else ""
+
+		# Records with no landing URL cannot be exported, so they are left out here rather than read and skipped
+		select_sql = """SELECT recs.record_id, recs.title, recs.pub_date, recs.contact, recs.series, recs.source_url, recs.deleted, recs.local_identifier, recs.modified_timestamp,
+			repos.repository_url, repos.repository_name, repos.repository_thumbnail, repos.item_url_pattern, repos.last_crawl_timestamp, recs.landing_url,
+			recs.content_hash, """ + cache_columns + """
+			FROM records recs """ + cache_join + """, repositories repos
+			WHERE recs.repository_id = repos.repository_id AND recs.landing_url <> ''"""
 
 		buffer_limit = int(self.export_limit) * 1024 * 1024
 		self.logger.info("Exporter: output file size limited to {} MB each".format(int(self.export_limit)))
 
 		records_assembled = 0
-		gmeta_batches = 0
-		buffer_size = 0
-		for row in records_cursor:
-			if buffer_size > buffer_limit:
-				gmeta_batches += 1
-				self.logger.debug("Writing batch {} to output file".format(gmeta_batches))
-				gingest_block = {"@datatype": "GIngest", "@version": "2016-11-09", "source_id": "ComputeCanada", "ingest_type": "GMetaList", "ingest_data": {"@datatype": "GMetaList", "@version": "2016-11-09", "gmeta":gmeta}}
-				self._write_to_file(json.dumps(gingest_block), export_filepath, temp_filepath, "gmeta", gmeta_batches)
-				gmeta = []
-				buffer_size = 0
-
-			record = (dict(zip(['record_id','title', 'pub_date', 'contact', 'series', 'source_url', 'deleted', 'local_identifier', 'modified_timestamp',
-				'repository_url', 'repository_name', 'repository_thumbnail', 'item_url_pattern',  'last_crawl_timestamp'], row)))
-			record["deleted"] = int(record["deleted"])
-
-			if only_new_records == True and float(lastrun_timestamp) > record["last_crawl_timestamp"]:
-				continue
-
-			if (len(record['title']) == 0):
-				continue
+		records_from_cache = 0
+		settings_hashes = {}
+		writer = self._export_writer(export_filepath, temp_filepath, buffer_limit, changed_since)
+		for rows in self._select_record_blocks(records_cursor, select_sql, changed_since, record_range):
+			block = []
+			for row in rows:
+				record = (dict(zip(['record_id','title', 'pub_date', 'contact', 'series', 'source_url', 'deleted', 'local_identifier', 'modified_timestamp',
+					'repository_url', 'repository_name', 'repository_thumbnail', 'item_url_pattern',  'last_crawl_timestamp'], row[:14])))
+				record["deleted"] = int(record["deleted"])
+				landing_url, content_hash, cached_content_hash, cached_settings_hash, cached_rendered = row[14:]
+				settings_key = (record["repository_name"], record["repository_thumbnail"], record["item_url_pattern"])
+				if settings_key not in settings_hashes:
+					settings_hashes[settings_key] = hashlib.sha1(json.dumps([self.__render_version, self.serializer.compact] + list(settings_key)).encode("utf-8")).hexdigest()
+				settings_hash = settings_hashes[settings_key]
+				if content_hash is None or content_hash != cached_content_hash or settings_hash != cached_settings_hash or record["deleted"] == 1:
+					cached_rendered = None
+				block.append((record, landing_url, content_hash, settings_hash, cached_rendered))
+			related = self._load_relations([record["record_id"] for record, landing_url, content_hash, settings_hash, cached_rendered in block
+				if record["deleted"] == 0 and cached_rendered is None])
+
+			cache_entries = []
+			for record, landing_url, content_hash, settings_hash, cached_rendered in block:
+				writer.rotate_if_full()
+
+				if cached_rendered is not None:
+					# Rendered from the same content and repository settings by an earlier export
+					if index_records:
+						writer.write(zlib.decompress(cached_rendered).decode("utf-8"), record["record_id"], landing_url)
+					else:
+						writer.write(zlib.decompress(cached_rendered).decode("utf-8"))
+					records_assembled += 1
+					records_from_cache += 1
+					if (records_assembled % 1000 == 0):
+						self.logger.info("Done processing {} records for export".format(records_assembled))
+					continue
+
+				if (len(record['title']) == 0):
+					continue
+
+				record["dc:source"] = landing_url
+
+				if record["deleted"] == 1:
+					deleted.append(record["dc:source"])
+					if index_records:
+						writer.delete(record["record_id"], record["dc:source"])
+					continue
+
+				record_id = record["record_id"]
+				if self.export_format == "rifcs":
+					entry = self._render_rifcs(record, related[record_id])
+					if entry is None:
+						continue
+				else:
+					entry = self.serializer.dumps(self._assemble_gmeta_entry(record, related[record_id]))
+				if index_records:
+					writer.write(entry, record_id, record["dc:source"])
+				else:
+					writer.write(entry)
+				if use_cache and content_hash is not None:
+					cache_entries.append((record_id, content_hash, settings_hash, zlib.compress(entry.encode("utf-8"))))
+				records_assembled += 1
+				if (records_assembled % 1000 == 0):
+					self.logger.info("Done processing {} records for export".format(records_assembled))
+
+			if cache_entries:
+				self._write_export_cache(cache_entries)
+
+		writer.close()
+		if writer.failed:
+			self.export_ok = False
+		self.records_assembled = records_assembled
+		self.logger.info("{} size: {} items in {} files, {} taken from the export cache".format(self.export_format, records_assembled, writer.batches + 1, records_from_cache))
+		return deleted
+
+	def _select_record_blocks(self, cursor, select_sql, changed_since, record_range):
+		""" Yield the rows to export a block at a time, each block its own short query so no read stays open while the cache is written """
+		if changed_since is None:
+			filters = ""
+			params = []
+			if record_range:
+				filters = " AND recs.record_id >= ? AND recs.record_id < ?"
+				params = list(record_range)
+			page_sql = self.db._prep(select_sql + " AND recs.record_id > ?" + filters + " ORDER BY recs.record_id LIMIT ?")
+			last_record_id = 0
+			while True:
+				cursor.execute(page_sql, [last_record_id] + params + [self.__records_per_loop])
+				rows = cursor.fetchall()
+				if not rows:
+					return
+				last_record_id = rows[-1][0]
+				yield rows
+
+		# The changed records are found through records_by_changed first; paged on record_id as well, the planner
+		# walks the primary key through the whole table instead
+		cursor.execute(self.db._prep("SELECT record_id FROM records WHERE changed_timestamp >= ?"), (changed_since,))
+		record_ids = sorted(int(row[0]) for row in cursor.fetchall())
+		if record_range:
+			record_ids = [record_id for record_id in record_ids if record_range[0] <= record_id < record_range[1]]
+		for i in range(0, len(record_ids), self.__records_per_loop):
+			chunk = record_ids[i:i + self.__records_per_loop]
+			cursor.execute(self.db._prep(select_sql + " AND recs.record_id IN ({}) ORDER BY recs.record_id".format(",".join("?" for record_id in chunk))), chunk)
+			rows = cursor.fetchall()
+			if rows:
+				yield rows
+
+	def _load_relations(self, record_ids):
+		""" Fetch the related rows for a block of records with one query per table, grouped by record_id """
+		related = {}
+		for record_id in record_ids:
+			related[record_id] = {"geospatial": [], "dc:contributor.author": [], "dc:contributor": [], "dc:subject": [], "dc:publisher": [],
+				"dc:rights": [], "dc:description": [], "frdr:description_fr": [], "frdr:tags": [], "frdr:tags_fr": [], "frdr:access": [], "domain_metadata": []}
+		if not record_ids:
+			return related
+
+		con = self.db.getConnection()
+		with con:
+			litecur = con.cursor()
+			if self.db.getType() == "sqlite":
+				litecur.row_factory = None
+
+			for row in self.db._select_in(litecur, "SELECT record_id, coordinate_type, lat, lon FROM geospatial WHERE record_id IN ({}) ORDER BY record_id, geospatial_id", record_ids):
+				related[row[0]]["geospatial"].append(row[1:])
+
+			for row in self.db._select_in(litecur, """SELECT records_x_creators.record_id, records_x_creators.is_contributor, creators.creator FROM creators
+				JOIN records_x_creators on records_x_creators.creator_id = creators.creator_id
+				WHERE records_x_creators.record_id IN ({}) ORDER BY records_x_creators.record_id, records_x_creators.records_x_creators_id""", record_ids):
+				if row[1] is not None and int(row[1]) == 0:
+					related[row[0]]["dc:contributor.author"].append(row[2])
+				elif row[1] is not None and int(row[1]) == 1:
+					related[row[0]]["dc:contributor"].append(row[2])
+
+			for field, table, column, crosstable, idcolumn in [("dc:subject", "subjects", "subject", "records_x_subjects", "subject_id"),
+				("dc:publisher", "publishers", "publisher", "records_x_publishers", "publisher_id"), ("dc:rights", "rights", "rights", "records_x_rights", "rights_id"),
+				("frdr:access", "access", "access", "records_x_access", "access_id")]:
+				for row in self.db._select_in(litecur, """SELECT {crosstable}.record_id, {table}.{column} FROM {table}
+					JOIN {crosstable} on {crosstable}.{idcolumn} = {table}.{idcolumn}
+					WHERE {crosstable}.record_id IN ({{}}) ORDER BY {crosstable}.record_id, {crosstable}.{crosstable}_id""".format(
+						table=table, column=column, crosstable=crosstable, idcolumn=idcolumn), record_ids):
+					related[row[0]][field].append(row[1])
+
+			for row in self.db._select_in(litecur, "SELECT record_id, language, description FROM descriptions WHERE record_id IN ({}) ORDER BY record_id, description_id", record_ids):
+				if row[1] == "en":
+					related[row[0]]["dc:description"].append(row[2])
+				elif row[1] == "fr":
+					related[row[0]]["frdr:description_fr"].append(row[2])
+
+			for row in self.db._select_in(litecur, """SELECT records_x_tags.record_id, tags.language, tags.tag FROM tags JOIN records_x_tags on records_x_tags.tag_id = tags.tag_id
+				WHERE records_x_tags.record_id IN ({}) ORDER BY records_x_tags.record_id, records_x_tags.records_x_tags_id""", record_ids):
+				if row[1] == "en":
+					related[row[0]]["frdr:tags"].append(row[2])
+				elif row[1] == "fr":
+					related[row[0]]["frdr:tags_fr"].append(row[2])
+
+			for row in self.db._select_in(litecur, """SELECT dm.record_id, ds.namespace, dm.field_name, dm.field_value FROM domain_metadata dm, domain_schemas ds
+				WHERE dm.schema_id=ds.schema_id and dm.record_id IN ({}) ORDER BY dm.record_id, dm.metadata_id""", record_ids):
+				related[row[0]]["domain_metadata"].append(row[1:])
+
+		return related
+
+	def _assemble_gmeta_entry(self, record, related):
+		record["frdr:geospatial"] = []
+		polycoordinates = []
 
-			record["dc:source"] = self._construct_local_url(record)
-			if record["dc:source"] is None:
-				continue
-
-			if record["deleted"] == 1:
-				deleted.append(record["dc:source"])
-				continue
-
-			con = self.db.getConnection()
-			with con:
-				if self.db.getType() == "sqlite":
-					from sqlite3 import Row
-					con.row_factory = Row
-					litecur = con.cursor()
-				elif self.db.getType() == "postgres":
-					litecur = con.cursor(cursor_factory=None)
-
-				litecur.execute(self.db._prep("SELECT coordinate_type, lat, lon FROM geospatial WHERE record_id=?"), (record["record_id"],) )
-				geodata = litecur.fetchall()
-				record["frdr:geospatial"] = []
-				polycoordinates = []
+		try:
+			for coordinate in related["geospatial"]:
+				if coordinate[0] == "Polygon":
+					polycoordinates.append([float(coordinate[1]), float(coordinate[2])])
+				else:
+					record["frdr:geospatial"].append({"frdr:geospatial_type":"Feature", "frdr:geospatial_geometry":{"frdr:geometry_type":coordinate[0], "frdr:geometry_coordinates": [float(coordinate[1]), float(coordinate[2])]}})
+		except:
+			pass
 
-				try:
-					for coordinate in geodata:
-						if coordinate[0] == "Polygon":
-							polycoordinates.append([float(coordinate[1]), float(coordinate[2])])
-						else:
-							record["frdr:geospatial"].append({"frdr:geospatial_type":"Feature", "frdr:geospatial_geometry":{"frdr:geometry_type":coordinate[0], "frdr:geometry_coordinates": [float(coordinate[1]), float(coordinate[2])]}})
-				except:
-					pass
-
-				if polycoordinates:
-					record["frdr:geospatial"].append({"frdr:geospatial_type":"Feature", "frdr:geospatial_geometry":{"frdr:geometry_type":"Polygon", "frdr:geometry_coordinates": polycoordinates}})
-
-			with con:
-				if self.db.getType() == "sqlite":
-					con.row_factory = lambda cursor, row: row[0]
-					litecur = con.cursor()
-				elif self.db.getType() == "postgres":
-					from psycopg2.extras import DictCursor as DictCursor
-					litecur = con.cursor(cursor_factory=DictCursor)
-
-				# attach the other values to the dict
-				litecur.execute(self.db._prep("""SELECT creators.creator FROM creators JOIN records_x_creators on records_x_creators.creator_id = creators.creator_id 
-					WHERE records_x_creators.record_id=? AND records_x_creators.is_contributor=0"""), (record["record_id"],) )
-				record["dc:contributor.author"] = litecur.fetchall()
-
-				litecur.execute(self.db._prep("""SELECT creators.creator FROM creators JOIN records_x_creators on records_x_creators.creator_id = creators.creator_id 
-					WHERE records_x_creators.record_id=? AND records_x_creators.is_contributor=1"""), (record["record_id"],) )
-				record["dc:contributor"] = litecur.fetchall()
-
-				litecur.execute(self.db._prep("""SELECT subjects.subject FROM subjects JOIN records_x_subjects on records_x_subjects.subject_id = subjects.subject_id 
-					WHERE records_x_subjects.record_id=?"""), (record["record_id"],) )
-				record["dc:subject"] = litecur.fetchall()
-
-				litecur.execute(self.db._prep("""SELECT publishers.publisher FROM publishers JOIN records_x_publishers on records_x_publishers.publisher_id = publishers.publisher_id 
-					WHERE records_x_publishers.record_id=?"""), (record["record_id"],) )
-				record["dc:publisher"] = litecur.fetchall()
-
-				litecur.execute(self.db._prep("""SELECT rights.rights FROM rights JOIN records_x_rights on records_x_rights.rights_id = rights.rights_id 
-					WHERE records_x_rights.record_id=?"""), (record["record_id"],) )
-				record["dc:rights"] = litecur.fetchall()
-
-				litecur.execute(self.db._prep("SELECT description FROM descriptions WHERE record_id=? and language='en' "), (record["record_id"],) )
-				record["dc:description"] = litecur.fetchall()
-
-				litecur.execute(self.db._prep("SELECT description FROM descriptions WHERE record_id=? and language='fr' "), (record["record_id"],) )
-				record["frdr:description_fr"] = litecur.fetchall()
-
-				litecur.execute(self.db._prep("""SELECT tags.tag FROM tags JOIN records_x_tags on records_x_tags.tag_id = tags.tag_id 
-					WHERE records_x_tags.record_id=? and tags.language = 'en' """), (record["record_id"],) )
-				record["frdr:tags"] = litecur.fetchall()
-
-				litecur.execute(self.db._prep("""SELECT tags.tag FROM tags JOIN records_x_tags on records_x_tags.tag_id = tags.tag_id 
-					WHERE records_x_tags.record_id=? and tags.language = 'fr' """), (record["record_id"],) )
-				record["frdr:tags_fr"] = litecur.fetchall()
-
-				litecur.execute(self.db._prep("""SELECT access.access FROM access JOIN records_x_access on records_x_access.access_id = access.access_id 
-					WHERE records_x_access.record_id=?"""), (record["record_id"],) )
-				record["frdr:access"] = litecur.fetchall()
-
-			domain_schemas = {}
-			with con:
-				if self.db.getType() == "sqlite":
-					from sqlite3 import Row
-					con.row_factory = Row
-					litecur = con.cursor()
-				elif self.db.getType() == "postgres":
-					litecur = con.cursor(cursor_factory=None)
-
-				litecur.execute(self.db._prep("SELECT ds.namespace, dm.field_name, dm.field_value FROM domain_metadata dm, domain_schemas ds WHERE dm.schema_id=ds.schema_id and dm.record_id=?"), (record["record_id"],) )
-				for row in litecur:
-					domain_namespace = str(row[0])
-					if domain_namespace not in domain_schemas.keys():
-						current_count = len(domain_schemas)
-						domain_schemas[domain_namespace] = "frdrcust" + str(current_count+1)
-					custom_label = domain_schemas[domain_namespace] + ":" + str(row[1])
-					record[custom_label] = str(row[2])
-
-			# Convert friendly column names into dc element names
-			record["dc:title"]         = record["title"]
-			record["dc:date"]          = record["pub_date"]
-			record["frdr:contact"]     = record["contact"]
-			record["frdr:series"]      = record["series"]
-			record["frdr:origin.id"]   = record["repository_name"]
-			record["frdr:origin.icon"] = record["repository_thumbnail"]
-
-			# remove unneeded columns from output
-			record.pop("contact", None)
-			record.pop("deleted", None)
-			record.pop("item_url_pattern", None)
-			record.pop("last_crawl_timestamp", None)
-			record.pop("local_identifier", None)
-			record.pop("modified_timestamp", None)
-			record.pop("pub_date", None)
-			record.pop("record_id", None)
-			record.pop("repository_name", None)
-			record.pop("repository_thumbnail", None)
-			record.pop("repository_url", None)
-			record.pop("series", None)
-			record.pop("source_url", None)
-			record.pop("title", None)
-
-			record["@context"] = {
-				"dc": "http://dublincore.org/documents/dcmi-terms", 
-				"frdr": "https://frdr.ca/schema/1.0", 
-				"datacite": "https://schema.labs.datacite.org/meta/kernel-4.0/metadata.xsd"
-			}
-			for custom_schema in domain_schemas:
-				short_label = domain_schemas[custom_schema]
-				record["@context"].update({short_label: custom_schema})
-			record["datacite:resourceTypeGeneral"] = "dataset"
-			gmeta_data = {"@datatype": "GMetaEntry", "@version": "2016-11-09", "subject": record["dc:source"], "id": record["dc:source"], "visible_to": ["public"], "mimetype": "application/json", "content": record}
-			gmeta.append(gmeta_data)
-
-			buffer_size = buffer_size + len(json.dumps(gmeta_data))
-			records_assembled += 1
-			if (records_assembled % 1000 == 0):
-				self.logger.info("Done processing {} records for export".format(records_assembled))
-
-		self.logger.info("gmeta size: {} items in {} files".format(records_assembled, gmeta_batches + 1))
-		return gmeta, deleted
-
-	def _validate_rifcs(self, rifcs):
-		self.logger.info("Exporter: _validate_rifs called")
-		with open('schema/registryObjects.xsd', 'r') as f:
-			schema_root = etree.XML(f.read())
-		schema = etree.XMLSchema(schema_root)
-		# Generate parser and fix any XML bugs from the templating.
-		xmlparser = etree.XMLParser(schema=schema, recover = True)
+		if polycoordinates:
+			record["frdr:geospatial"].append({"frdr:geospatial_type":"Feature", "frdr:geospatial_geometry":{"frdr:geometry_type":"Polygon", "frdr:geometry_coordinates": polycoordinates}})
+
+		# attach the other values to the dict
+		for field in ["dc:contributor.author", "dc:contributor", "dc:subject", "dc:publisher", "dc:rights", "dc:description", "frdr:description_fr",
+			"frdr:tags", "frdr:tags_fr", "frdr:access"]:
+			record[field] = related[field]
+
+		domain_schemas = {}
+		for row in related["domain_metadata"]:
+			domain_namespace = str(row[0])
+			if domain_namespace not in domain_schemas.keys():
+				current_count = len(domain_schemas)
+				domain_schemas[domain_namespace] = "frdrcust" + str(current_count+1)
+			custom_label = domain_schemas[domain_namespace] + ":" + str(row[1])
+			record[custom_label] = str(row[2])
+
+		# Convert friendly column names into dc element names
+		record["dc:title"]         = record["title"]
+		record["dc:date"]          = record["pub_date"]
+		record["frdr:contact"]     = record["contact"]
+		record["frdr:series"]      = record["series"]
+		record["frdr:origin.id"]   = record["repository_name"]
+		record["frdr:origin.icon"] = record["repository_thumbnail"]
+
+		# remove unneeded columns from output
+		record.pop("contact", None)
+		record.pop("deleted", None)
+		record.pop("item_url_pattern", None)
+		record.pop("last_crawl_timestamp", None)
+		record.pop("local_identifier", None)
+		record.pop("modified_timestamp", None)
+		record.pop("pub_date", None)
+		record.pop("record_id", None)
+		record.pop("repository_name", None)
+		record.pop("repository_thumbnail", None)
+		record.pop("repository_url", None)
+		record.pop("series", None)
+		record.pop("source_url", None)
+		record.pop("title", None)
+
+		record["@context"] = {
+			"dc": "http://dublincore.org/documents/dcmi-terms", 
+			"frdr": "https://frdr.ca/schema/1.0", 
+			"datacite": "https://schema.labs.datacite.org/meta/kernel-4.0/metadata.xsd"
+		}
+		for custom_schema in domain_schemas:
+			short_label = domain_schemas[custom_schema]
+			record["@context"].update({short_label: custom_schema})
+		record["datacite:resourceTypeGeneral"] = "dataset"
+		gmeta_data = {"@datatype": "GMetaEntry", "@version": "2016-11-09", "subject": record["dc:source"], "id": record["dc:source"], "visible_to": ["public"], "mimetype": "application/json", "content": record}
+		return gmeta_data
+
+	def _load_rifcs_templates(self):
+		""" Read the RIF-CS templates, and the schema if objects are to be validated, once per exporter """
+		if self.rifcs_templates is not None:
+			return
+		self.rifcs_templates = {}
+		for part in ["header", "object", "footer"]:
+			with open(os.path.join("templates", "rifcs_" + part + ".xml"), "r") as f:
+				self.rifcs_templates[part] = Template(f.read())
+
+		if self.validate_rifcs:
+			if etree is None:
+				raise ValueError("RIF-CS validation requires the lxml package")
+			# The schema imports others by paths relative to the working directory, so it is parsed from a string as before
+			with open('schema/registryObjects.xsd', 'r') as f:
+				schema_root = etree.XML(f.read())
+			self.rifcs_schema = etree.XMLSchema(schema_root)
+
+	def _render_rifcs(self, record, related):
+		""" Fill in the registryObject template for one record, or None if it is to be validated and is not valid """
+		values = {
+			"frdr_origin_id": record["repository_name"],
+			"dc_source": record["dc:source"],
+			"repository_url": record["repository_url"],
+			"dc_title": record["title"],
+			"dc_date": record["pub_date"],
+			"dc_rights": "\n".join(related["dc:rights"]),
+			"dc_description": "\n".join(related["dc:description"]),
+			"dc_contributor_author": "; ".join(related["dc:contributor.author"])
+		}
+		rifcs_object = self.rifcs_templates["object"].substitute({key: html.escape(str(value or "")) for key, value in values.items()})
+		if self.rifcs_schema is not None and not self._validate_rifcs(rifcs_object, record["dc:source"]):
+			return None
+		return rifcs_object
+
+	def _validate_rifcs(self, rifcs_object, source):
+		""" Check one registryObject against the schema, wrapped in the header and footer so it is a complete document """
 		try:
-			etree.fromstring(rifcs, xmlparser)
-			self.logger.info("Valid RIFCS Generated")
-		except etree.XMLSchemaError:
-			self.logger.error("Invalid RIFCS Generated")
-			raise SystemExit
+			document = etree.fromstring((self.rifcs_templates["header"].template + rifcs_object + self.rifcs_templates["footer"].template).encode("utf-8"))
+		except etree.XMLSyntaxError as e:
+			self.logger.error("Invalid RIFCS generated for {}: {}".format(source, e))
+			return False
+		if not self.rifcs_schema.validate(document):
+			self.logger.error("Invalid RIFCS generated for {}: {}".format(source, self.rifcs_schema.error_log.last_error))
+			return False
+		return True
 
 
-	def _write_to_file(self, output, export_filepath, temp_filepath, export_format, batch_number=False):
+	def _write_to_file(self, output, export_filepath, temp_filepath, export_format):
 		try:
 			os.mkdir(temp_filepath)
 		except:
 			pass
 
-		if batch_number:
-			export_basename = "gmeta_" + str(batch_number) + ".json"
-		elif export_format == "gmeta":
-			export_basename = "gmeta.json"
-		elif export_format == "rifcs":
-			export_basename = "rifcs.xml"
-		elif export_format == "delete":
-			export_basename = "delete.txt"
-
+		# The list of deleted records is small and read as plain text, so it is never compressed
+		export_basename = ExportWriter.file_name(export_format, "none")
 		temp_filename = os.path.join(temp_filepath, export_basename)
 
 		try:
-			with open(temp_filename, "w") as tempfile:
+			with ExportWriter.open_output(temp_filename, "none") as tempfile:
 				tempfile.write(output)
 		except:
+			self.export_ok = False
 			self.logger.error("Unable to write output data to temporary file: {}".format(temp_filename))
 
 		try:
@@ -291,10 +475,11 @@ class Exporter(object):
 		try:
 			os.rename(temp_filename, os.path.join(export_filepath, export_basename))
 		except:
+			self.export_ok = False
 			self.logger.error("Unable to move temp file {} into output file location {}".format(temp_filename, export_filepath))
 
 	def _cleanup_previous_exports(self, dirname, export_format):
-		pattern = export_format + '_?[\d]*\.[a-z]*$'
+		pattern = export_format + '_?[\d]*(\.[a-z]+)+$'
 		try:
 			for f in os.listdir(dirname):
 				if re.search(pattern, f):
@@ -302,25 +487,65 @@ class Exporter(object):
 		except:
 			pass
 
+	def _jsonl_index_missing(self):
+		""" True if there are JSON Lines files from an earlier export but not the index of them """
+		if os.path.exists(os.path.join(self.export_filepath, "jsonl.idx")):
+			return False
+		try:
+			return any(re.match(r"jsonl_\d+\.jsonl$", f) for f in os.listdir(self.export_filepath))
+		except OSError:
+			return False
+
 	def export_to_file(self, **kwargs):
 		for key, value in kwargs.items():
 			setattr(self, key, value)
-		output = None
-		self._cleanup_previous_exports(self.export_filepath, self.export_format)
+		delete_list = []
+		self.export_ok = True
+		# Taken before reading any records, so a record written during the export is picked up again next time
+		export_started = int(time.time())
+		watermark_setting = "export_watermark_" + self.export_format
+		self.changed_since = None
+		refreshed = self.db.refresh_landing_urls()
+		if refreshed:
+			self.logger.info("Exporter: resolved landing URLs for {} records".format(refreshed))
+		if self.only_new_records:
+			self.changed_since = int(self.db.get_setting(watermark_setting, 0))
+			if self.export_format == "jsonl" and self._jsonl_index_missing():
+				# Changed records appended to files the index does not cover could never be looked up, so everything is written again
+				self.logger.warning("Exporter: {} has JSON Lines files but no jsonl.idx; exporting every record instead of those changed since {}".format(
+					self.export_filepath, self.changed_since))
+				self.db.set_setting(watermark_setting, 0)
+				self.changed_since = None
+			else:
+				self.logger.info("Exporter: exporting records changed since {}".format(self.changed_since))
+		if self.export_format != "jsonl" or self.changed_since is None:
+			# JSON Lines exports of changed records are appended to the files already there
+			self._cleanup_previous_exports(self.export_filepath, self.export_format)
 		self._cleanup_previous_exports(self.export_filepath, "delete")
 		self._cleanup_previous_exports(self.temp_filepath, self.export_format)
 
-		if self.export_format == "gmeta":
-			gmeta_block, delete_list = self._generate_gmeta(self.export_filepath, self.temp_filepath, self.only_new_records)
-			output = json.dumps({"@datatype": "GIngest", "@version": "2016-11-09", "source_id": "ComputeCanada", "ingest_type": "GMetaList", "ingest_data": {"@datatype": "GMetaList", "@version": "2016-11-09", "gmeta":gmeta_block}})
-		elif self.export_format == "rifcs":
-			from lxml import etree
-			output = self._generate_rifcs()
+		if self.export_format == "jsonl" and self.compression != "none":
+			self.export_ok = False
+			self.logger.error("JSON Lines exports cannot be compressed, since the index gives byte offsets into the files")
+		elif self.export_format in ["gmeta", "rifcs", "jsonl"]:
+			if self.export_format == "rifcs":
+				# Loaded before any workers are forked, so they share the templates and compiled schema
+				self._load_rifcs_templates()
+			# The index refers to files by number as they are written, so JSON Lines are written by one process
+			if self.export_workers > 1 and self.export_format != "jsonl":
+				delete_list = self._generate_records_parallel(self.export_filepath, self.temp_filepath, self.changed_since)
+			else:
+				delete_list = self._generate_records(self.export_filepath, self.temp_filepath, self.changed_since)
 		else:
+			self.export_ok = False
 			self.logger.error("Unknown export format: {}".format(self.export_format))
 
-		if output:
-			self._write_to_file(output, self.export_filepath, self.temp_filepath, self.export_format)
 		if len(delete_list):
 			output = "\n".join(delete_list)
 			self._write_to_file(output, self.export_filepath, self.temp_filepath, "delete")
+
+		if self.export_ok:
+			self.db.set_setting(watermark_setting, export_started)
+			self.db.update_last_export()
+		else:
+			self.logger.error("Export was not completed; records changed since {} will be exported again".format(self.changed_since or 0))
@@ -63,8 +63,11 @@ class HarvestLogger:
 	def info(self, message):
 		self.logger.info(message)
 
-	def error(self, message):
+	def warning(self, message):
+		self.logger.warning(message)
+
+	def error(self, message, copytoemail=True):
 		self.logger.error(message)
-		if self.copyerrorstoemail:
+		if self.copyerrorstoemail and copytoemail:
 			self.mailLogger.error(message)
 
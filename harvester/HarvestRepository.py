@@ -1,6 +1,10 @@
 import time
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from harvester.TimeFormatter import TimeFormatter
+from harvester.RateLimiter import RateLimiter
+from harvester.LockedDatabase import LockedDatabase
 
 import urllib3
 urllib3.disable_warnings() #We are not loading any unsafe sites, just repos we trust
@@ -8,6 +12,11 @@ urllib3.disable_warnings() #We are not loading any unsafe sites, just repos we t
 class HarvestRepository(object):
 	""" Top level representation of a repository """
 
+	# Set by repository types that can list only the records changed since a given time
+	supports_incremental_crawl = False
+	# Cleared by repository types whose _update_record() cannot run in several threads at once
+	concurrent_updates = True
+
 	def __init__(self, globalParams):
 		defaultParams = {
 			'url': None,
@@ -18,10 +27,18 @@ class HarvestRepository(object):
 			'abort_after_numerrors': 5,
 			'max_records_updated_per_run': 100,
 			'update_log_after_numitems': 100,
+			'write_batch_size': 100,
+			'bulk_write_batch_size': 5000,
+			'bulk_load': False,
 			'record_refresh_days': 30,
 			'repo_refresh_days': 7,
 			'item_url_pattern': None,
 			'prune_non_dataset_items': False,
+			'full_harvest': False,
+			'full_harvest_days': 30,
+			'harvest_overlap_hours': 1,
+			'requests_per_second': 5,
+			'refresh_workers': 4,
 			'enabled': False,
 			'formatter': TimeFormatter(),
 			'error_count': 0,
@@ -34,11 +51,14 @@ class HarvestRepository(object):
 		for key, value in globalParams.items():
 			setattr(self, key, value)
 		self.repository_id = 0
+		# error_count is added to from the threads refreshing stale records
+		self.error_lock = threading.Lock()
 
 	def setRepoParams(self, repoParams):
 		""" Set local repo params and let them override the global config """
 		for key, value in repoParams.items():
 			setattr(self, key, value)
+		self.rate_limiter = RateLimiter.for_url(self.url, self.requests_per_second)
 
 	def setLogger(self, l):
 		self.logger = l
@@ -54,6 +74,8 @@ class HarvestRepository(object):
 		if self.repository_id == 0:
 			self.repository_id = self.db.get_repo_id(self.url, self.set)
 		self.last_crawl = self.db.get_repo_last_crawl(self.repository_id)
+		self.last_full_crawl = self.db.get_repo_last_full_crawl(self.repository_id)
+		self.full_crawl = self.full_crawl_due()
 
 		if self.last_crawl == 0:
 			self.logger.info("*** Repo: {}, type: {}, (last harvested: never)".format(self.name, self.type ) )
@@ -63,16 +85,59 @@ class HarvestRepository(object):
 		if (self.enabled):
 			if (self.last_crawl + self.repo_refresh_days*86400) < self.tstart:
 				try:
+					self.db.set_crawl_profile(True)
+					known_records = self.db.load_identity_map(self.repository_id)
+					self.logger.debug("Loaded {} known record identifiers".format(known_records))
+					if known_records == 0 or self.bulk_load:
+						self.logger.info("Loading records in bulk mode")
+						self.db.set_bulk_mode(True)
+					if not self.full_crawl:
+						self.logger.info("Harvesting records changed since the last harvest (last full harvest: {} ago)".format(self.formatter.humanize(self.tstart - self.last_full_crawl)))
 					self._crawl()
-					self.db.update_last_crawl(self.repository_id)
+					self.db.update_last_crawl(self.repository_id, self.tstart, self.full_crawl)
 				except Exception as e:
 					self.logger.error("Repository {} unable to be harvested: {}".format(self.name,e))
+				finally:
+					self.db.set_crawl_profile(False)
+					self.db.set_bulk_mode(False)
+					self.db.release_identity_map(self.repository_id)
 			else:
 				self.logger.info("This repo is not yet due to be harvested")
 		else:
 			self.logger.info("This repo is not enabled for harvesting")
 
 
+	def full_crawl_due(self):
+		""" Whether this crawl lists every record, rather than only those changed since the last crawl """
+		if not self.supports_incremental_crawl or self.full_harvest:
+			return True
+		if self.last_crawl == 0 or self.last_full_crawl == 0:
+			return True
+		return (self.last_full_crawl + self.full_harvest_days*86400) < self.tstart
+
+	def reconcile_records(self, identifiers):
+		""" Tombstone records no longer listed by a feed that is always crawled in full """
+		if not self.full_crawl:
+			# Records missing from a listing of recent changes have simply not changed
+			return
+		if not identifiers:
+			# An empty listing is more likely a feed problem than a repository with nothing in it
+			self.logger.info("No items found in feed, skipping check for removed records")
+			return
+		deleted_count, reappeared_count = self.db.reconcile_records(self.repository_id, identifiers)
+		self.logger.info("Marked {} records no longer in feed as deleted, {} deleted records reappeared".format(deleted_count, reappeared_count))
+
+	def get_write_batch_size(self):
+		if self.db.bulk_mode:
+			return self.bulk_write_batch_size
+		return self.write_batch_size
+
+	def count_error(self):
+		""" Add one to error_count, returning the new count """
+		with self.error_lock:
+			self.error_count = self.error_count + 1
+			return self.error_count
+
 	def _update_record(self, record):
 		""" This method to be overridden """
 		return True
@@ -91,18 +156,39 @@ class HarvestRepository(object):
 		stale_timestamp = int(time.time() - self.record_refresh_days*86400)
 
 		records = self.db.get_stale_records(stale_timestamp,self.repository_id, self.max_records_updated_per_run)
-		for record in records:
-			if record_count == 0:
-				self.logger.info("Started processing for {} records".format(len(records)) )
-
+		workers = self.refresh_workers if self.concurrent_updates else 1
+		if records:
+			self.logger.info("Started processing for {} records with {} workers at up to {} requests/sec".format(len(records), workers, self.requests_per_second))
+
+		# Requests overlap, bounded by the rate limiter, while database calls are made one at a time
+		db = self.db
+		self.db = LockedDatabase(db)
+		aborted = threading.Event()
+
+		def refresh(record):
+			if aborted.is_set():
+				return None
 			status = self._update_record(record)
 			if not status:
-				self.logger.error("Aborting due to errors after {} items updated in {} ({:.1f} items/sec)".format(record_count, self.formatter.humanize(time.time() - tstart), record_count/(time.time() - tstart + 0.1)))
-				break
-
-			record_count = record_count + 1
-			if (record_count % self.update_log_after_numitems == 0):
-				tdelta = time.time() - tstart + 0.1
-				self.logger.info("Done {} items after {} ({:.1f} items/sec)".format(record_count, self.formatter.humanize(tdelta), (record_count/tdelta)))
+				aborted.set()
+			return status
+
+		try:
+			with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+				for status in pool.map(refresh, records):
+					if not status:
+						self.logger.error("Aborting due to errors after {} items updated in {} ({:.1f} items/sec)".format(record_count, self.formatter.humanize(time.time() - tstart), record_count/(time.time() - tstart + 0.1)))
+						break
+
+					record_count = record_count + 1
+					if (record_count % self.update_log_after_numitems == 0):
+						tdelta = time.time() - tstart + 0.1
+						self.logger.info("Done {} items after {} ({:.1f} items/sec)".format(record_count, self.formatter.humanize(tdelta), (record_count/tdelta)))
+		finally:
+			self.db = db
 
 		self.logger.info("Updated {} items in {} ({:.1f} items/sec)".format(record_count, self.formatter.humanize(time.time() - tstart),record_count/(time.time() - tstart + 0.1)))
+		self.db.update_stale_count(self.repository_id, stale_timestamp)
+		write_stats = self.db.get_write_stats(self.repository_id)
+		self.logger.info("Records rewritten: {}, unchanged and skipped: {} ({:.1f}% skipped)".format(write_stats["written"], write_stats["unchanged"],
+			100.0 * write_stats["unchanged"] / max(write_stats["written"] + write_stats["unchanged"], 1)))
@@ -0,0 +1,59 @@
+import os
+import re
+from harvester.ExportIndex import ExportIndex
+from harvester.ExportWriter import ExportWriter
+
+class JSONLinesWriter:
+	""" Write encoded GMetaEntry objects one per line into numbered jsonl files, indexing where each one was written """
+
+	def __init__(self, export_filepath, size_limit, logger, append=False):
+		self.export_filepath = export_filepath
+		self.size_limit = size_limit
+		self.logger = logger
+		self.batches = 0
+		self.output = None
+		self.failed = False
+		self.index = ExportIndex(os.path.join(export_filepath, "jsonl.idx"), append)
+
+		# Files are always numbered and never renamed, since the index refers to them by number
+		self.file_number = 1
+		if append:
+			numbers = [int(m.group(1)) for m in (re.match(r"jsonl_([0-9]+)\.jsonl$", f) for f in os.listdir(export_filepath)) if m]
+			self.file_number = max(numbers, default=1)
+		self._open()
+
+	def _open(self):
+		self.filename = os.path.join(self.export_filepath, ExportWriter.file_name("jsonl", "none", self.file_number))
+		self.output = open(self.filename, "ab")
+		self.offset = self.output.tell()
+
+	def write(self, entry, record_id, source):
+		""" Append one entry, already encoded as a JSON string without newlines """
+		line = entry.encode("utf-8")
+		self.output.write(line + b"\n")
+		self.index.add(source, record_id, self.file_number, self.offset, len(line))
+		self.offset += len(line) + 1
+
+	def delete(self, record_id, source):
+		""" Index entries of length zero mark records deleted since they were written """
+		self.index.add(source, record_id, 0, 0, 0)
+
+	def rotate_if_full(self):
+		if self.offset > self.size_limit:
+			self.batches += 1
+			self.logger.debug("Starting output file {}".format(self.file_number + 1))
+			self._close()
+			self.file_number += 1
+			self._open()
+
+	def close(self):
+		self._close()
+		self.index.close()
+
+	def _close(self):
+		try:
+			self.output.close()
+			self.index.flush()
+		except:
+			self.failed = True
+			self.logger.error("Unable to write output file {}".format(self.filename))
@@ -0,0 +1,107 @@
+import codecs
+import json
+import math
+import re
+
+try:
+	import orjson
+except ImportError:
+	orjson = None
+
+try:
+	import ujson
+except ImportError:
+	ujson = None
+
+class JSONSerializer:
+	""" Encode JSON as the standard library does, or compact JSON with the fastest library installed, giving the same text whichever library is used """
+
+	# Preferred first; the standard library is always available
+	backends = ["orjson", "ujson", "json"]
+
+	# Numbers the fast libraries may write differently from Python's repr: exponents, and fractions below 1e-4.
+	# Searched for as plain text first, since a match inside a string only costs an unneeded rewrite. The pattern
+	# starts with a literal so the search is quick, and a match counts only after a digit, as words like "file1" are common
+	__exponent = re.compile("e[-+0-9]")
+	# Strings are matched first and left alone, so only numbers outside them are rewritten
+	__tokens = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|(-?[0-9]+(?:\.[0-9]+)?(?:[eE][-+]?[0-9]+)?)')
+	# Codec error handler escaping what the fast libraries leave unescaped; registered the first time one of them is used
+	error_handler = "harvester.JSONSerializer.escape"
+
+	def __init__(self, backend=None, compact=False):
+		installed = {"orjson": orjson is not None, "ujson": ujson is not None, "json": True}
+		if backend is None:
+			backend = [name for name in self.backends if installed[name]][0]
+		if backend not in installed:
+			raise ValueError("JSON backend must be one of: {}".format(", ".join(self.backends)))
+		if not installed[backend]:
+			raise ValueError("JSON backend {} is not installed".format(backend))
+		self.backend = backend
+		# The fast libraries only write compact JSON, and putting the spaces back costs more than they save
+		self.compact = compact
+		self.separators = (",", ":") if compact else (", ", ": ")
+		if compact and backend != "json":
+			self._register_error_handler()
+
+	def dumps(self, obj):
+		""" The same text as json.dumps(obj), or with compact json.dumps(obj, separators=(",", ":")): keys in insertion order, non-ASCII escaped, floats as repr() """
+		if self.compact and self.backend == "orjson":
+			try:
+				encoded = orjson.dumps(obj).decode("utf-8")
+				# orjson writes NaN and Infinity as null, where the standard library writes them as they are
+				if "null" not in encoded or not self._has_non_finite(obj):
+					return self._normalize(encoded)
+			except TypeError:
+				# Values orjson does not take, such as integers over 64 bits, go through the standard library
+				pass
+		elif self.compact and self.backend == "ujson":
+			try:
+				return self._normalize(ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False))
+			except (TypeError, OverflowError):
+				pass
+		return json.dumps(obj, separators=self.separators)
+
+	def _normalize(self, encoded):
+		if self._has_exponent(encoded) or "0.0000" in encoded:
+			encoded = self.__tokens.sub(self._format_number, encoded)
+		# Anything outside printable ASCII can only be inside a string, so it can be escaped after encoding
+		if not encoded.isascii():
+			encoded = encoded.encode("ascii", self.error_handler).decode("ascii")
+		if "\x7f" in encoded:
+			encoded = encoded.replace("\x7f", "\\u007f")
+		return encoded
+
+	def _has_exponent(self, encoded):
+		for match in self.__exponent.finditer(encoded):
+			if match.start() > 0 and encoded[match.start() - 1].isdigit():
+				return True
+		return False
+
+	@staticmethod
+	def _format_number(match):
+		number = match.group(1)
+		if number is None or not ("e" in number or "E" in number or "0.0000" in number):
+			return match.group(0)
+		return repr(float(number))
+
+	@classmethod
+	def _register_error_handler(cls):
+		try:
+			codecs.lookup_error(cls.error_handler)
+		except LookupError:
+			codecs.register_error(cls.error_handler, cls._escape_non_ascii)
+
+	@staticmethod
+	def _escape_non_ascii(error):
+		""" JSON escapes, with surrogate pairs above the BMP, as the standard library writes them """
+		return json.encoder.encode_basestring_ascii(error.object[error.start:error.end])[1:-1], error.end
+
+	@classmethod
+	def _has_non_finite(cls, obj):
+		if isinstance(obj, float):
+			return not math.isfinite(obj)
+		if isinstance(obj, dict):
+			return any(cls._has_non_finite(value) for value in obj.values())
+		if isinstance(obj, (list, tuple)):
+			return any(cls._has_non_finite(value) for value in obj)
+		return False
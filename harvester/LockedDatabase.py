@@ -0,0 +1,21 @@
+import threading
+from functools import wraps
+
+class LockedDatabase:
+	""" Pass calls on to a DBInterface one thread at a time, for records refreshed by several threads """
+
+	def __init__(self, db):
+		self.db = db
+		self.lock = threading.RLock()
+
+	def __getattr__(self, name):
+		value = getattr(self.db, name)
+		if not callable(value):
+			return value
+
+		@wraps(value)
+		def locked(*args, **kwargs):
+			with self.lock:
+				return value(*args, **kwargs)
+
+		return locked
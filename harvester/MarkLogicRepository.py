@@ -46,18 +46,19 @@ class MarkLogicRepository(HarvestRepository):
 				records = response.json()
 				if not records["results"]:
 					break
+				batch = []
 				for record in records["results"]:
 					oai_record = self.format_marklogic_to_oai(record)
 					if oai_record:
-						self.db.write_record(oai_record, self.repository_id, self.metadataprefix.lower(), self.domain_metadata)
+						batch.append((oai_record, self.domain_metadata))
+				self.db.write_records(batch, self.repository_id, self.metadataprefix.lower())
 				offset += self.records_per_request
 
 			return True
 
 		except Exception as e:
 			self.logger.error("Updating MarkLogic Repository failed: {}".format(e) )
-			self.error_count =  self.error_count + 1
-			if self.error_count < self.abort_after_numerrors:
+			if self.count_error() < self.abort_after_numerrors:
 				return True
 
 		return False
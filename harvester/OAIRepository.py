@@ -1,6 +1,6 @@
 from harvester.HarvestRepository import HarvestRepository
-from functools import wraps
-from sickle import Sickle
+from harvester.RateLimiter import rate_limited
+from sickle import Sickle, oaiexceptions
 from sickle.iterator import BaseOAIIterator, OAIItemIterator, OAIResponseIterator
 from sickle.models import OAIItem, Record, Header
 from sickle.oaiexceptions import BadArgument, CannotDisseminateFormat, IdDoesNotExist, NoSetHierarchy, \
@@ -10,6 +10,8 @@ import re
 import os.path
 import time
 import json
+import queue
+import threading
 #import dateparser
 #from time import strftime
 
@@ -44,7 +46,10 @@ class FRDRRecord(OAIItem):
 		return dict(fields)
 
 class FRDRItemIterator(BaseOAIIterator):
-	""" Modifed from Sickle.interator.OAIItemIterator to implement custom item mapping """
+	""" Modifed from Sickle.interator.OAIItemIterator to implement custom item mapping, with later pages fetched in the background """
+
+	# Pages fetched and parsed but not yet mapped; the fetch thread waits once this many are queued
+	prefetch_pages = 2
 
 	def __init__(self, sickle, params, ignore_deleted=False):
 		VERBS_ELEMENTS = {
@@ -57,11 +62,49 @@ class FRDRItemIterator(BaseOAIIterator):
 		}
 		self.mapper = FRDRRecord
 		self.element = VERBS_ELEMENTS[params.get('verb')]
+		self.pages = queue.Queue(maxsize=self.prefetch_pages)
+		self.stop_fetching = threading.Event()
 		super(FRDRItemIterator, self).__init__(sickle, params, ignore_deleted)
 
+	def _fetch_page(self, params):
+		""" Request one page and parse it once, where Sickle would parse it again for the error, the token and the items """
+		response = self.sickle.harvest(**params)
+		xml = response.xml
+		error = xml.find('.//' + self.sickle.oai_namespace + 'error')
+		if error is not None:
+			code = error.attrib.get('code', 'UNKNOWN')
+			description = error.text or ''
+			try:
+				raise getattr(oaiexceptions, code[0].upper() + code[1:])(description)
+			except AttributeError:
+				raise OAIError(description)
+		token = xml.find('.//' + self.sickle.oai_namespace + 'resumptionToken')
+		token = token.text if token is not None else None
+		return response, xml.findall('.//' + self.sickle.oai_namespace + self.element), token
+
 	def _next_response(self):
-		super(FRDRItemIterator, self)._next_response()
-		self._items = self.oai_response.xml.iterfind('.//' + self.sickle.oai_namespace + self.element)
+		""" Called by BaseOAIIterator for the first page only; the pages after it come from the fetch thread """
+		self.oai_response, items, self.resumption_token = self._fetch_page(self.params)
+		self._items = iter(items)
+		if self.resumption_token:
+			threading.Thread(target=self._fetch_pages, args=(self.resumption_token,), daemon=True).start()
+
+	def _fetch_pages(self, token):
+		""" Runs in the fetch thread, requesting each page as soon as the token for it has been read """
+		while token and not self.stop_fetching.is_set():
+			try:
+				page = self._fetch_page({'resumptionToken': token, 'verb': self.verb})
+				token = page[2]
+			except Exception as e:
+				# Handed over to be raised where the records are read, as it would have been without prefetching
+				page = e
+				token = None
+			while not self.stop_fetching.is_set():
+				try:
+					self.pages.put(page, timeout=1)
+					break
+				except queue.Full:
+					pass
 
 	def next(self):
 		"""Return the next record/header/set."""
@@ -71,14 +114,24 @@ class FRDRItemIterator(BaseOAIIterator):
 				if self.ignore_deleted and mapped.deleted:
 					continue
 				return mapped
-			if self.resumption_token and self.resumption_token.token:
-				self._next_response()
-			else:
+			if not self.resumption_token:
 				raise StopIteration
+			page = self.pages.get()
+			if isinstance(page, Exception):
+				self.resumption_token = None
+				raise page
+			self.oai_response, items, self.resumption_token = page
+			self._items = iter(items)
+
+	def close(self):
+		""" Stop the fetch thread, for a crawl that ends before the last page """
+		self.stop_fetching.set()
 
 class OAIRepository(HarvestRepository):
 	""" OAI Repository """
 
+	supports_incremental_crawl = True
+
 	def setRepoParams(self, repoParams):
 		self.metadataprefix = "oai_dc"
 		super(OAIRepository, self).setRepoParams(repoParams)
@@ -86,13 +139,18 @@ class OAIRepository(HarvestRepository):
 
 	def _crawl(self):
 		records = []
+		# Deleted records are listed too, so they can be marked deleted here rather than found one GetRecord at a time
+		params = {"metadataPrefix": self.metadataprefix}
+		if self.set is not None and self.set != "":
+			params["set"] = self.set
+		if not self.full_crawl:
+			params["from"] = self._from_date(self.last_crawl - self.harvest_overlap_hours*3600)
+			self.logger.info("Listing records changed since {}".format(params["from"]))
 
 		try:
-			if self.set is None or self.set == "":
-				records = self.sickle.ListRecords(metadataPrefix=self.metadataprefix, ignore_deleted=True)
-			else:
-				records = self.sickle.ListRecords(metadataPrefix=self.metadataprefix, ignore_deleted=True, set=self.set)
-		except:
+			records = self.sickle.ListRecords(**params)
+		except NoRecordsMatch:
+			# Any other error reaches crawl(), so the crawl is not recorded as done and the same changes are listed next time
 			self.logger.info("No items were found")
 
 		kwargs = {
@@ -103,11 +161,40 @@ class OAIRepository(HarvestRepository):
 			"repo_refresh_days": self.repo_refresh_days, "homepage_url": self.homepage_url
 		}
 		self.repository_id = self.db.update_repo(**kwargs)
+
+		try:
+			self._crawl_records(records)
+		finally:
+			if isinstance(records, FRDRItemIterator):
+				# Otherwise the fetch thread would be left waiting to queue a page nobody reads
+				records.close()
+
+	def _from_date(self, timestamp):
+		""" A from argument for ListRecords, as fine grained as the repository's Identify response says it supports """
+		granularity = "YYYY-MM-DD"
+		try:
+			granularity = self.sickle.Identify().granularity
+		except:
+			self.logger.debug("Unable to read granularity from Identify, using days")
+		if granularity == "YYYY-MM-DDThh:mm:ssZ":
+			return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(timestamp))
+		return time.strftime("%Y-%m-%d", time.gmtime(timestamp))
+
+	def _crawl_records(self, records):
 		item_count = 0
+		deleted_count = 0
+		batch = []
+		deleted = []
 
 		while records:
 			try:
 				record = records.next()
+				if record.deleted:
+					deleted.append(record.header.identifier)
+					if len(deleted) >= self.get_write_batch_size():
+						deleted_count = deleted_count + self.db.delete_records_by_identifier(self.repository_id, deleted)
+						deleted = []
+					continue
 				metadata = record.metadata
 
 				# Search for a hyperlink in the list of identifiers
@@ -132,7 +219,10 @@ class OAIRepository(HarvestRepository):
 				oai_record = self.unpack_oai_metadata(metadata)
 				domain_metadata = self.find_domain_metadata(metadata)
 
-				self.db.write_record(oai_record, self.repository_id, self.metadataprefix.lower(), domain_metadata)
+				batch.append((oai_record, domain_metadata))
+				if len(batch) >= self.get_write_batch_size():
+					self.db.write_records(batch, self.repository_id, self.metadataprefix.lower())
+					batch = []
 				item_count = item_count + 1
 				if (item_count % self.update_log_after_numitems == 0):
 					tdelta = time.time() - self.tstart + 0.1
@@ -147,7 +237,13 @@ class OAIRepository(HarvestRepository):
 			except StopIteration:
 				break
 
+		if batch:
+			self.db.write_records(batch, self.repository_id, self.metadataprefix.lower())
+		if deleted:
+			deleted_count = deleted_count + self.db.delete_records_by_identifier(self.repository_id, deleted)
 		self.logger.info("Processed {} items in feed".format(item_count))
+		if deleted_count:
+			self.logger.info("Marked {} records deleted in feed as deleted".format(deleted_count))
 
 	def unpack_oai_metadata(self, record):
 		record["pub_date"] = record.get("date")
@@ -321,40 +417,15 @@ class OAIRepository(HarvestRepository):
 				newRecord[elementName] = record.pop(elementName, None)
 		return newRecord
 
-	def _rate_limited(max_per_second):
-		""" Decorator that make functions not be called faster than a set rate """
-		threading = __import__('threading')
-		lock = threading.Lock()
-		min_interval = 1.0 / float(max_per_second)
-
-		def decorate(func):
-			last_time_called = [0.0]
-
-			@wraps(func)
-			def rate_limited_function(*args, **kwargs):
-				lock.acquire()
-				elapsed = time.clock() - last_time_called[0]
-				left_to_wait = min_interval - elapsed
-
-				if left_to_wait > 0:
-					time.sleep(left_to_wait)
-
-				lock.release()
-
-				ret = func(*args, **kwargs)
-				last_time_called[0] = time.clock()
-				return ret
-
-			return rate_limited_function
-
-		return decorate
-
-	@_rate_limited(5)
+	@rate_limited
 	def _update_record(self, record):
 		self.logger.debug("Updating OAI record {}".format(record['local_identifier']) )
 
 		try:
 			single_record = self.sickle.GetRecord(identifier=record["local_identifier"], metadataPrefix=self.metadataprefix)
+			if single_record.deleted:
+				self.db.delete_record(record)
+				return True
 
 			try:
 				metadata = single_record.metadata
@@ -386,8 +457,7 @@ class OAIRepository(HarvestRepository):
 			self.logger.error("Updating item failed (repo_id:{}, oai_id:{}): {}".format(self.repository_id, record['local_identifier'], e) )
 			# Touch the record so we do not keep requesting it on every run
 			self.db.touch_record(record)
-			self.error_count = self.error_count + 1
-			if self.error_count < self.abort_after_numerrors:
+			if self.count_error() < self.abort_after_numerrors:
 				return True
 
 		return False
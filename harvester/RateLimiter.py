@@ -0,0 +1,62 @@
+import time
+import threading
+from functools import wraps
+from urllib.parse import urlparse
+
+class RateLimiter:
+	""" Token bucket limiting the requests made to one host, shared by every repository and thread using that host """
+
+	hosts = {}
+	hosts_lock = threading.Lock()
+
+	def __init__(self, requests_per_second):
+		self.rate = float(requests_per_second)
+		# Up to one second of requests can be made at once after a pause
+		self.capacity = max(1.0, self.rate)
+		self.tokens = 1.0
+		self.updated = time.monotonic()
+		self.lock = threading.Lock()
+
+	@classmethod
+	def for_url(cls, url, requests_per_second):
+		""" The limiter for the host of a url; where repositories on one host ask for different rates, the lowest is used """
+		host = urlparse(url).netloc.lower()
+		with cls.hosts_lock:
+			limiter = cls.hosts.get(host)
+			if limiter is None:
+				limiter = cls.hosts[host] = cls(requests_per_second)
+			elif float(requests_per_second) < limiter.rate:
+				limiter.set_rate(requests_per_second)
+		return limiter
+
+	def set_rate(self, requests_per_second):
+		with self.lock:
+			self._refill()
+			self.rate = float(requests_per_second)
+			self.capacity = max(1.0, self.rate)
+			self.tokens = min(self.tokens, self.capacity)
+
+	def _refill(self):
+		now = time.monotonic()
+		self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+		self.updated = now
+
+	def acquire(self):
+		""" Wait until a request can be made """
+		while True:
+			with self.lock:
+				self._refill()
+				if self.tokens >= 1.0:
+					self.tokens -= 1.0
+					return
+				wait = (1.0 - self.tokens) / self.rate
+			time.sleep(wait)
+
+def rate_limited(func):
+	""" Decorator for repository methods making a request, so that they wait for the repository's rate limiter first """
+	@wraps(func)
+	def rate_limited_function(self, *args, **kwargs):
+		self.rate_limiter.acquire()
+		return func(self, *args, **kwargs)
+
+	return rate_limited_function
@@ -0,0 +1,28 @@
+class RepositoryLogger:
+	""" Log through a HarvestLogger with each line prefixed by the repository name, so concurrent harvests can be told apart """
+
+	def __init__(self, log, name):
+		self.log = log
+		self.prefix = "[{}] ".format(name)
+		# Kept here rather than on the shared logger, which other repositories are using at the same time
+		self.copyerrorstoemail = True
+		self.previouserrorstate = True
+
+	def setErrorsToEmail(self, newState):
+		self.previouserrorstate = self.copyerrorstoemail
+		self.copyerrorstoemail = newState
+
+	def restoreErrorsToEmail(self):
+		self.copyerrorstoemail = self.previouserrorstate
+
+	def debug(self, message):
+		self.log.debug(self.prefix + message)
+
+	def info(self, message):
+		self.log.info(self.prefix + message)
+
+	def warning(self, message):
+		self.log.warning(self.prefix + message)
+
+	def error(self, message):
+		self.log.error(self.prefix + message, self.copyerrorstoemail)
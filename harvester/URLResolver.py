@@ -0,0 +1,47 @@
+import re
+
+class URLResolver:
+	""" Work out the landing page URL of a record from its identifier, its repository's item_url_pattern and its source URL """
+
+	__oai_id = re.compile("oai:(.+):(.+)")
+	__id_placeholder = re.compile("(\\%id\\%)")
+	__doi = re.compile("(doi|DOI):\\s?\\S+")
+	__doi_prefix = re.compile("(doi|DOI):\\s?")
+	__url = re.compile("(http|ftp|https)://([\\w_-]+(?:(?:\\.[\\w_-]+)+))([\\w.,@?^=%&:/~+#-]*[\\w@?^=%&/~+#-])?")
+
+	def resolve(self, local_identifier, item_url_pattern=None, source_url=None):
+		""" The landing URL, or None if none can be made for this record """
+		# Check if the local_identifier has already been turned into a url
+		if "http" in local_identifier.lower():
+			return local_identifier
+
+		# Check for OAI format of identifier (oai:domain:id)
+		oai_id = None
+		oai_search = self.__oai_id.search(local_identifier)
+		if oai_search:
+			oai_id = oai_search.group(2)
+			# TODO: determine if this is needed for all repos, or just SFU?
+			oai_id = oai_id.replace("_", ":")
+
+		# If given a pattern then substitue in the item ID and return it
+		if item_url_pattern:
+			if oai_id:
+				return self.__id_placeholder.sub(oai_id, item_url_pattern)
+			return self.__id_placeholder.sub(local_identifier, item_url_pattern)
+
+		# Check if the identifier is a DOI
+		doi = self.__doi.search(local_identifier)
+		if doi:
+			doi = doi.group(0).rstrip('\\.')
+			return self.__doi_prefix.sub("http://dx.doi.org/", doi)
+
+		# If the item has a source URL, use it
+		if source_url:
+			return source_url
+
+		# URL is in the identifier
+		local_url = self.__url.search(local_identifier)
+		if local_url:
+			return local_url.group(0)
+
+		return None
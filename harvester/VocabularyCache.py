@@ -0,0 +1,39 @@
+from collections import OrderedDict
+
+class VocabularyCache:
+	""" Bounded LRU map of vocabulary table values to their ids """
+
+	def __init__(self, maxsize=10000):
+		self.maxsize = int(maxsize)
+		self.entries = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, tablename, value, filters=()):
+		key = (tablename, value)
+		if key in self.entries and filters in self.entries[key]:
+			self.entries.move_to_end(key)
+			self.hits += 1
+			return self.entries[key][filters]
+		self.misses += 1
+		return None
+
+	def put(self, tablename, value, filters, id):
+		if self.maxsize <= 0:
+			return
+		key = (tablename, value)
+		if key not in self.entries:
+			self.entries[key] = {}
+		self.entries[key][filters] = id
+		self.entries.move_to_end(key)
+		while len(self.entries) > self.maxsize:
+			self.entries.popitem(last=False)
+
+	def invalidate(self, tablename, value):
+		self.entries.pop((tablename, value), None)
+
+	def summary(self):
+		lookups = self.hits + self.misses
+		hit_rate = 100.0 * self.hits / lookups if lookups else 0.0
+		return "{} hits, {} misses ({:.1f}% hit rate), {} of {} entries used".format(
+			self.hits, self.misses, hit_rate, len(self.entries), self.maxsize)
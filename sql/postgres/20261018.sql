@@ -0,0 +1 @@
+alter table records add column content_hash VARCHAR(100);
\ No newline at end of file
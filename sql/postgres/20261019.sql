@@ -0,0 +1 @@
+create index IF NOT EXISTS records_by_repository_deleted_modified on records (repository_id, deleted, modified_timestamp);
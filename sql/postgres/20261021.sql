@@ -0,0 +1,16 @@
+create table if not exists repository_stats (
+	repository_id INTEGER PRIMARY KEY NOT NULL,
+	active_count INTEGER NOT NULL DEFAULT 0,
+	deleted_count INTEGER NOT NULL DEFAULT 0,
+	stale_count INTEGER NOT NULL DEFAULT 0,
+	last_crawl_timestamp INTEGER,
+	last_export_timestamp INTEGER);
+-- Fill it for the repositories already harvested; repositories added later get their row when they are added
+insert into repository_stats (repository_id, active_count, deleted_count, stale_count, last_crawl_timestamp)
+	select repos.repository_id,
+		coalesce(sum(case when recs.deleted = 0 then 1 else 0 end), 0),
+		coalesce(sum(case when recs.deleted = 1 then 1 else 0 end), 0),
+		coalesce(sum(case when recs.deleted = 0 and recs.modified_timestamp < extract(epoch from now()) - coalesce(repos.record_refresh_days, 30) * 86400 then 1 else 0 end), 0),
+		repos.last_crawl_timestamp
+	from repositories repos left join records recs on recs.repository_id = repos.repository_id
+	group by repos.repository_id, repos.last_crawl_timestamp;
\ No newline at end of file
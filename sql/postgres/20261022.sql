@@ -0,0 +1,3 @@
+alter table records add column changed_timestamp INTEGER;
+update records set changed_timestamp = modified_timestamp;
+create index IF NOT EXISTS records_by_changed on records (changed_timestamp);
\ No newline at end of file
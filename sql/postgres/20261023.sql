@@ -0,0 +1,5 @@
+create table if not exists export_cache (
+	record_id INTEGER PRIMARY KEY NOT NULL,
+	content_hash VARCHAR(100),
+	settings_hash VARCHAR(100),
+	rendered BYTEA);
\ No newline at end of file
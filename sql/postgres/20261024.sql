@@ -0,0 +1,3 @@
+alter table records add column landing_url TEXT;
+create index IF NOT EXISTS records_by_landing_url on records (landing_url);
+alter table repositories add column landing_url_pattern TEXT;
\ No newline at end of file
@@ -0,0 +1,57 @@
+-- Merge duplicate vocabulary rows and cross rows so that they can be protected by unique indexes
+
+UPDATE records_x_creators SET creator_id = (SELECT min(d.creator_id) FROM creators d JOIN creators o ON d.creator = o.creator WHERE o.creator_id = records_x_creators.creator_id)
+	WHERE creator_id IN (SELECT creator_id FROM creators WHERE creator IS NOT NULL AND creator_id NOT IN (SELECT min(creator_id) FROM creators GROUP BY creator));
+DELETE FROM creators WHERE creator_id IN (SELECT creator_id FROM creators WHERE creator IS NOT NULL AND creator_id NOT IN (SELECT min(creator_id) FROM creators GROUP BY creator));
+DELETE FROM records_x_creators WHERE records_x_creators_id NOT IN (SELECT min(records_x_creators_id) FROM records_x_creators GROUP BY record_id, creator_id);
+DROP INDEX IF EXISTS creators_by_creator;
+CREATE UNIQUE INDEX creators_unique on creators(creator);
+CREATE UNIQUE INDEX records_x_creators_unique on records_x_creators(record_id, creator_id);
+
+UPDATE records_x_subjects SET subject_id = (SELECT min(d.subject_id) FROM subjects d JOIN subjects o ON d.subject = o.subject WHERE o.subject_id = records_x_subjects.subject_id)
+	WHERE subject_id IN (SELECT subject_id FROM subjects WHERE subject IS NOT NULL AND subject_id NOT IN (SELECT min(subject_id) FROM subjects GROUP BY subject));
+DELETE FROM subjects WHERE subject_id IN (SELECT subject_id FROM subjects WHERE subject IS NOT NULL AND subject_id NOT IN (SELECT min(subject_id) FROM subjects GROUP BY subject));
+DELETE FROM records_x_subjects WHERE records_x_subjects_id NOT IN (SELECT min(records_x_subjects_id) FROM records_x_subjects GROUP BY record_id, subject_id);
+DROP INDEX IF EXISTS subjects_by_subject;
+CREATE UNIQUE INDEX subjects_unique on subjects(subject);
+CREATE UNIQUE INDEX records_x_subjects_unique on records_x_subjects(record_id, subject_id);
+
+UPDATE records_x_publishers SET publisher_id = (SELECT min(d.publisher_id) FROM publishers d JOIN publishers o ON d.publisher = o.publisher WHERE o.publisher_id = records_x_publishers.publisher_id)
+	WHERE publisher_id IN (SELECT publisher_id FROM publishers WHERE publisher IS NOT NULL AND publisher_id NOT IN (SELECT min(publisher_id) FROM publishers GROUP BY publisher));
+DELETE FROM publishers WHERE publisher_id IN (SELECT publisher_id FROM publishers WHERE publisher IS NOT NULL AND publisher_id NOT IN (SELECT min(publisher_id) FROM publishers GROUP BY publisher));
+DELETE FROM records_x_publishers WHERE records_x_publishers_id NOT IN (SELECT min(records_x_publishers_id) FROM records_x_publishers GROUP BY record_id, publisher_id);
+DROP INDEX IF EXISTS publishers_by_publisher;
+CREATE UNIQUE INDEX publishers_unique on publishers(publisher);
+CREATE UNIQUE INDEX records_x_publishers_unique on records_x_publishers(record_id, publisher_id);
+
+UPDATE records_x_access SET access_id = (SELECT min(d.access_id) FROM access d JOIN access o ON d.access = o.access WHERE o.access_id = records_x_access.access_id)
+	WHERE access_id IN (SELECT access_id FROM access WHERE access IS NOT NULL AND access_id NOT IN (SELECT min(access_id) FROM access GROUP BY access));
+DELETE FROM access WHERE access_id IN (SELECT access_id FROM access WHERE access IS NOT NULL AND access_id NOT IN (SELECT min(access_id) FROM access GROUP BY access));
+DELETE FROM records_x_access WHERE records_x_access_id NOT IN (SELECT min(records_x_access_id) FROM records_x_access GROUP BY record_id, access_id);
+DROP INDEX IF EXISTS access_by_access;
+CREATE UNIQUE INDEX access_unique on access(access);
+CREATE UNIQUE INDEX records_x_access_unique on records_x_access(record_id, access_id);
+
+UPDATE records_x_tags SET tag_id = (SELECT min(d.tag_id) FROM tags d JOIN tags o ON d.tag = o.tag AND d.language = o.language WHERE o.tag_id = records_x_tags.tag_id)
+	WHERE tag_id IN (SELECT tag_id FROM tags WHERE tag IS NOT NULL AND language IS NOT NULL AND tag_id NOT IN (SELECT min(tag_id) FROM tags GROUP BY tag, language));
+DELETE FROM tags WHERE tag_id IN (SELECT tag_id FROM tags WHERE tag IS NOT NULL AND language IS NOT NULL AND tag_id NOT IN (SELECT min(tag_id) FROM tags GROUP BY tag, language));
+DELETE FROM records_x_tags WHERE records_x_tags_id NOT IN (SELECT min(records_x_tags_id) FROM records_x_tags GROUP BY record_id, tag_id);
+DROP INDEX IF EXISTS tags_by_tag;
+CREATE UNIQUE INDEX tags_unique on tags(tag, language);
+CREATE UNIQUE INDEX records_x_tags_unique on records_x_tags(record_id, tag_id);
+
+UPDATE records_x_rights SET rights_id = (SELECT min(d.rights_id) FROM rights d JOIN rights o ON d.rights_hash = o.rights_hash WHERE o.rights_id = records_x_rights.rights_id)
+	WHERE rights_id IN (SELECT rights_id FROM rights WHERE rights_hash IS NOT NULL AND rights_id NOT IN (SELECT min(rights_id) FROM rights GROUP BY rights_hash));
+DELETE FROM rights WHERE rights_id IN (SELECT rights_id FROM rights WHERE rights_hash IS NOT NULL AND rights_id NOT IN (SELECT min(rights_id) FROM rights GROUP BY rights_hash));
+DELETE FROM records_x_rights WHERE records_x_rights_id NOT IN (SELECT min(records_x_rights_id) FROM records_x_rights GROUP BY record_id, rights_id);
+DROP INDEX IF EXISTS rights_by_right_hash;
+CREATE UNIQUE INDEX rights_unique on rights(rights_hash);
+CREATE UNIQUE INDEX records_x_rights_unique on records_x_rights(record_id, rights_id);
+
+UPDATE domain_metadata SET schema_id = (SELECT min(d.schema_id) FROM domain_schemas d JOIN domain_schemas o ON d.namespace = o.namespace WHERE o.schema_id = domain_metadata.schema_id)
+	WHERE schema_id IN (SELECT schema_id FROM domain_schemas WHERE namespace IS NOT NULL AND schema_id NOT IN (SELECT min(schema_id) FROM domain_schemas GROUP BY namespace));
+DELETE FROM domain_schemas WHERE schema_id IN (SELECT schema_id FROM domain_schemas WHERE namespace IS NOT NULL AND schema_id NOT IN (SELECT min(schema_id) FROM domain_schemas GROUP BY namespace));
+CREATE UNIQUE INDEX domain_schemas_unique on domain_schemas(namespace);
+
+DELETE FROM descriptions WHERE description_hash IS NOT NULL AND description_id NOT IN (SELECT min(description_id) FROM descriptions GROUP BY record_id, language, description_hash);
+CREATE UNIQUE INDEX descriptions_unique on descriptions(record_id, language, description_hash);
\ No newline at end of file
@@ -0,0 +1,5 @@
+create table if not exists export_cache (
+	record_id INTEGER PRIMARY KEY NOT NULL,
+	content_hash TEXT,
+	settings_hash TEXT,
+	rendered BLOB);
\ No newline at end of file
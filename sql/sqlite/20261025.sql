@@ -0,0 +1 @@
+alter table repositories add column last_full_crawl_timestamp INTEGER;
\ No newline at end of file
@@ -0,0 +1,44 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from helpers import ROOT, ListLogger, add_repository
+
+sys.path.insert(0, ROOT)
+from harvester.DBInterface import DBInterface
+
+
+@pytest.fixture(scope="session", autouse=True)
+def repository_root():
+	""" Migrations, templates and schemas are read by paths relative to the repository root """
+	cwd = os.getcwd()
+	os.chdir(ROOT)
+	yield ROOT
+	os.chdir(cwd)
+
+
+@pytest.fixture
+def logger():
+	return ListLogger()
+
+
+@pytest.fixture
+def make_db(tmp_path, logger):
+	""" A migrated sqlite database in the test's directory """
+	def make(name="harvester.db", **params):
+		db = DBInterface(dict({"type": "sqlite", "dbname": str(tmp_path / name)}, **params))
+		db.setLogger(logger)
+		return db
+	return make
+
+
+@pytest.fixture
+def db(make_db):
+	return make_db()
+
+
+@pytest.fixture
+def repo_id(db):
+	return add_repository(db)
@@ -0,0 +1,327 @@
+BEGIN TRANSACTION;
+CREATE TABLE access (
+	access_id INTEGER PRIMARY KEY NOT NULL,
+	access TEXT);
+INSERT INTO "access" VALUES(1,'Public');
+CREATE TABLE creators (
+	creator_id INTEGER PRIMARY KEY NOT NULL,
+	creator TEXT);
+INSERT INTO "creators" VALUES(1,'Creator 8');
+INSERT INTO "creators" VALUES(2,'Creator 36');
+INSERT INTO "creators" VALUES(3,'Creator 5');
+INSERT INTO "creators" VALUES(4,'Creator 31');
+INSERT INTO "creators" VALUES(5,'Creator 48');
+INSERT INTO "creators" VALUES(6,'Creator 13');
+INSERT INTO "creators" VALUES(7,'Creator 6');
+INSERT INTO "creators" VALUES(8,'Creator 27');
+INSERT INTO "creators" VALUES(9,'Creator 38');
+INSERT INTO "creators" VALUES(10,'Creator 46');
+INSERT INTO "creators" VALUES(11,'Creator 14');
+INSERT INTO "creators" VALUES(12,'Creator 1');
+INSERT INTO "creators" VALUES(13,'Creator 41');
+INSERT INTO "creators" VALUES(14,'Creator 43');
+INSERT INTO "creators" VALUES(15,'Creator 11');
+INSERT INTO "creators" VALUES(16,'Creator 22');
+INSERT INTO "creators" VALUES(17,'Creator 18');
+INSERT INTO "creators" VALUES(18,'Creator 40');
+INSERT INTO "creators" VALUES(19,'Creator 45');
+CREATE TABLE descriptions (
+	description_id INTEGER PRIMARY KEY NOT NULL,
+	record_id INTEGER NOT NULL, 
+	description TEXT,
+	description_hash TEXT, 
+	language TEXT);
+INSERT INTO "descriptions" VALUES(1,1,'Description 0 é','67fcd496a62c6aea58c659539a2537a6ed860929','en');
+INSERT INTO "descriptions" VALUES(2,2,'Description 1 é','a53b14b00e3b04d968f51397538e03d87db7caac','en');
+INSERT INTO "descriptions" VALUES(3,3,'Description 2 é','bf757aca86eb3ce0da319365cd651380b768bb7a','en');
+INSERT INTO "descriptions" VALUES(4,4,'Description 3 é','1c06906ce68301a8994f9ac00e975c7cd381bf7b','en');
+INSERT INTO "descriptions" VALUES(5,5,'Description 4 é','b4c820b963fb6a3d5de0776ddceeb9b7756ed726','en');
+INSERT INTO "descriptions" VALUES(6,6,'Description 5 é','40b560c8bf99ae6b9e90bbee58c394443df2064e','en');
+INSERT INTO "descriptions" VALUES(7,7,'Description 6 é','298a5bfe1b6215b0fbc06769d1204114d5b32f01','en');
+INSERT INTO "descriptions" VALUES(8,8,'Description 7 é','f62a3653c6432801a93fcbd313008a5e50f31cb2','en');
+INSERT INTO "descriptions" VALUES(9,9,'Description 8 é','4909938ed4c4158fe944ce8e9e0045534b59258d','en');
+INSERT INTO "descriptions" VALUES(10,10,'Description 9 é','d66d664dbe7c302a39defac0ce888af4c91bcc72','en');
+CREATE TABLE domain_metadata (
+	metadata_id INTEGER PRIMARY KEY NOT NULL,
+	schema_id INTEGER NOT NULL, 
+	record_id INTEGER NOT NULL, 
+	field_name TEXT, 
+	field_value TEXT);
+INSERT INTO "domain_metadata" VALUES(1,1,1,'field','value 0');
+INSERT INTO "domain_metadata" VALUES(2,1,1,'field','second');
+INSERT INTO "domain_metadata" VALUES(3,1,6,'field','value 5');
+INSERT INTO "domain_metadata" VALUES(4,1,6,'field','second');
+CREATE TABLE domain_schemas (
+	schema_id INTEGER PRIMARY KEY NOT NULL, 
+	namespace TEXT);
+INSERT INTO "domain_schemas" VALUES(1,'http://schema.example/ns');
+CREATE TABLE geospatial (
+	geospatial_id INTEGER PRIMARY KEY NOT NULL,
+	record_id INTEGER NOT NULL, 
+	coordinate_type TEXT, 
+	lat NUMERIC, 
+	lon NUMERIC);
+INSERT INTO "geospatial" VALUES(1,1,'Polygon',49.1,-123.1);
+INSERT INTO "geospatial" VALUES(2,1,'Polygon',49.2,-123.2);
+INSERT INTO "geospatial" VALUES(3,5,'Polygon',49.1,-123.1);
+INSERT INTO "geospatial" VALUES(4,5,'Polygon',49.2,-123.2);
+INSERT INTO "geospatial" VALUES(5,9,'Polygon',49.1,-123.1);
+INSERT INTO "geospatial" VALUES(6,9,'Polygon',49.2,-123.2);
+CREATE TABLE publishers (
+	publisher_id INTEGER PRIMARY KEY NOT NULL,
+	publisher TEXT);
+INSERT INTO "publishers" VALUES(1,'Publisher 0');
+INSERT INTO "publishers" VALUES(2,'Publisher 1');
+INSERT INTO "publishers" VALUES(3,'Publisher 2');
+INSERT INTO "publishers" VALUES(4,'Publisher 3');
+INSERT INTO "publishers" VALUES(5,'Publisher 4');
+CREATE TABLE records (
+	record_id INTEGER PRIMARY KEY NOT NULL,
+	repository_id INTEGER NOT NULL,
+	title TEXT,pub_date TEXT,
+	modified_timestamp INTEGER DEFAULT 0,
+	source_url TEXT,
+	deleted NUMERIC DEFAULT 0,
+	local_identifier TEXT,
+	series TEXT,
+	contact TEXT);
+INSERT INTO "records" VALUES(1,1,'Title 0 0','2017-01-01',1.79232560987252521507e+09,'http://repository.example/item/0',0,'oai:test:0','','contact@repository.example');
+INSERT INTO "records" VALUES(2,1,'Title 1 0','2017-01-02',1792325609.88841,'http://repository.example/item/1',0,'oai:test:1','','contact@repository.example');
+INSERT INTO "records" VALUES(3,1,'Title 2 0','2017-01-03',1.7923256099003551006e+09,'http://repository.example/item/2',0,'oai:test:2','','contact@repository.example');
+INSERT INTO "records" VALUES(4,1,'Title 3 0','2017-01-04',1.79232560991246509547e+09,'http://repository.example/item/3',0,'oai:test:3','','contact@repository.example');
+INSERT INTO "records" VALUES(5,1,'Title 4 0','2017-01-05',1.79232560992649245256e+09,'http://repository.example/item/4',0,'oai:test:4','','contact@repository.example');
+INSERT INTO "records" VALUES(6,1,'Title 5 0','2017-01-06',1.79232560993682336807e+09,'http://repository.example/item/5',0,'oai:test:5','','contact@repository.example');
+INSERT INTO "records" VALUES(7,1,'Title 6 0','2017-01-07',1.79232560994421195985e+09,'http://repository.example/item/6',0,'oai:test:6','','contact@repository.example');
+INSERT INTO "records" VALUES(8,1,'Title 7 0','2017-01-08',1792325609.95433,'http://repository.example/item/7',0,'oai:test:7','','contact@repository.example');
+INSERT INTO "records" VALUES(9,1,'Title 8 0','2017-01-09',1.79232560996185684206e+09,'http://repository.example/item/8',0,'oai:test:8','','contact@repository.example');
+INSERT INTO "records" VALUES(10,1,'Title 9 0','2017-01-10',1.79232560997048068042e+09,'http://repository.example/item/9',0,'oai:test:9','','contact@repository.example');
+INSERT INTO "records" VALUES(11,1,'Title 10 0','2017-01-11',1.79232561000368428231e+09,'http://repository.example/item/10',1,'oai:test:10','','contact@repository.example');
+INSERT INTO "records" VALUES(12,1,'Title 11 0','2017-01-12',1.79232561000810074807e+09,'http://repository.example/item/11',1,'oai:test:11','','contact@repository.example');
+CREATE TABLE records_x_access (
+	records_x_access_id INTEGER PRIMARY KEY NOT NULL,
+	record_id INTEGER NOT NULL,
+	access_id INTEGER NOT NULL);
+INSERT INTO "records_x_access" VALUES(1,1,1);
+INSERT INTO "records_x_access" VALUES(2,2,1);
+INSERT INTO "records_x_access" VALUES(3,3,1);
+INSERT INTO "records_x_access" VALUES(4,4,1);
+INSERT INTO "records_x_access" VALUES(5,5,1);
+INSERT INTO "records_x_access" VALUES(6,6,1);
+INSERT INTO "records_x_access" VALUES(7,7,1);
+INSERT INTO "records_x_access" VALUES(8,8,1);
+INSERT INTO "records_x_access" VALUES(9,9,1);
+INSERT INTO "records_x_access" VALUES(10,10,1);
+CREATE TABLE records_x_creators (
+	records_x_creators_id INTEGER PRIMARY KEY NOT NULL,
+	record_id INTEGER NOT NULL,
+	creator_id INTEGER NOT NULL,
+	is_contributor INTEGER NOT NULL);
+INSERT INTO "records_x_creators" VALUES(1,1,1,0);
+INSERT INTO "records_x_creators" VALUES(2,1,2,0);
+INSERT INTO "records_x_creators" VALUES(3,1,3,1);
+INSERT INTO "records_x_creators" VALUES(4,2,4,0);
+INSERT INTO "records_x_creators" VALUES(5,2,5,0);
+INSERT INTO "records_x_creators" VALUES(6,3,6,0);
+INSERT INTO "records_x_creators" VALUES(7,3,7,0);
+INSERT INTO "records_x_creators" VALUES(8,4,8,0);
+INSERT INTO "records_x_creators" VALUES(9,4,9,0);
+INSERT INTO "records_x_creators" VALUES(10,4,1,1);
+INSERT INTO "records_x_creators" VALUES(11,5,10,0);
+INSERT INTO "records_x_creators" VALUES(12,5,11,0);
+INSERT INTO "records_x_creators" VALUES(13,6,12,0);
+INSERT INTO "records_x_creators" VALUES(14,6,13,0);
+INSERT INTO "records_x_creators" VALUES(15,7,14,0);
+INSERT INTO "records_x_creators" VALUES(16,7,6,0);
+INSERT INTO "records_x_creators" VALUES(17,7,15,1);
+INSERT INTO "records_x_creators" VALUES(18,8,11,0);
+INSERT INTO "records_x_creators" VALUES(19,8,5,0);
+INSERT INTO "records_x_creators" VALUES(20,9,11,0);
+INSERT INTO "records_x_creators" VALUES(21,9,16,0);
+INSERT INTO "records_x_creators" VALUES(22,10,17,0);
+INSERT INTO "records_x_creators" VALUES(23,10,12,0);
+INSERT INTO "records_x_creators" VALUES(24,10,11,1);
+CREATE TABLE records_x_publishers (
+	records_x_publishers_id INTEGER PRIMARY KEY NOT NULL,
+	record_id INTEGER NOT NULL,
+	publisher_id INTEGER NOT NULL);
+INSERT INTO "records_x_publishers" VALUES(1,1,1);
+INSERT INTO "records_x_publishers" VALUES(2,2,2);
+INSERT INTO "records_x_publishers" VALUES(3,3,3);
+INSERT INTO "records_x_publishers" VALUES(4,4,4);
+INSERT INTO "records_x_publishers" VALUES(5,5,5);
+INSERT INTO "records_x_publishers" VALUES(6,6,1);
+INSERT INTO "records_x_publishers" VALUES(7,7,2);
+INSERT INTO "records_x_publishers" VALUES(8,8,3);
+INSERT INTO "records_x_publishers" VALUES(9,9,4);
+INSERT INTO "records_x_publishers" VALUES(10,10,5);
+CREATE TABLE records_x_rights (
+	records_x_rights_id INTEGER PRIMARY KEY NOT NULL,
+	record_id INTEGER NOT NULL,
+	rights_id INTEGER NOT NULL);
+INSERT INTO "records_x_rights" VALUES(1,1,1);
+INSERT INTO "records_x_rights" VALUES(2,2,2);
+INSERT INTO "records_x_rights" VALUES(3,3,3);
+INSERT INTO "records_x_rights" VALUES(4,4,1);
+INSERT INTO "records_x_rights" VALUES(5,5,2);
+INSERT INTO "records_x_rights" VALUES(6,6,3);
+INSERT INTO "records_x_rights" VALUES(7,7,1);
+INSERT INTO "records_x_rights" VALUES(8,8,2);
+INSERT INTO "records_x_rights" VALUES(9,9,3);
+INSERT INTO "records_x_rights" VALUES(10,10,1);
+CREATE TABLE records_x_subjects (
+	records_x_subjects_id INTEGER PRIMARY KEY NOT NULL,
+	record_id INTEGER NOT NULL,
+	subject_id INTEGER NOT NULL);
+INSERT INTO "records_x_subjects" VALUES(1,1,1);
+INSERT INTO "records_x_subjects" VALUES(2,1,2);
+INSERT INTO "records_x_subjects" VALUES(3,1,3);
+INSERT INTO "records_x_subjects" VALUES(4,2,4);
+INSERT INTO "records_x_subjects" VALUES(5,2,5);
+INSERT INTO "records_x_subjects" VALUES(6,2,6);
+INSERT INTO "records_x_subjects" VALUES(7,3,7);
+INSERT INTO "records_x_subjects" VALUES(8,3,8);
+INSERT INTO "records_x_subjects" VALUES(9,3,9);
+INSERT INTO "records_x_subjects" VALUES(10,4,10);
+INSERT INTO "records_x_subjects" VALUES(11,4,4);
+INSERT INTO "records_x_subjects" VALUES(12,4,11);
+INSERT INTO "records_x_subjects" VALUES(13,5,12);
+INSERT INTO "records_x_subjects" VALUES(14,5,13);
+INSERT INTO "records_x_subjects" VALUES(15,5,14);
+INSERT INTO "records_x_subjects" VALUES(16,6,15);
+INSERT INTO "records_x_subjects" VALUES(17,6,16);
+INSERT INTO "records_x_subjects" VALUES(18,6,6);
+INSERT INTO "records_x_subjects" VALUES(19,7,17);
+INSERT INTO "records_x_subjects" VALUES(20,7,8);
+INSERT INTO "records_x_subjects" VALUES(21,7,18);
+INSERT INTO "records_x_subjects" VALUES(22,8,19);
+INSERT INTO "records_x_subjects" VALUES(23,8,20);
+INSERT INTO "records_x_subjects" VALUES(24,8,21);
+INSERT INTO "records_x_subjects" VALUES(25,9,22);
+INSERT INTO "records_x_subjects" VALUES(26,9,23);
+INSERT INTO "records_x_subjects" VALUES(27,9,24);
+INSERT INTO "records_x_subjects" VALUES(28,10,25);
+INSERT INTO "records_x_subjects" VALUES(29,10,26);
+INSERT INTO "records_x_subjects" VALUES(30,10,27);
+CREATE TABLE records_x_tags (
+	records_x_tags_id INTEGER PRIMARY KEY NOT NULL,
+	record_id INTEGER NOT NULL,
+	tag_id INTEGER NOT NULL);
+INSERT INTO "records_x_tags" VALUES(1,1,1);
+INSERT INTO "records_x_tags" VALUES(2,1,2);
+INSERT INTO "records_x_tags" VALUES(3,2,3);
+INSERT INTO "records_x_tags" VALUES(4,2,4);
+INSERT INTO "records_x_tags" VALUES(5,3,5);
+INSERT INTO "records_x_tags" VALUES(6,3,6);
+INSERT INTO "records_x_tags" VALUES(7,4,7);
+INSERT INTO "records_x_tags" VALUES(8,4,8);
+INSERT INTO "records_x_tags" VALUES(9,5,9);
+INSERT INTO "records_x_tags" VALUES(10,5,2);
+INSERT INTO "records_x_tags" VALUES(11,6,10);
+INSERT INTO "records_x_tags" VALUES(12,6,4);
+INSERT INTO "records_x_tags" VALUES(13,7,11);
+INSERT INTO "records_x_tags" VALUES(14,7,6);
+INSERT INTO "records_x_tags" VALUES(15,8,1);
+INSERT INTO "records_x_tags" VALUES(16,8,8);
+INSERT INTO "records_x_tags" VALUES(17,9,3);
+INSERT INTO "records_x_tags" VALUES(18,9,2);
+INSERT INTO "records_x_tags" VALUES(19,10,5);
+INSERT INTO "records_x_tags" VALUES(20,10,4);
+CREATE TABLE repositories (
+	repository_id INTEGER PRIMARY KEY NOT NULL,
+	repository_set TEXT NOT NULL DEFAULT '',
+	repository_url TEXT,
+	repository_name TEXT,
+	repository_thumbnail TEXT,
+	repository_type TEXT,
+	last_crawl_timestamp INTEGER,
+	item_url_pattern TEXT,
+	abort_after_numerrors INTEGER,
+	max_records_updated_per_run INTEGER,
+	update_log_after_numitems INTEGER,
+	record_refresh_days INTEGER,
+	repo_refresh_days INTEGER,
+	enabled TEXT, homepage_url TEXT);
+INSERT INTO "repositories" VALUES(1,'','http://repository.example/oai','Test Repository','http://repository.example/logo.png','oai',1.7923256098718121052e+09,NULL,5,100,100,30,7,'1','http://repository.example/');
+CREATE TABLE rights (
+	rights_id INTEGER PRIMARY KEY NOT NULL,
+	rights TEXT,
+	rights_hash VARCHAR(100));
+INSERT INTO "rights" VALUES(1,'CC-BY 0','01e19c5689a3c31ddf01a4d9032eada1ab7a8cb2');
+INSERT INTO "rights" VALUES(2,'CC-BY 1','6a885939b766537956f5891edbd9efa4edf20274');
+INSERT INTO "rights" VALUES(3,'CC-BY 2','1af2faf9d6eb013e49fa1e939caabea2bc87b49a');
+CREATE TABLE settings (setting_id INTEGER PRIMARY KEY NOT NULL, setting_name TEXT, setting_value TEXT);
+INSERT INTO "settings" VALUES(1,'dbversion','20180411');
+CREATE TABLE subjects (
+	subject_id INTEGER PRIMARY KEY NOT NULL,
+	subject TEXT);
+INSERT INTO "subjects" VALUES(1,'Subject 8');
+INSERT INTO "subjects" VALUES(2,'Subject 32');
+INSERT INTO "subjects" VALUES(3,'Subject 15');
+INSERT INTO "subjects" VALUES(4,'Subject 57');
+INSERT INTO "subjects" VALUES(5,'Subject 60');
+INSERT INTO "subjects" VALUES(6,'Subject 48');
+INSERT INTO "subjects" VALUES(7,'Subject 62');
+INSERT INTO "subjects" VALUES(8,'Subject 3');
+INSERT INTO "subjects" VALUES(9,'Subject 49');
+INSERT INTO "subjects" VALUES(10,'Subject 0');
+INSERT INTO "subjects" VALUES(11,'Subject 34');
+INSERT INTO "subjects" VALUES(12,'Subject 75');
+INSERT INTO "subjects" VALUES(13,'Subject 13');
+INSERT INTO "subjects" VALUES(14,'Subject 40');
+INSERT INTO "subjects" VALUES(15,'Subject 69');
+INSERT INTO "subjects" VALUES(16,'Subject 1');
+INSERT INTO "subjects" VALUES(17,'Subject 54');
+INSERT INTO "subjects" VALUES(18,'Subject 67');
+INSERT INTO "subjects" VALUES(19,'Subject 56');
+INSERT INTO "subjects" VALUES(20,'Subject 63');
+INSERT INTO "subjects" VALUES(21,'Subject 70');
+INSERT INTO "subjects" VALUES(22,'Subject 29');
+INSERT INTO "subjects" VALUES(23,'Subject 28');
+INSERT INTO "subjects" VALUES(24,'Subject 58');
+INSERT INTO "subjects" VALUES(25,'Subject 53');
+INSERT INTO "subjects" VALUES(26,'Subject 71');
+INSERT INTO "subjects" VALUES(27,'Subject 12');
+INSERT INTO "subjects" VALUES(28,'Subject 37');
+INSERT INTO "subjects" VALUES(29,'Subject 42');
+INSERT INTO "subjects" VALUES(30,'Subject 64');
+INSERT INTO "subjects" VALUES(31,'Subject 24');
+CREATE TABLE tags (
+	tag_id INTEGER PRIMARY KEY NOT NULL,
+	tag TEXT, 
+	language TEXT);
+INSERT INTO "tags" VALUES(1,'tag0','en');
+INSERT INTO "tags" VALUES(2,'etiquette0','fr');
+INSERT INTO "tags" VALUES(3,'tag1','en');
+INSERT INTO "tags" VALUES(4,'etiquette1','fr');
+INSERT INTO "tags" VALUES(5,'tag2','en');
+INSERT INTO "tags" VALUES(6,'etiquette2','fr');
+INSERT INTO "tags" VALUES(7,'tag3','en');
+INSERT INTO "tags" VALUES(8,'etiquette3','fr');
+INSERT INTO "tags" VALUES(9,'tag4','en');
+INSERT INTO "tags" VALUES(10,'tag5','en');
+INSERT INTO "tags" VALUES(11,'tag6','en');
+CREATE INDEX geospatial_by_record on geospatial(record_id);
+CREATE INDEX domain_metadata_by_record on domain_metadata(record_id,schema_id);
+CREATE INDEX domain_schemas_by_schema_id on domain_schemas(schema_id);
+CREATE UNIQUE INDEX records_by_repository on records (repository_id, local_identifier);
+CREATE INDEX subjects_by_subject on subjects(subject);
+CREATE INDEX records_x_subjects_by_record on records_x_subjects(record_id);
+CREATE INDEX records_x_subjects_by_subject on records_x_subjects(subject_id);
+CREATE INDEX creators_by_creator on creators(creator);
+CREATE INDEX records_x_creators_by_record on records_x_creators(record_id);
+CREATE INDEX records_x_creators_by_creator on records_x_creators(creator_id);
+CREATE INDEX publishers_by_publisher on publishers(publisher);
+CREATE INDEX records_x_publishers_by_record on records_x_publishers(record_id);
+CREATE INDEX records_x_publishers_by_publisher on records_x_publishers(publisher_id);
+CREATE INDEX access_by_access on access(access);
+CREATE INDEX records_x_access_by_record on records_x_access(record_id);
+CREATE INDEX records_x_access_by_access on records_x_access(access_id);
+CREATE INDEX tags_by_tag on tags(tag);
+CREATE INDEX records_x_tags_by_record on records_x_tags(record_id);
+CREATE INDEX records_x_tags_by_tag on records_x_tags(tag_id);
+CREATE INDEX rights_by_right_hash on rights(rights_hash);
+CREATE INDEX records_x_rights_by_record on records_x_rights(record_id);
+CREATE INDEX records_x_rights_by_right on records_x_rights(rights_id);
+CREATE INDEX descriptions_by_description_hash on descriptions(description_hash);
+CREATE INDEX descriptions_by_record_id on descriptions(record_id, language);
+COMMIT;
@@ -0,0 +1,116 @@
+import os
+import random
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ListLogger:
+	""" Stands in for HarvestLogger, keeping messages so tests can look at them """
+
+	def __init__(self):
+		self.messages = []
+
+	def debug(self, message):
+		self.messages.append(("debug", message))
+
+	def info(self, message):
+		self.messages.append(("info", message))
+
+	def warning(self, message):
+		self.messages.append(("warning", message))
+
+	def error(self, message, copytoemail=True):
+		self.messages.append(("error", message))
+
+	def errors(self):
+		return [message for level, message in self.messages if level == "error"]
+
+
+def add_repository(db, url="http://repository.example/oai", name="Test Repository", repo_type="oai", thumbnail="http://repository.example/logo.png"):
+	return db.update_repo(repo_id=0, repo_url=url, repo_set="", repo_name=name, repo_type=repo_type, enabled=True, repo_thumbnail=thumbnail,
+		item_url_pattern=None, abort_after_numerrors=5, max_records_updated_per_run=100, update_log_after_numitems=100, record_refresh_days=30,
+		repo_refresh_days=7, homepage_url="http://repository.example/")
+
+
+def make_records(count, variant=0, seed=1, start=0):
+	""" (record, domain_metadata) pairs as the repository classes pass them to write_records, covering every related table """
+	rng = random.Random(seed)
+	creators = ["Creator {}".format(i) for i in range(50)]
+	subjects = ["Subject {}".format(i) for i in range(80)]
+	records = []
+	for i in range(start, start + count):
+		record = {"identifier": "oai:test:{}".format(i), "title": "Title {} {}".format(i, variant), "pub_date": "2017-01-{:02d}".format(i % 28 + 1),
+			"contact": "contact@repository.example", "series": "", "dc:source": "http://repository.example/item/{}".format(i),
+			"creator": rng.sample(creators, 2), "subject": rng.sample(subjects, 3), "publisher": "Publisher {}".format(i % 5),
+			"rights": ["CC-BY {}".format(i % 3)], "description": ["Description {} é".format(i)], "tags": ["tag{}".format(i % 7)],
+			"tags_fr": ["etiquette{}".format(i % 4)], "access": "Public"}
+		if i % 3 == 0:
+			record["contributor"] = [creators[(i + 5) % 50]]
+		if i % 4 == 0:
+			record["geospatial"] = {"type": "Polygon", "coordinates": [[["49.1", "-123.1"], ["49.2", "-123.2"]]]}
+		domain_metadata = {}
+		if i % 5 == 0:
+			domain_metadata = {"http://schema.example/ns#field": ["value {}".format(i), "second"]}
+		records.append((record, domain_metadata))
+	return records
+
+
+def read_export(export_filepath):
+	""" Every file in an export directory, by name, as bytes """
+	files = {}
+	for name in sorted(os.listdir(export_filepath)):
+		with open(os.path.join(export_filepath, name), "rb") as f:
+			files[name] = f.read()
+	return files
+
+
+class RecordingConnection:
+	""" Wraps a sqlite connection, keeping every statement run through it with its parameters """
+
+	def __init__(self, con):
+		object.__setattr__(self, "_con", con)
+		object.__setattr__(self, "statements", [])
+
+	def __getattr__(self, name):
+		return getattr(self._con, name)
+
+	def __setattr__(self, name, value):
+		setattr(self._con, name, value)
+
+	def __enter__(self):
+		self._con.__enter__()
+		return self
+
+	def __exit__(self, *exc):
+		return self._con.__exit__(*exc)
+
+	def execute(self, sql, params=()):
+		self.statements.append((sql, params))
+		return self._con.execute(sql, params)
+
+	def cursor(self, *args, **kwargs):
+		return RecordingCursor(self._con.cursor(*args, **kwargs), self.statements)
+
+
+class RecordingCursor:
+
+	def __init__(self, cur, statements):
+		object.__setattr__(self, "_cur", cur)
+		object.__setattr__(self, "statements", statements)
+
+	def __getattr__(self, name):
+		return getattr(self._cur, name)
+
+	def __setattr__(self, name, value):
+		setattr(self._cur, name, value)
+
+	def __iter__(self):
+		return iter(self._cur)
+
+	def execute(self, sql, params=()):
+		self.statements.append((sql, params))
+		return self._cur.execute(sql, params)
+
+	def executemany(self, sql, seq_of_params):
+		self.statements.append((sql, None))
+		return self._cur.executemany(sql, seq_of_params)
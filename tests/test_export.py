@@ -0,0 +1,164 @@
+""" Exports split into several files, rendered by several workers, compressed or taken from the cache hold the same entries as a plain export """
+import gzip
+import json
+import os
+import re
+
+import pytest
+
+from helpers import ListLogger, make_records, read_export
+from harvester.DBInterface import DBInterface
+from harvester.Exporter import Exporter
+
+
+@pytest.fixture
+def records_db(db, repo_id):
+	db.write_records(make_records(60), repo_id, "oai_dc")
+	return db
+
+
+def run_export(db, export_filepath, export_format="gmeta", only_new_records=False, **config):
+	os.makedirs(export_filepath, exist_ok=True)
+	exporter = Exporter(db, ListLogger(), config)
+	exporter.export_to_file(export_format=export_format, export_filepath=export_filepath, temp_filepath=export_filepath + "_temp", only_new_records=only_new_records)
+	return exporter
+
+
+def export_files(export_filepath, export_format="gmeta"):
+	""" The files of an export in the order they were written: the numbered files, then the one without a number """
+	names = [name for name in os.listdir(export_filepath) if name.startswith(export_format)]
+	number = lambda name: int(re.match(re.escape(export_format) + "_([0-9]+)", name).group(1)) if "_" in name else len(names) + 1
+	return [os.path.join(export_filepath, name) for name in sorted(names, key=number)]
+
+
+def gmeta_entries(export_filepath):
+	entries = []
+	for filename in export_files(export_filepath):
+		with (gzip.open if filename.endswith(".gz") else open)(filename, "rb") as f:
+			entries.extend(json.loads(f.read())["ingest_data"]["gmeta"])
+	return entries
+
+
+def test_rotated_files_hold_the_same_entries(records_db, tmp_path):
+	# With no room at all, each file holds a single entry
+	rotated = run_export(records_db, str(tmp_path / "rotated"), export_file_limit_mb=0)
+	single = run_export(records_db, str(tmp_path / "single"))
+	assert rotated.export_ok and single.export_ok
+
+	assert len(export_files(str(tmp_path / "rotated"))) == 60
+	assert len(export_files(str(tmp_path / "single"))) == 1
+	entries = gmeta_entries(str(tmp_path / "single"))
+	assert len(entries) == 60
+	assert gmeta_entries(str(tmp_path / "rotated")) == entries
+
+
+@pytest.mark.parametrize("export_file_limit_mb", [10, 0])
+def test_export_workers_write_the_same_files(records_db, repo_id, tmp_path, export_file_limit_mb):
+	records_db.reconcile_records(repo_id, ["oai:test:{}".format(i) for i in range(55)])
+	single = run_export(records_db, str(tmp_path / "single"), export_file_limit_mb=export_file_limit_mb)
+	parallel = run_export(records_db, str(tmp_path / "parallel"), export_file_limit_mb=export_file_limit_mb, export_workers=3)
+	assert single.export_ok and parallel.export_ok
+
+	# Each worker starts its own files, so only the entries and the order they come in are the same
+	entries = gmeta_entries(str(tmp_path / "single"))
+	assert len(entries) == 55
+	assert gmeta_entries(str(tmp_path / "parallel")) == entries
+	deleted = read_export(str(tmp_path / "single"))["delete.txt"]
+	assert len(deleted.splitlines()) == 5
+	assert read_export(str(tmp_path / "parallel"))["delete.txt"] == deleted
+
+
+def test_incremental_export_holds_only_changed_records(records_db, repo_id, tmp_path):
+	con = records_db.getConnection()
+	with con:
+		con.execute("UPDATE records SET changed_timestamp = 1000")
+	records_db.set_setting("export_watermark_gmeta", 2000)
+	records_db.write_records(make_records(60, variant=1)[10:15], repo_id, "oai_dc")
+	records_db.reconcile_records(repo_id, ["oai:test:{}".format(i) for i in range(59)])
+
+	exporter = run_export(records_db, str(tmp_path / "changed"), only_new_records=True)
+	assert exporter.export_ok
+	assert sorted(entry["subject"] for entry in gmeta_entries(str(tmp_path / "changed"))) == sorted(
+		"http://repository.example/item/{}".format(i) for i in range(10, 15))
+	assert read_export(str(tmp_path / "changed"))["delete.txt"] == b"http://repository.example/item/59"
+	assert int(records_db.get_setting("export_watermark_gmeta")) > 2000
+
+
+def test_failed_export_keeps_the_watermark(records_db, tmp_path):
+	records_db.set_setting("export_watermark_gmeta", 2000)
+	os.makedirs(str(tmp_path / "temp"))
+	exporter = Exporter(records_db, ListLogger(), {})
+	# The finished files cannot be moved into a directory that is not there
+	exporter.export_to_file(export_format="gmeta", export_filepath=str(tmp_path / "missing"), temp_filepath=str(tmp_path / "temp"), only_new_records=True)
+	assert not exporter.export_ok
+	assert exporter.logger.errors()
+	assert int(records_db.get_setting("export_watermark_gmeta")) == 2000
+
+	# So the next export still picks up every record changed since the last one that worked
+	exporter = run_export(records_db, str(tmp_path / "retried"), only_new_records=True)
+	assert exporter.export_ok
+	assert len(gmeta_entries(str(tmp_path / "retried"))) == 60
+	assert int(records_db.get_setting("export_watermark_gmeta")) > 2000
+
+
+def from_cache(exporter):
+	""" How many entries the export took from the cache, as it logged """
+	for level, message in exporter.logger.messages:
+		match = re.search("([0-9]+) taken from the export cache", message)
+		if match:
+			return int(match.group(1))
+
+
+def test_export_workers_leave_the_cache_to_the_parent(records_db, tmp_path, monkeypatch):
+	def migrate(db):
+		raise AssertionError("the parent has already brought the database up to date")
+	monkeypatch.setattr(DBInterface, "migrate", migrate)
+	parallel = run_export(records_db, str(tmp_path / "parallel"), export_workers=3)
+	assert parallel.export_ok
+
+	single = run_export(records_db, str(tmp_path / "single"))
+	assert from_cache(single) == 60
+	assert gmeta_entries(str(tmp_path / "single")) == gmeta_entries(str(tmp_path / "parallel"))
+
+
+def test_cache_is_used_until_settings_change(records_db, repo_id, tmp_path):
+	first = run_export(records_db, str(tmp_path / "first"))
+	second = run_export(records_db, str(tmp_path / "second"))
+	assert (from_cache(first), from_cache(second)) == (0, 60)
+	assert read_export(str(tmp_path / "second")) == read_export(str(tmp_path / "first"))
+
+	# Records whose content changed are rendered again
+	records_db.write_records(make_records(60, variant=1)[:5], repo_id, "oai_dc")
+	changed = run_export(records_db, str(tmp_path / "changed"))
+	assert from_cache(changed) == 55
+	assert [entry["content"]["dc:title"] for entry in gmeta_entries(str(tmp_path / "changed"))[:5]] == ["Title {} 1".format(i) for i in range(5)]
+
+	# A new thumbnail is part of every entry of the repository, so none of them can be taken from the cache
+	records_db.update_repo(repo_id=repo_id, repo_thumbnail="http://repository.example/new-logo.png")
+	moved = run_export(records_db, str(tmp_path / "moved"))
+	assert from_cache(moved) == 0
+	entries = gmeta_entries(str(tmp_path / "moved"))
+	assert set(entry["content"]["frdr:origin.icon"] for entry in entries) == set(["http://repository.example/new-logo.png"])
+	assert from_cache(run_export(records_db, str(tmp_path / "again"))) == 60
+
+
+@pytest.mark.parametrize("compression", ["gzip", "zstd"])
+def test_compressed_export_holds_the_same_bytes(records_db, repo_id, tmp_path, compression):
+	decompress = gzip.decompress
+	if compression == "zstd":
+		zstandard = pytest.importorskip("zstandard")
+		decompress = lambda data: zstandard.ZstdDecompressor().stream_reader(data).read()
+	extension = {"gzip": ".gz", "zstd": ".zst"}[compression]
+	records_db.reconcile_records(repo_id, ["oai:test:{}".format(i) for i in range(55)])
+
+	for export_format in ["gmeta", "rifcs"]:
+		plain = run_export(records_db, str(tmp_path / export_format / "plain"), export_format, export_file_limit_mb=0)
+		compressed = run_export(records_db, str(tmp_path / export_format / "compressed"), export_format, export_file_limit_mb=0, export_compression=compression)
+		assert plain.export_ok and compressed.export_ok
+
+		files = read_export(str(tmp_path / export_format / "plain"))
+		assert len(files) == 57
+		compressed_files = read_export(str(tmp_path / export_format / "compressed"))
+		# delete.txt is written uncompressed
+		assert compressed_files.pop("delete.txt") == files.pop("delete.txt")
+		assert {name[:-len(extension)]: decompress(data) for name, data in compressed_files.items()} == files
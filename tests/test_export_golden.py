@@ -0,0 +1,35 @@
+""" A database written by the harvester before exports were streamed still exports to the same bytes the exporter of that time wrote """
+import os
+import sqlite3
+
+import pytest
+
+from helpers import ROOT, ListLogger, read_export
+from harvester.DBInterface import DBInterface
+from harvester.Exporter import Exporter
+
+# baseline.sql is a dump of twelve records, two of them deleted, written and exported by that version; each directory holds its export
+GOLDEN = os.path.join(ROOT, "tests", "golden")
+
+
+@pytest.fixture
+def baseline_db(tmp_path, logger):
+	dbname = str(tmp_path / "baseline.db")
+	con = sqlite3.connect(dbname)
+	with open(os.path.join(GOLDEN, "baseline.sql")) as f:
+		con.executescript(f.read())
+	con.close()
+	# Opening it runs every migration since
+	db = DBInterface({"type": "sqlite", "dbname": dbname})
+	db.setLogger(logger)
+	return db
+
+
+@pytest.mark.parametrize("golden, export_file_limit_mb", [("gmeta", 10), ("gmeta_rotated", 0)])
+def test_same_files_as_the_baseline_exporter(baseline_db, tmp_path, golden, export_file_limit_mb):
+	export_filepath = str(tmp_path / "export")
+	os.makedirs(export_filepath)
+	exporter = Exporter(baseline_db, ListLogger(), {"export_file_limit_mb": export_file_limit_mb})
+	exporter.export_to_file(export_format="gmeta", export_filepath=export_filepath, temp_filepath=export_filepath + "_temp", only_new_records=False)
+	assert exporter.export_ok
+	assert read_export(export_filepath) == read_export(os.path.join(GOLDEN, golden))
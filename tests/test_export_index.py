@@ -0,0 +1,98 @@
+""" Records are found through the index of a JSON Lines export, after a full export and after changes are appended """
+import json
+import os
+
+import pytest
+
+from helpers import ListLogger, make_records
+from harvester.ExportIndex import ExportIndex
+from harvester.Exporter import Exporter
+
+
+def export_jsonl(db, export_filepath, only_new_records=False):
+	exporter = Exporter(db, ListLogger(), {"export_file_limit_mb": 0})
+	exporter.export_to_file(export_format="jsonl", export_filepath=export_filepath, temp_filepath=export_filepath + "_temp", only_new_records=only_new_records)
+	assert exporter.export_ok
+	return exporter
+
+
+def read_line(export_filepath, source=None, record_id=None):
+	found = ExportIndex.lookup(os.path.join(export_filepath, "jsonl.idx"), source=source, record_id=record_id)
+	if found is None:
+		return None
+	file_number, offset, length = found
+	with open(os.path.join(export_filepath, "jsonl_{}.jsonl".format(file_number)), "rb") as f:
+		f.seek(offset)
+		return json.loads(f.read(length))
+
+
+@pytest.fixture
+def exported(db, repo_id, tmp_path):
+	db.write_records(make_records(60), repo_id, "oai_dc")
+	db.reconcile_records(repo_id, ["oai:test:{}".format(i) for i in range(55)])
+	export_filepath = str(tmp_path / "export")
+	os.makedirs(export_filepath)
+	export_jsonl(db, export_filepath)
+	record_ids = dict((row[0], row[1]) for row in db.getConnection().execute("SELECT local_identifier, record_id FROM records"))
+	return export_filepath, record_ids
+
+
+def source(i):
+	return "http://repository.example/item/{}".format(i)
+
+
+def test_full_export_index_is_sorted(exported):
+	export_filepath, record_ids = exported
+	with open(os.path.join(export_filepath, "jsonl.idx"), "rb") as f:
+		index = f.read()
+	assert index[:8] == ExportIndex.header
+	count = ExportIndex.sorted_count.unpack_from(index, 8)[0]
+	assert count == 60
+	assert len(index) == 16 + count * ExportIndex.entry.size
+	keys = [entry[0] for entry in ExportIndex.entry.iter_unpack(index[16:])]
+	assert keys == sorted(keys)
+	assert not os.path.exists(os.path.join(export_filepath, "jsonl.idx.unsorted"))
+
+
+def test_lookup_after_full_export(exported):
+	export_filepath, record_ids = exported
+	for i in range(55):
+		entry = read_line(export_filepath, source=source(i))
+		assert entry["subject"] == source(i)
+		assert read_line(export_filepath, record_id=record_ids["oai:test:{}".format(i)]) == entry
+	for i in range(55, 60):
+		assert read_line(export_filepath, source=source(i)) is None
+		assert read_line(export_filepath, record_id=record_ids["oai:test:{}".format(i)]) is None
+	assert read_line(export_filepath, source="http://repository.example/never-exported") is None
+
+
+def test_lookup_after_changes_are_appended(db, repo_id, exported):
+	export_filepath, record_ids = exported
+	db.write_records(make_records(60, variant=1)[10:15], repo_id, "oai_dc")
+	db.reconcile_records(repo_id, ["oai:test:{}".format(i) for i in range(50)])
+	export_jsonl(db, export_filepath, only_new_records=True)
+
+	for i in range(50):
+		entry = read_line(export_filepath, source=source(i))
+		assert entry["content"]["dc:title"] == "Title {} {}".format(i, 1 if 10 <= i < 15 else 0)
+		assert read_line(export_filepath, record_id=record_ids["oai:test:{}".format(i)]) == entry
+	for i in range(50, 60):
+		assert read_line(export_filepath, source=source(i)) is None
+		assert read_line(export_filepath, record_id=record_ids["oai:test:{}".format(i)]) is None
+
+
+def test_missing_index_gives_a_full_export(db, repo_id, exported):
+	export_filepath, record_ids = exported
+	os.remove(os.path.join(export_filepath, "jsonl.idx"))
+	db.write_records(make_records(60, variant=1)[10:15], repo_id, "oai_dc")
+	exporter = export_jsonl(db, export_filepath, only_new_records=True)
+
+	assert [level for level, message in exporter.logger.messages if "jsonl.idx" in message] == ["warning"]
+	with open(os.path.join(export_filepath, "jsonl.idx"), "rb") as f:
+		index = f.read()
+	assert ExportIndex.sorted_count.unpack_from(index, 8)[0] == 60
+	assert len(index) == 16 + 60 * ExportIndex.entry.size
+	for i in range(55):
+		entry = read_line(export_filepath, source=source(i))
+		assert entry["content"]["dc:title"] == "Title {} {}".format(i, 1 if 10 <= i < 15 else 0)
+	assert int(db.get_setting("export_watermark_jsonl", 0)) > 0
@@ -0,0 +1,44 @@
+""" Stale records refreshed by several threads """
+import time
+
+import pytest
+
+pytest.importorskip("urllib3")
+
+from harvester.HarvestRepository import HarvestRepository
+
+
+class FailingRepository(HarvestRepository):
+	""" Every refresh fails, as an unreachable repository's would """
+
+	def _update_record(self, record):
+		# Lets the threads overlap, as requests would
+		time.sleep(0.001)
+		return self.count_error() < self.abort_after_numerrors
+
+
+@pytest.fixture
+def repository(db, repo_id, logger):
+	for i in range(200):
+		db.write_header("oai:test:{}".format(i), repo_id)
+	repository = FailingRepository({})
+	repository.setRepoParams({"url": "http://repository.example/oai", "enabled": True, "refresh_workers": 8, "requests_per_second": 1000,
+		"max_records_updated_per_run": 1000})
+	repository.setLogger(logger)
+	repository.setDatabase(db)
+	repository.repository_id = repo_id
+	return repository
+
+
+def test_every_error_is_counted(repository):
+	repository.abort_after_numerrors = 1000
+	repository.update_stale_records({})
+	assert repository.error_count == 200
+
+
+def test_refresh_stops_after_too_many_errors(repository, logger):
+	repository.abort_after_numerrors = 5
+	repository.update_stale_records({})
+	# Refreshes already started when the limit is reached still finish, but no more are started
+	assert 5 <= repository.error_count < 5 + 8
+	assert [message for message in logger.errors() if message.startswith("Aborting due to errors")]
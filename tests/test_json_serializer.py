@@ -0,0 +1,41 @@
+""" Each JSON library gives the same text as the standard library, with its default separators or compact ones """
+import json
+
+import pytest
+
+from harvester.JSONSerializer import JSONSerializer
+
+VALUES = [
+	{"title": "Title", "count": 3, "deleted": False, "missing": None, "nested": {"list": [1, 2.5, "three"]}},
+	# Exponents and small fractions are written differently by the fast libraries
+	[1e16, 1e-7, 1.5e300, 0.00001, 0.0001, -2.5e-10, 123456789.125],
+	# Text that looks like an exponent, inside strings and keys
+	{"file1e5": "Table1e-5 e+1 version2e", "e1": ["3e8", "1.0e-9"]},
+	["Réseau canadien", "日本語", "emoji \U0001f600", "control \x7f \x01", "quote \" backslash \\ slash /"],
+	{"big": 2 ** 70, "negative": -2 ** 63},
+	# orjson writes these as null
+	[float("nan"), float("inf"), -float("inf"), {"nested": [None, float("nan")]}],
+	# ujson escapes slashes and some separators by default, and keeps the shortest float text
+	{"url": "http://repository.example/item/1?a=b&c=d", "script": "</script>", "separators": "line\u2028paragraph\u2029"},
+	[0.1, 0.30000000000000004, 5e-324, 1.7976931348623157e308, -0.0, 100.0],
+	{"empty": [], "object": {}, "tuple": (1, "two"), "true": True, "unsigned": 2 ** 64 - 1, "key, with: separators": ", : "},
+]
+
+
+def serializer_or_skip(backend, compact):
+	try:
+		return JSONSerializer(backend, compact)
+	except ValueError:
+		pytest.skip("{} is not installed".format(backend))
+
+
+@pytest.mark.parametrize("backend", JSONSerializer.backends)
+@pytest.mark.parametrize("value", VALUES)
+def test_same_text_as_the_standard_library(backend, value):
+	assert serializer_or_skip(backend, False).dumps(value) == json.dumps(value)
+
+
+@pytest.mark.parametrize("backend", JSONSerializer.backends)
+@pytest.mark.parametrize("value", VALUES)
+def test_same_compact_text_as_the_standard_library(backend, value):
+	assert serializer_or_skip(backend, True).dumps(value) == json.dumps(value, separators=(",", ":"))
@@ -0,0 +1,51 @@
+""" A failed OAI listing is not mistaken for a repository with nothing new, so the changes are listed again next time """
+import time
+
+import pytest
+
+pytest.importorskip("sickle")
+pytest.importorskip("urllib3")
+
+from sickle.oaiexceptions import BadArgument, NoRecordsMatch
+from harvester.OAIRepository import OAIRepository
+
+
+class FailingSickle:
+	""" Stands in for Sickle, with a ListRecords that raises """
+
+	def __init__(self, error):
+		self.error = error
+
+	def ListRecords(self, **params):
+		raise self.error
+
+	def Identify(self):
+		raise AttributeError("granularity")
+
+
+@pytest.fixture
+def repository(db, repo_id, logger):
+	db.update_last_crawl(repo_id, 1000, full_crawl=True)
+	repository = OAIRepository({})
+	repository.setRepoParams({"url": "http://repository.example/oai", "name": "Test Repository", "thumbnail": "http://repository.example/logo.png",
+		"homepage_url": "http://repository.example/", "enabled": True, "repo_refresh_days": 0})
+	repository.setLogger(logger)
+	repository.setDatabase(db)
+	repository.repository_id = repo_id
+	return repository
+
+
+def test_no_records_match_finishes_the_crawl(repository, db, repo_id):
+	repository.sickle = FailingSickle(NoRecordsMatch("No records"))
+	started = time.time()
+	repository.crawl()
+	assert db.get_repo_last_crawl(repo_id) >= int(started)
+	assert db.logger.errors() == []
+
+
+@pytest.mark.parametrize("error", [BadArgument("bad from"), IOError("connection reset")])
+def test_other_errors_leave_the_last_crawl(repository, db, repo_id, error):
+	repository.sickle = FailingSickle(error)
+	repository.crawl()
+	assert db.get_repo_last_crawl(repo_id) == 1000
+	assert db.logger.errors()
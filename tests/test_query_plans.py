@@ -0,0 +1,124 @@
+""" The queries run for every record or every block of records, checked with EXPLAIN QUERY PLAN so that none of them reads the whole records table """
+import time
+
+import pytest
+
+from helpers import ListLogger, RecordingConnection, add_repository, make_records
+from harvester.DBInterface import DBInterface
+from harvester.Exporter import Exporter
+
+# Full scans of these are what the indexes are there to avoid; recs and dm are the aliases the queries use
+RECORD_TABLES = set(["records", "recs", "dm"] + DBInterface.record_related_tables)
+
+REPOSITORIES = 20
+WRITTEN_RECORDS_PER_REPOSITORY = 20
+BULK_RECORDS_PER_REPOSITORY = 1000
+
+
+def written_start(repo_id):
+	""" Where the identifiers of the records fully written for a repository start """
+	return (repo_id - 1) * WRITTEN_RECORDS_PER_REPOSITORY
+
+
+@pytest.fixture(scope="module")
+def plan_db(tmp_path_factory, repository_root):
+	""" Twenty repositories, each with a block of fully written records and many more bare ones, with statistics gathered """
+	db = DBInterface({"type": "sqlite", "dbname": str(tmp_path_factory.mktemp("plans") / "plans.db")})
+	db.setLogger(ListLogger())
+	now = int(time.time())
+	for number in range(REPOSITORIES):
+		repo_id = add_repository(db, url="http://repository{}.example/oai".format(number), name="Repository {}".format(number))
+		db.write_records(make_records(WRITTEN_RECORDS_PER_REPOSITORY, start=written_start(repo_id)), repo_id, "oai_dc")
+		con = db.getConnection()
+		with con:
+			con.executemany("""INSERT INTO records (title, pub_date, contact, series, modified_timestamp, changed_timestamp, local_identifier, repository_id, deleted, landing_url)
+				VALUES ('Title', '2017-01-01', '', '', ?, ?, ?, ?, ?, ?)""",
+				[(now - 86400 * (i % 60), now - 86400 * (i % 60), "bulk:{}".format(i), repo_id, 1 if i % 20 == 0 else 0, "http://repository.example/bulk/{}".format(i))
+				for i in range(BULK_RECORDS_PER_REPOSITORY)])
+	con = db.getConnection()
+	with con:
+		con.execute("ANALYZE")
+	db.connection = RecordingConnection(con)
+	return db
+
+
+@pytest.fixture
+def statements(plan_db):
+	del plan_db.connection.statements[:]
+	return plan_db.connection.statements
+
+
+def record_table_plans(db, statements, marker):
+	""" How record tables are read, in the plans of the statements run that contain marker """
+	matched = [(sql, params) for sql, params in statements if marker in sql and params is not None]
+	assert matched, "No statement containing {!r} was run".format(marker)
+	details = []
+	for sql, params in matched:
+		for row in db.connection._con.execute("EXPLAIN QUERY PLAN " + sql, params):
+			detail = row[-1]
+			if detail.split()[0] in ["SCAN", "SEARCH"] and detail.split()[1] in RECORD_TABLES:
+				details.append(detail)
+	return details
+
+
+def record_table_scans(db, statements, marker):
+	""" Full scans of record tables in the plans of the statements run that contain marker """
+	return [detail for detail in record_table_plans(db, statements, marker) if detail.startswith("SCAN ")]
+
+
+def test_get_stale_records(plan_db, statements):
+	plan_db.get_stale_records(int(time.time()) - 30 * 86400, 3, 100)
+	assert record_table_scans(plan_db, statements, "FROM records recs, repositories repos") == []
+
+
+def test_record_id_lookup(plan_db, statements):
+	plan_db.release_identity_map(3)
+	plan_db.write_header("header:1", 3)
+	assert plan_db.get_record_id(3, "bulk:10") is not None
+	assert record_table_scans(plan_db, statements, "from records where local_identifier=?") == []
+
+
+def test_write_records_existing_rows(plan_db, statements):
+	plan_db.release_identity_map(4)
+	plan_db.write_records(make_records(5, variant=1, start=written_start(4)), 4, "oai_dc")
+	assert record_table_scans(plan_db, statements, "FROM records WHERE repository_id=? AND local_identifier IN") == []
+
+
+def test_write_records_existing_rows_with_identity_map(plan_db, statements):
+	plan_db.load_identity_map(5)
+	try:
+		plan_db.write_records(make_records(5, variant=1, start=written_start(5)), 5, "oai_dc")
+	finally:
+		plan_db.release_identity_map(5)
+	assert record_table_scans(plan_db, statements, "SELECT local_identifier, record_id FROM records WHERE repository_id=?") == []
+	assert record_table_scans(plan_db, statements, "FROM records WHERE record_id IN") == []
+
+
+def test_update_stale_count(plan_db, statements):
+	plan_db.update_stale_count(6, int(time.time()) - 30 * 86400)
+	assert record_table_scans(plan_db, statements, "stale_count") == []
+
+
+def test_load_relations(plan_db, statements):
+	exporter = Exporter(plan_db, ListLogger(), {})
+	record_ids = [row[0] for row in plan_db.connection._con.execute("SELECT record_id FROM records WHERE local_identifier LIKE 'oai:test:%' LIMIT 50")]
+	related = exporter._load_relations(record_ids)
+	assert any(related[record_id]["dc:contributor.author"] for record_id in record_ids)
+	for marker in ["FROM geospatial", "JOIN records_x_creators", "JOIN records_x_subjects", "JOIN records_x_publishers", "JOIN records_x_rights",
+		"JOIN records_x_access", "FROM descriptions", "JOIN records_x_tags", "FROM domain_metadata dm"]:
+		assert record_table_scans(plan_db, statements, marker) == [], marker
+
+
+@pytest.mark.parametrize("only_new_records", [False, True])
+def test_export_select(plan_db, statements, tmp_path, only_new_records):
+	# The watermark leaves a few days of the bulk records to export
+	plan_db.set_setting("export_watermark_gmeta", int(time.time()) - 3 * 86400)
+	del statements[:]
+	exporter = Exporter(plan_db, ListLogger(), {})
+	exporter.export_to_file(export_format="gmeta", export_filepath=str(tmp_path), temp_filepath=str(tmp_path / "temp"), only_new_records=only_new_records)
+	assert exporter.export_ok
+	assert record_table_scans(plan_db, statements, "FROM records recs") == []
+	if only_new_records:
+		# Paging along the primary key from the last record_id seen reads every record, changed or not
+		assert [detail for detail in record_table_plans(plan_db, statements, "FROM records") if "rowid>" in detail] == []
+		assert record_table_scans(plan_db, statements, "FROM records WHERE changed_timestamp") == []
@@ -0,0 +1,37 @@
+""" Records a feed stops listing are tombstoned, and deleted records that come back are queued for a refresh """
+import time
+
+from helpers import make_records
+
+
+def counts(db):
+	""" Deleted records, and the creators still linked to them """
+	con = db.getConnection()
+	deleted = con.execute("SELECT count(*) FROM records WHERE deleted = 1").fetchone()[0]
+	creators = con.execute("""SELECT count(*) FROM records_x_creators
+		JOIN records on records.record_id = records_x_creators.record_id WHERE records.deleted = 1""").fetchone()[0]
+	return deleted, creators
+
+
+def test_missing_records_are_tombstoned(db, repo_id):
+	records = make_records(50)
+	identifiers = [record["identifier"] for record, domain_metadata in records]
+	db.write_records(records, repo_id, "oai_dc")
+
+	assert db.reconcile_records(repo_id, identifiers[:40]) == (10, 0)
+	assert counts(db) == (10, 0)
+	# Records already tombstoned are not deleted again
+	assert db.reconcile_records(repo_id, identifiers[:40]) == (0, 0)
+	assert db.logger.errors() == []
+
+
+def test_reappeared_records_are_queued_for_refresh(db, repo_id):
+	records = make_records(50)
+	identifiers = [record["identifier"] for record, domain_metadata in records]
+	db.write_records(records, repo_id, "oai_dc")
+	db.reconcile_records(repo_id, identifiers[:40])
+
+	assert db.reconcile_records(repo_id, identifiers[:45]) == (0, 5)
+	stale = db.get_stale_records(int(time.time()) - 86400, repo_id, 100)
+	assert sorted(row["local_identifier"] for row in stale) == sorted(identifiers[40:45])
+	assert counts(db)[0] == 10
@@ -0,0 +1,84 @@
+""" The repository_stats summary kept up as records are written and deleted matches a recount from the records table """
+import os
+import sqlite3
+import time
+
+from helpers import ROOT, add_repository, make_records
+from harvester.DBInterface import DBInterface
+
+
+def stats(db):
+	con = db.getConnection()
+	return [tuple(row) for row in con.execute("SELECT repository_id, active_count, deleted_count, stale_count FROM repository_stats ORDER BY repository_id")]
+
+
+def assert_matches_rebuild(db, repo_ids):
+	for repo_id in repo_ids:
+		db.update_stale_count(repo_id, int(time.time()) - 30 * 86400)
+	kept = stats(db)
+	db.rebuild_repository_stats()
+	assert kept == stats(db)
+	return kept
+
+
+def test_counts_match_rebuild(db, repo_id):
+	other_repo_id = add_repository(db, url="http://other.example/oai", name="Other Repository")
+	repo_ids = [repo_id, other_repo_id]
+	records = make_records(50)
+	identifiers = [record["identifier"] for record, domain_metadata in records]
+
+	db.write_records(records, repo_id, "oai_dc")
+	db.write_records(make_records(20, start=100), other_repo_id, "oai_dc")
+	# A header is written without a timestamp, so it is stale until its record is fetched
+	db.write_header("oai:test:header", repo_id)
+	assert assert_matches_rebuild(db, repo_ids) == [(repo_id, 51, 0, 1), (other_repo_id, 20, 0, 0)]
+
+	# Some records go stale
+	con = db.getConnection()
+	with con:
+		con.execute("UPDATE records SET modified_timestamp = ? WHERE repository_id = ? AND local_identifier IN ('oai:test:1', 'oai:test:2')",
+			(int(time.time()) - 60 * 86400, repo_id))
+	assert assert_matches_rebuild(db, repo_ids)[0] == (repo_id, 51, 0, 3)
+
+	db.reconcile_records(repo_id, identifiers[:40])
+	assert_matches_rebuild(db, repo_ids)
+
+	# Deleted records come back, and more are deleted, by identifier and one at a time
+	db.write_records(make_records(50)[40:45], repo_id, "oai_dc")
+	db.delete_records_by_identifier(other_repo_id, ["oai:test:100", "oai:test:101", "oai:test:unknown"])
+	db.delete_record(con.execute("SELECT record_id, local_identifier FROM records WHERE local_identifier = 'oai:test:0'").fetchone())
+	assert assert_matches_rebuild(db, repo_ids) == [(repo_id, 44, 7, 2), (other_repo_id, 18, 2, 0)]
+
+	# Deleting what is already deleted changes nothing
+	db.delete_records_by_identifier(other_repo_id, ["oai:test:100"])
+	db.reconcile_records(repo_id, identifiers[:40])
+	assert assert_matches_rebuild(db, repo_ids) == [(repo_id, 39, 12, 2), (other_repo_id, 18, 2, 0)]
+	assert db.logger.errors() == []
+
+
+def test_migration_fills_the_summary(tmp_path, logger):
+	# A database from before the summary existed, with ten records and two deleted ones
+	dbname = str(tmp_path / "baseline.db")
+	con = sqlite3.connect(dbname)
+	with open(os.path.join(ROOT, "tests", "golden", "baseline.sql")) as f:
+		con.executescript(f.read())
+	con.close()
+	db = DBInterface({"type": "sqlite", "dbname": dbname})
+	db.setLogger(logger)
+
+	kept = stats(db)
+	assert [row[:3] for row in kept] == [(1, 10, 2)]
+	db.rebuild_repository_stats()
+	assert stats(db) == kept
+
+
+def test_repository_without_a_summary_row_is_counted_without_writing(db, repo_id):
+	db.write_records(make_records(10), repo_id, "oai_dc")
+	db.delete_records([row[0] for row in db.getConnection().execute("SELECT record_id FROM records WHERE local_identifier = 'oai:test:0'")])
+	con = db.getConnection()
+	with con:
+		con.execute("DELETE FROM repository_stats")
+
+	repos = db.get_repositories()
+	assert [(repo["repository_id"], repo["item_count"], repo["deleted_count"], repo["stale_count"]) for repo in repos] == [(repo_id, 9, 1, 0)]
+	assert stats(db) == []